@@ -0,0 +1,228 @@
+"""
+Benchmark the build and load cost of the generated artifacts.
+
+Generate device profiles of increasing size, translate them,
+then record, for each profile size and translation variant:
+    - the translation time,
+    - the size of the generated nftables script and C source code,
+    - the time to compile the C source code, and the size of the resulting object files,
+    - the time for `nft -c -f` to check the nftables script, if `nft` is available.
+
+The C source code includes the headers of the NFQueue and parsers libraries,
+which must be given with the `-I` option for the compilation to succeed.
+
+Usage (with the package installed):
+    python3 benchmarks/bench_artifacts.py -s 10 100 1000 -I /path/to/include -o bench_output.txt
+"""
+
+import os
+import sys
+import csv
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import yaml
+from profile_translator_blocklist import translate_profile
+from profile_translator_blocklist.profile_generator import generate_profile
+
+
+### VARIABLES ###
+
+# Translation variants to compare, with the corresponding translation arguments
+variants = {
+    "default": {},
+    "split": {"split_sources": True},
+    "sets": {"merge_sets": True},
+    "vmaps": {"verdict_maps": True},
+    "tree": {"chain_tree": True}
+}
+
+# Output columns
+columns = [
+    "variant",
+    "policies",
+    "nft_rules",
+    "nft_bytes",
+    "c_files",
+    "c_bytes",
+    "translate_s",
+    "compile_s",
+    "object_bytes",
+    "nft_check_s"
+]
+
+
+### FUNCTIONS ###
+
+def count_nft_rules(nft_path: str) -> int:
+    """
+    Count the rules in an nftables script.
+
+    Args:
+        nft_path (str): path to the nftables script
+    Returns:
+        int: number of rules in the script
+    """
+    count = 0
+    with open(nft_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if ( not line or line.startswith("#") or line.endswith("{") or line == "}"
+                 or line.startswith("type ") or line.startswith("policy ") ):
+                continue
+            count += 1
+    return count
+
+
+def compile_source(c_file: str, compiler: str, cflags: list, include_dirs: list) -> int:
+    """
+    Compile a single C source file to an object file.
+
+    Args:
+        c_file (str): path to the C source file
+        compiler (str): C compiler command
+        cflags (list): additional compiler flags
+        include_dirs (list): directories to search for headers
+    Returns:
+        int: size of the resulting object file, in bytes,
+             or None if the compilation failed
+    """
+    object_file = os.path.splitext(c_file)[0] + ".o"
+    cmd = [compiler, "-c", c_file, "-o", object_file] + cflags + [f"-I{d}" for d in include_dirs]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        first_error = next((l for l in result.stderr.splitlines() if "error" in l), result.stderr.strip())
+        print(f"Compilation of {os.path.basename(c_file)} failed: {first_error}", file=sys.stderr)
+        return None
+    return os.path.getsize(object_file)
+
+
+def compile_sources(c_files: list, compiler: str, cflags: list, include_dirs: list, jobs: int = 1) -> tuple:
+    """
+    Compile the given C source files to object files,
+    with up to `jobs` compiler processes in parallel, like `make -j`.
+
+    Args:
+        c_files (list): paths to the C source files
+        compiler (str): C compiler command
+        cflags (list): additional compiler flags
+        include_dirs (list): directories to search for headers
+        jobs (int): maximum number of parallel compiler processes
+    Returns:
+        tuple: compilation wall-clock time, in seconds, and total object size, in bytes,
+               or (None, None) if the compilation failed
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        object_sizes = list(executor.map(lambda c_file: compile_source(c_file, compiler, cflags, include_dirs), c_files))
+    elapsed = time.perf_counter() - start
+    if None in object_sizes:
+        return None, None
+    return elapsed, sum(object_sizes)
+
+
+def check_nft(nft_path: str) -> float:
+    """
+    Check an nftables script with `nft -c -f`, without applying it.
+
+    Args:
+        nft_path (str): path to the nftables script
+    Returns:
+        float: check time, in seconds,
+               or None if `nft` is not available or the check failed
+    """
+    nft = shutil.which("nft")
+    if nft is None:
+        return None
+    start = time.perf_counter()
+    result = subprocess.run([nft, "-c", "-f", nft_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        print(f"nft check of {nft_path} failed: {result.stderr.strip()}", file=sys.stderr)
+        return None
+    return elapsed
+
+
+def bench(num_policies: int, variant: str, work_dir: str, compiler: str, cflags: list, include_dirs: list, jobs: int = 1) -> dict:
+    """
+    Benchmark the translation of a generated profile, and the build and load cost of its artifacts.
+
+    Args:
+        num_policies (int): number of policies in the generated profile
+        variant (str): name of the translation variant
+        work_dir (str): directory to write the profile and the generated files into
+        compiler (str): C compiler command
+        cflags (list): additional compiler flags
+        include_dirs (list): directories to search for headers
+        jobs (int): maximum number of parallel compiler processes
+    Returns:
+        dict: benchmark results, keyed by column name
+    """
+    # Write generated profile
+    output_dir = os.path.join(work_dir, f"{variant}-{num_policies}")
+    os.makedirs(output_dir, exist_ok=True)
+    profile_path = os.path.join(output_dir, "profile.yaml")
+    with open(profile_path, "w") as f:
+        yaml.dump(generate_profile(num_policies), f, default_flow_style=False)
+
+    # Translate profile
+    start = time.perf_counter()
+    translate_profile(profile_path, output_dir=output_dir, **variants[variant])
+    translate_s = time.perf_counter() - start
+
+    # Generated artifacts
+    nft_path = os.path.join(output_dir, "firewall.nft")
+    c_files = sorted(glob.glob(os.path.join(output_dir, "*.c")))
+    compile_s, object_bytes = compile_sources(c_files, compiler, cflags, include_dirs, jobs) if c_files else (0.0, 0)
+
+    return {
+        "variant": variant,
+        "policies": num_policies,
+        "nft_rules": count_nft_rules(nft_path),
+        "nft_bytes": os.path.getsize(nft_path),
+        "c_files": len(c_files),
+        "c_bytes": sum(os.path.getsize(c_file) for c_file in c_files),
+        "translate_s": translate_s,
+        "compile_s": compile_s,
+        "object_bytes": object_bytes,
+        "nft_check_s": check_nft(nft_path)
+    }
+
+
+##### MAIN #####
+if __name__ == "__main__":
+
+    # Command line arguments
+    description = "Benchmark the build and load cost of the generated nftables and C artifacts."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Numbers of policies of the generated profiles")
+    parser.add_argument("-v", "--variants", type=str, nargs="+", choices=list(variants.keys()), default=list(variants.keys()), help="Translation variants to benchmark")
+    parser.add_argument("-c", "--compiler", type=str, default="gcc", help="C compiler command")
+    parser.add_argument("-f", "--cflags", type=str, default="-O2", help="Additional compiler flags")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Maximum number of parallel compiler processes, like make -j")
+    parser.add_argument("-I", "--include-dir", type=str, action="append", default=[], help="Directory to search for headers (can be repeated)")
+    parser.add_argument("-w", "--work-dir", type=str, default=None, help="Directory to write the generated files into (default: temporary directory)")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Output CSV file (default: standard output)")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix="bench-artifacts-")
+    cflags = args.cflags.split()
+
+    # Run benchmarks
+    results = []
+    for variant in args.variants:
+        for num_policies in args.sizes:
+            results.append(bench(num_policies, variant, work_dir, args.compiler, cflags, args.include_dir, args.jobs))
+
+    # Write results
+    f = open(args.output, "w", newline="") if args.output is not None else sys.stdout
+    writer = csv.DictWriter(f, fieldnames=columns)
+    writer.writeheader()
+    for result in results:
+        writer.writerow({k: (f"{v:.4f}" if isinstance(v, float) else v) for k, v in result.items()})
+    if f is not sys.stdout:
+        f.close()
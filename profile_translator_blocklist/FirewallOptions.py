@@ -0,0 +1,79 @@
+from typing import Any
+from dataclasses import dataclass
+from .RateLimitType import RateLimitType
+
+
+@dataclass
+class FirewallOptions:
+    """
+    Options of the generated nftables firewall and NFQueue C source code,
+    shared by the translation functions of module `translator`.
+
+    Attributes:
+        test (bool): Test mode: use VM instead of router
+        split_sources (bool): Split the NFQueue C source code into a shared header `nfqueues.h`,
+                              one file `callback_<nfqueue>.c` per NFQueue, and `main.c`,
+                              instead of a single file `nfqueues.c`
+        merge_sets (bool): Merge the kernel-only rules which only differ in the value of one match
+                           into a single rule matching an anonymous or named set
+        verdict_maps (bool): Replace the rules matching exact values of the same fields
+                             by a single verdict map rule on the concatenation of these fields
+        chain_tree (bool): Factor the matches shared by rules (protocol family, layer 4 protocol, device address)
+                           into jump rules to sub-chains, to reduce the number of rules evaluated per packet
+        device_guard (bool): Skip the unicast traffic which does not involve the device's MAC address,
+                             at the top of the chain, if all policies involve the device
+                             (only supported by bridge and netdev hooks, which see the Ethernet header)
+        ct_marks (bool): Cache the DROP verdicts given in user space in the connections' conntrack marks,
+                         and drop the dropped connections in the kernel, at the top of the chain
+                         (ACCEPT verdicts are not cached, as each message of a connection must be checked)
+        offload (bool): Offload the established flows which need no further inspection
+                        to a flowtable on `flowtable_devices`, in a separate inet table.
+                        Flows are offloaded from the forward hook, which only sees routed traffic:
+                        bridged flows, e.g. between two LAN devices, are never offloaded.
+        flowtable_devices (list): Network interfaces of the flowtable, required by `offload`
+        rate_limits (RateLimitType): Type of rate limits to be used:
+                                     anonymous limits (INLINE), named limit objects (NAMED),
+                                     or per-source meters keyed on the packets' source address (SOURCE)
+        counters (bool): Add a named counter to the rule of each NFQueue,
+                         and write the names of the policies counted by each counter to `counters.json`
+        hit_stats (Any): Hit statistics of the rules, to evaluate the most matched rules first,
+                         only moving rules which cannot match the same packets:
+                         values of the named counters, by counter name, or as returned by `counter_scraper.read_counters`
+                         (only the counters of the device's table are used),
+                         or path to a pcap file of the device's traffic or to the output of `nft -j list counters`
+        copy_ranges (bool): Only copy to user space the bytes of the packets read by each NFQueue's callback,
+                            i.e. the IPv4 and transport headers for the NFQueues without custom parser,
+                            instead of the whole packets
+        ct_directions (bool): Merge the kernel-only rules matching both directions of the same flows,
+                              e.g. the rules of both directions of a bidirectional policy,
+                              into a single rule matching the flows' conntrack original tuple against both orientations
+        notrack (bool): Skip connection tracking, in a chain at raw priority,
+                        for the multicast and broadcast traffic whose verdict does not depend on conntrack
+        hook (dict): Hook of the base chain, overriding the device's `hook` setting and the default hook of the mode,
+                     with keys "family", "hook", "priority" and "device"
+        early_drop (str): Network interface of the device's port, to drop the traffic sent by the device
+                          at netdev ingress on this interface, before bridge processing (no early drop if None)
+        remove_redundant (bool): Remove the rules which never change the verdict of a packet,
+                                 as all their packets are matched by another rule with the same verdict,
+                                 and log the removed rules
+        json_output (bool): Also write the firewall in the JSON format of libnftables to `firewall.json`
+    """
+    test:              bool          = False
+    split_sources:     bool          = False
+    merge_sets:        bool          = False
+    verdict_maps:      bool          = False
+    chain_tree:        bool          = False
+    device_guard:      bool          = False
+    ct_marks:          bool          = False
+    offload:           bool          = False
+    flowtable_devices: list          = None
+    rate_limits:       RateLimitType = RateLimitType.INLINE
+    counters:          bool          = False
+    hit_stats:         Any           = None
+    copy_ranges:       bool          = False
+    ct_directions:     bool          = False
+    notrack:           bool          = False
+    hook:              dict          = None
+    early_drop:        str           = None
+    remove_redundant:  bool          = False
+    json_output:       bool          = False
@@ -2,6 +2,8 @@ import re
 from copy import deepcopy
 from .LogType import LogType
 from .Policy import Policy
+from .nft_utils import get_random_verdict
+from .nft_json import get_matches_json, get_random_verdict_json
 
 
 class NFQueue:
@@ -18,8 +20,22 @@ class NFQueue:
         "week":   60 * 60 * 24 * 7
     }
 
+    # Maximum length of the network headers, by nftables protocol.
+    # IPv6 headers have no maximum length, as they can be followed by any number of extension headers.
+    ip_header_lengths = {
+        "ip": 60  # IPv4, with options
+    }
+
+    # Maximum length of the transport headers, by nftables protocol.
+    # Packets of other or unknown transport protocols are copied up to the longest of these headers.
+    l4_header_lengths = {
+        "tcp":  60,  # With options
+        "udp":  8,
+        "icmp": 8
+    }
+
 
-    def __init__(self, name: str, nft_matches: list, queue_num: int = -1) -> None:
+    def __init__(self, name: str, nft_matches: list, queue_num: int = -1, workers: int = 1) -> None:
         """
         Initialize a new NFQueue object.
 
@@ -27,12 +43,16 @@ class NFQueue:
         :param nft_matches: list of nftables matches corresponding to this queue
         :param queue_num: number of the nfqueue queue corresponding to this policy,
                           or a negative number if the policy is simply `drop`
+        :param workers: number of threads reading this nfqueue,
+                        each one from its own queue, starting at `queue_num`
         """
         self.name = name            # Descriptive name for this nfqueue (name of the first policy to be added)
         self.queue_num = queue_num  # Number of the corresponding nfqueue
+        self.workers = workers      # Number of threads, and consecutive queues, of this nfqueue
         self.policies = []          # List of policies associated to this nfqueue
         self.nft_matches = deepcopy(nft_matches)  # List of nftables matches associated to this nfqueue
         self.nft_stats = {}
+        self.counter = None         # Name of the nftables counter object of this nfqueue's rule, if any
     
 
     def __eq__(self, other: object) -> bool:
@@ -44,12 +64,9 @@ class NFQueue:
         """
         if not isinstance(other, self.__class__):
             return NotImplemented
-        key_func = lambda x: x["template"].format(x["match"])
-        self_matches = sorted(self.nft_matches, key=key_func)
-        other_matches = sorted(other.nft_matches, key=key_func)
         return ( self.name == other.name and
                  self.queue_num == other.queue_num and
-                 self_matches == other_matches )
+                 NFQueue.get_matches_key(self.nft_matches) == NFQueue.get_matches_key(other.nft_matches) )
     
 
     def get_name_slug(self) -> str:
@@ -67,6 +84,64 @@ class NFQueue:
         return name
     
 
+    def get_queue_settings(self) -> dict:
+        """
+        Get the overload protection settings of this nfqueue, combined from its policies' settings:
+        the queue is bypassed or fails open if any policy requires it,
+        and its maximum length is the largest one required.
+
+        :return: dictionary with keys "bypass", "maxlen" and "fail-open"
+        """
+        settings = {"bypass": False, "maxlen": None, "fail-open": False}
+        for policy_dict in self.policies:
+            policy_settings = policy_dict["policy"].queue_settings
+            settings["bypass"] = settings["bypass"] or bool(policy_settings.get("bypass", False))
+            settings["fail-open"] = settings["fail-open"] or bool(policy_settings.get("fail-open", False))
+            maxlen = policy_settings.get("maxlen", None)
+            if maxlen is not None:
+                settings["maxlen"] = max(int(maxlen), settings["maxlen"] or 0)
+        return settings
+    
+
+    def get_copy_range(self) -> int:
+        """
+        Get the number of bytes of the packets to copy to user space for this nfqueue,
+        i.e. the maximum length of the headers read by its callback,
+        given the IP version and the transport protocol matched by its rule.
+        Callbacks with a custom parser read whole application messages, without bound on their length
+        (e.g. DNS queries with EDNS options), hence need the whole packets,
+        as do packets whose IP version is unknown, or IPv6 packets, whose headers have no maximum length.
+
+        :return: number of bytes to copy, from the start of the IP header,
+                 or None if the whole packets must be copied
+        """
+        if any(policy_dict["policy"].custom_parser for policy_dict in self.policies):
+            return None
+
+        # Network and transport protocols matched by the rule
+        ip_protocols = set()
+        l4_protocols = set()
+        for nft_match in self.nft_matches:
+            words = nft_match["template"].split()
+            if words[:2] == ["meta", "nfproto"]:
+                ip_protocols.add({"ipv4": "ip", "ipv6": "ip6"}.get(str(nft_match["match"]), None))
+            elif words[:2] == ["meta", "l4proto"]:
+                l4_protocols.add(str(nft_match["match"]))
+            elif words[0] in ["ip", "ip6"]:
+                ip_protocols.add(words[0])
+            elif words[0] in NFQueue.l4_header_lengths:
+                l4_protocols.add(words[0])
+
+        if len(ip_protocols) != 1 or not ip_protocols <= NFQueue.ip_header_lengths.keys():
+            return None
+        ip_header_length = NFQueue.ip_header_lengths[ip_protocols.pop()]
+        if len(l4_protocols) == 1 and l4_protocols <= NFQueue.l4_header_lengths.keys():
+            l4_header_length = NFQueue.l4_header_lengths[l4_protocols.pop()]
+        else:
+            l4_header_length = max(NFQueue.l4_header_lengths.values())
+        return ip_header_length + l4_header_length
+    
+
     def contains_policy_matches(self, policy: Policy) -> bool:
         """
         Check if this NFQueue object contains the nftables matches of the given policy.
@@ -74,10 +149,20 @@ class NFQueue:
         :param policy: policy to check
         :return: True if this NFQueue object contains the nftables matches of the given policy, False otherwise
         """
-        key_func = lambda x: x["template"].format(x["match"])
-        policy_matches = sorted(policy.nft_matches, key=key_func)
-        self_matches = sorted(self.nft_matches, key=key_func)
-        return policy_matches == self_matches
+        return NFQueue.get_matches_key(policy.nft_matches) == NFQueue.get_matches_key(self.nft_matches)
+
+
+    @staticmethod
+    def get_matches_key(nft_matches: list) -> tuple:
+        """
+        Compute a hashable key identifying a list of nftables matches, regardless of their order.
+        Two lists of nftables matches have the same key if and only if they render the same nftables matches,
+        as compared by `__eq__`, e.g. a port given as `80` or `"80"`.
+
+        :param nft_matches: list of nftables matches
+        :return: hashable key for the given nftables matches
+        """
+        return tuple(sorted(nft_match["template"].format(nft_match["match"]) for nft_match in nft_matches))
     
 
     @staticmethod
@@ -191,18 +276,36 @@ class NFQueue:
         self.nft_stats["packet-size"]["match"] = new_match
     
 
-    def update_match(self, stat: str, new_match: str):
+    def update_duration_match(self, new_stat: dict):
+        """
+        Update the duration NFTables match for this NFQueue object, if needed.
+        The policies of an NFQueue share the same nftables match, hence start their timers on the same connections:
+        the rule checks the timer set with the longest timeout.
+
+        :param new_stat: new duration stat to be compared to the current one,
+                         with keys "template", "match" (name of the timer set) and "timeout"
+        """
+        if new_stat["timeout"] > self.nft_stats["duration"]["timeout"]:
+            self.nft_stats["duration"] = new_stat
+
+
+    def update_match(self, stat: str, new_stat: dict):
         """
         Update the match for the given stat, if needed.
         Stat match is set to the least restrictive match between the current and the new one.
         
         :param stat: name of the stat to update
-        :param new_match: new match to set, if needed
+        :param new_stat: new stat, with keys "template" and "match", to set if needed
         """
+        new_match = new_stat["match"]
         if stat == "rate":
             self.update_rate_match(new_match)
         elif stat == "packet-size":
             self.update_size_match(new_match)
+        elif stat == "packet-count":
+            self.nft_stats[stat]["match"] = max(int(self.nft_stats[stat]["match"]), int(new_match))
+        elif stat == "duration":
+            self.update_duration_match(new_stat)
 
 
     def add_policy(self, policy: Policy) -> bool:
@@ -231,13 +334,14 @@ class NFQueue:
             if stat not in self.nft_stats:
                 self.nft_stats[stat] = data
             else:
-                self.update_match(stat, data["match"])
-
-        # Append policy to the list of policies
-        self.policies.append(policy_dict)
-        # Sort list of policies, with default drop policies at the end
-        sort_key = lambda x: (x["policy"])
-        self.policies.sort(key=sort_key)
+                self.update_match(stat, data)
+
+        # Insert policy in the sorted list of policies, with default drop policies at the end.
+        # Policies are mostly added in order, so scanning from the end is usually constant time.
+        idx = len(self.policies)
+        while idx > 0 and policy < self.policies[idx - 1]["policy"]:
+            idx -= 1
+        self.policies.insert(idx, policy_dict)
         return result
 
 
@@ -255,12 +359,25 @@ class NFQueue:
         for stat in self.nft_stats.values():
             if stat["match"] != 0:
                 nft_rule += stat["template"].format(stat["match"]) + " "
+        if self.counter is not None:
+            nft_rule += f"counter name \"{self.counter}\" "
         
         # Set NFT rule action and log verdict (queue, drop, accept)
         nft_action = ""
         verdict = ""
         if self.queue_num >= 0:
-            nft_action = f"queue num {self.queue_num}"
+            queue_flags = []
+            if self.get_queue_settings()["bypass"]:
+                # Packets are accepted if no program listens to the queue
+                queue_flags.append("bypass")
+            if self.workers > 1:
+                # Packets are spread over the workers' queues, by flow
+                nft_action = f"queue num {self.queue_num}-{self.queue_num + self.workers - 1}"
+                queue_flags.append("fanout")
+            else:
+                nft_action = f"queue num {self.queue_num}"
+            if queue_flags:
+                nft_action += " " + ",".join(queue_flags)
             verdict = "QUEUE"
         elif drop_proba == 1.0:
             nft_action = "drop"
@@ -268,6 +385,9 @@ class NFQueue:
         elif drop_proba == 0.0:
             nft_action = "accept"
             verdict = "ACCEPT"
+        else:
+            nft_action = get_random_verdict(drop_proba)
+            verdict = "RANDOM"
 
         # Set full NFT action, including logging (if specified)
         if log_type == LogType.CSV:
@@ -278,3 +398,48 @@ class NFQueue:
             return f"{nft_rule}{log} {nft_action}"
         else:
             return f"{nft_rule}{nft_action}"
+
+
+    def get_nft_json(self, drop_proba: float = 1.0, log_type: LogType = LogType.NONE, log_group: int = 100) -> list:
+        """
+        Retrieve the complete nftables rule for this nfqueue,
+        as a list of libnftables JSON statements, equivalent to `get_nft_rule`.
+
+        :return: JSON statements of the nftables rule for this nfqueue
+        """
+        # Set NFT rule match
+        statements = get_matches_json(self.nft_matches)
+        statements += get_matches_json([stat for stat in self.nft_stats.values() if stat["match"] != 0])
+        if self.counter is not None:
+            statements.append({"counter": self.counter})
+
+        # Set NFT rule action and log verdict (queue, drop, accept)
+        if self.queue_num >= 0:
+            queue = {"num": self.queue_num}
+            if self.workers > 1:
+                queue["num"] = {"range": [self.queue_num, self.queue_num + self.workers - 1]}
+            queue_flags = []
+            if self.get_queue_settings()["bypass"]:
+                queue_flags.append("bypass")
+            if self.workers > 1:
+                queue_flags.append("fanout")
+            if queue_flags:
+                queue["flags"] = queue_flags
+            nft_action = [{"queue": queue}]
+            verdict = "QUEUE"
+        elif drop_proba == 1.0:
+            nft_action = [{"drop": None}]
+            verdict = "DROP"
+        elif drop_proba == 0.0:
+            nft_action = [{"accept": None}]
+            verdict = "ACCEPT"
+        else:
+            nft_action = [get_random_verdict_json(drop_proba)]
+            verdict = "RANDOM"
+
+        # Set full NFT action, including logging (if specified)
+        if log_type == LogType.CSV:
+            statements.append({"log": {"prefix": f"{self.name},,{verdict}", "group": log_group}})
+        elif log_type == LogType.PCAP:
+            statements.append({"log": {"group": log_group}})
+        return statements + nft_action
@@ -1,10 +1,12 @@
 ## Import packages
 from __future__ import annotations
 from enum import Enum
-from typing import Tuple, Dict
+from typing import Any, Tuple, Dict
+import re
 import ipaddress
 ## Custom libraries
 from .LogType import LogType
+from .nft_utils import get_random_verdict
 # Protocol translators
 from .protocols.Protocol import Protocol
 from .protocols.ip import ip
@@ -31,11 +33,25 @@ class Policy:
         ACTION = 2
 
     # Metadata for supported nftables statistics
+    # Counter templates can depend on the counter direction ("default", "fwd" or "bwd")
     stats_metadata = {
         "rate": {"nft_type": NftType.MATCH, "counter": False, "template": "limit rate over {}"},
         "packet-size": {"nft_type": NftType.MATCH, "counter": False, "template": "ip length {}"},
-        "packet-count": {"counter": True},
-        "duration": {"counter": True}
+        "packet-count": {"nft_type": NftType.MATCH, "counter": True, "template": {
+            "default": "ct packets > {}",
+            "fwd":     "ct original packets > {}",
+            "bwd":     "ct reply packets > {}"
+        }},
+        "duration": {"nft_type": NftType.MATCH, "counter": True, "template": "ct state != new ct id != @{}"}
+    }
+
+    # Duration units, in seconds
+    time_units = {
+        "s": 1,
+        "m": 60,
+        "h": 60 * 60,
+        "d": 60 * 60 * 24,
+        "w": 60 * 60 * 24 * 7
     }
 
 
@@ -58,15 +74,18 @@ class Policy:
         self.queue_num = -1                       # Number of the corresponding NFQueue (will be updated by parsing)
         self.nft_action = ""                      # nftables action associated to this policy
         self.nfq_matches = []                     # List of nfqueue matches (will be populated by parsing)
+        self.counters = {}                        # Dict of counter statistics, by direction (will be populated by parsing)
+        self.is_device = False                    # Whether the device's addresses are involved in the policy (will be updated by parsing)
         self.profile_data = profile_data          # Policy data from the YAML profile
         self.initiator = profile_data["initiator"] if "initiator" in profile_data else ""
+        self.queue_settings = dict(profile_data.get("queue", {}))  # Overload protection settings of the policy's NFQueue
+
+        # Set policy name, used to name the policy's counters
+        self.name = policy_name if policy_name is not None else self.get_name()
 
         # Parse policy data
         self.parse()
 
-        # Set policy name
-        self.name = policy_name if policy_name is not None else self.get_name()
-
     
     def parse(self) -> None:
         """
@@ -213,10 +232,57 @@ class Policy:
         return Policy.get_field_static(self.profile_data, field, self.name)
 
     
+    @staticmethod
+    def parse_duration(duration: Any) -> int:
+        """
+        Parse a duration, given either as a number of seconds or as a string with a unit,
+        e.g. `90`, `30s`, `5m`, `2h`, `1d` or `1w`.
+
+        :param duration: duration to parse
+        :return: duration, in seconds
+        :raises ValueError: if the duration could not be parsed
+        """
+        if isinstance(duration, (int, float)):
+            return int(duration)
+        match = re.fullmatch(r"\s*(?P<value>\d+(\.\d+)?)\s*(?P<unit>[smhdw]?)\w*\s*", str(duration))
+        if match is None:
+            raise ValueError(f"Invalid duration: {duration}")
+        unit = Policy.time_units[match.group("unit")] if match.group("unit") else 1
+        return int(float(match.group("value")) * unit)
+
+
+    def get_base_name(self) -> str:
+        """
+        Get the name of the forward policy this policy is linked to,
+        i.e. this policy's name without the `-backward` suffix.
+
+        :return: name of the forward policy
+        """
+        return self.name[:-len("-backward")] if self.is_backward else self.name
+
+
+    def get_timer_name(self, direction: str = "default") -> str:
+        """
+        Get the name of the nftables set containing the connections of this policy
+        which are still within their allowed duration.
+        The set is shared by the forward and backward policies, unless durations are given per direction.
+
+        :param direction: counter direction ("default", "fwd" or "bwd")
+        :return: name of the nftables set
+        """
+        name = f"{self.device.get('name', '')}_{self.get_base_name()}_duration"
+        if direction != "default":
+            name += f"_{direction}"
+        return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
     def parse_stat(self, stat: str) -> Dict[str, str]:
         """
         Parse a single statistic.
         Add the corresponding counters and nftables matches.
+        Counters are enforced in the kernel:
+        packet counts with the connection's conntrack packet counter,
+        and durations with a set of the connections within their allowed duration.
 
         :param stat: Statistic to handle
         :return: parsed stat, with the form {"template": ..., "match": ...}
@@ -233,22 +299,24 @@ class Policy:
                     "fwd": value_fwd,
                     "bwd": value_bwd
                 }
-            if stat in Policy.stats_metadata and "template" in Policy.stats_metadata[stat]:
-                parsed_stat = {
-                    "template": Policy.stats_metadata[stat]["template"],
-                    "match": value_bwd if self.is_backward else value_fwd,
-                }
+            direction = "bwd" if self.is_backward else "fwd"
+            value = value_bwd if self.is_backward else value_fwd
         else:
             # Stat is a single value, which is used for both directions
             if Policy.stats_metadata[stat]["counter"]:
                 value = Policy.parse_duration(value) if stat == "duration" else value
                 self.counters[stat] = {"default": value}
-                value = f"\"{self.name[:-len('-backward')] if self.is_backward else self.name}\""
-            if stat in Policy.stats_metadata and "template" in Policy.stats_metadata[stat]:
-                parsed_stat = {
-                    "template": Policy.stats_metadata[stat]["template"],
-                    "match": value
-                }
+            direction = "default"
+
+        if stat in Policy.stats_metadata and "template" in Policy.stats_metadata[stat]:
+            template = Policy.stats_metadata[stat]["template"]
+            parsed_stat = {
+                "template": template[direction] if type(template) == dict else template,
+                "match": self.get_timer_name(direction) if stat == "duration" else value
+            }
+            if stat == "duration":
+                # Timeout of the timer set, to merge the durations of the policies sharing an NFQueue
+                parsed_stat["timeout"] = value
         
         if parsed_stat is not None and "nft_type" in Policy.stats_metadata[stat]:
             self.nft_stats[stat] = parsed_stat
@@ -260,7 +328,7 @@ class Policy:
 
         :param queue_num: number of the nfqueue queue corresponding to this policy,
                           or a negative number if the policy is simply `drop`
-        :param rate: rate limit, in packets/second, for this policy
+        :param drop_proba: dropping probability, given in the kernel if the policy has no nfqueue
         :param log_type: type of logging to enable
         :param log_group: log group number
         :return: complete nftables rule for this policy
@@ -298,6 +366,8 @@ class Policy:
             verdict = "DROP"
         elif drop_proba == 0.0:
             verdict = "ACCEPT"
+        else:
+            verdict = "RANDOM"
         if log_type == LogType.CSV:
             self.nft_action += f"log prefix \\\"{self.name},,{verdict}\\\" group {log_group} "
         elif log_type == LogType.PCAP:
@@ -310,6 +380,8 @@ class Policy:
             self.nft_action += "drop"
         elif drop_proba == 0.0:
             self.nft_action += "accept"
+        else:
+            self.nft_action += get_random_verdict(drop_proba)
 
         return self.get_nft_rule()
 
@@ -354,23 +426,38 @@ class Policy:
                     for host in addr:
                         if ip.is_ip_static(host, protocol):
                             # Host is an explicit or well-known address
-                            if match not in result:
-                                result[match] = {}
-                            result[match]["ip_addresses"] = result[match].get("ip_addresses", []) + [host]
+                            result.setdefault(match, {}).setdefault("ip_addresses", []).append(host)
                         else:
                             # Address is not explicit or well-known, might be a domain name
-                            if match not in result:
-                                result[match] = {}
-                            result[match]["domain_names"] = result[match].get("domain_names", []) + [host]
+                            result.setdefault(match, {}).setdefault("domain_names", []).append(host)
                 else:
                     # Field is a single host
-                    if match not in result:
-                        result[match] = {}
-                    result[match]["domain_names"] = result[match].get("domain_names", []) + [addr]
+                    result.setdefault(match, {}).setdefault("domain_names", []).append(addr)
         protocol = "ip" if protocol == "ipv4" else "ip6"
         return protocol, result
 
 
+    def get_nft_timers(self) -> list:
+        """
+        Retrieve the timers of this policy's duration counter,
+        which are started on the first packet of the policy's connections.
+        Only the forward policy starts timers, for both directions.
+
+        :return: list of timers, as dictionaries with keys
+                 "name" (name of the nftables set containing the connections within their allowed duration),
+                 "timeout" (allowed duration, in seconds),
+                 "nft_match" (nftables match of the connections' first packet),
+                 and "nft_matches" (list of the nftables matches composing it)
+        """
+        if "duration" not in self.counters or self.is_backward:
+            return []
+        nft_match = " ".join(nft_match["template"].format(nft_match["match"]) for nft_match in self.nft_matches)
+        return [
+            {"name": self.get_timer_name(direction), "timeout": timeout, "nft_match": nft_match, "nft_matches": list(self.nft_matches)}
+            for direction, timeout in self.counters["duration"].items()
+        ]
+
+
     def is_base_for_counter(self, counter: str):
         """
         Check if the policy is the base policy for a given counter.
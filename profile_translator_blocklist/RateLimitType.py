@@ -0,0 +1,12 @@
+from enum import IntEnum
+
+class RateLimitType(IntEnum):
+    """
+    Enum class for the type of rate limits to be used.
+    """
+    INLINE = 0  # Anonymous limit, shared by all packets matching the rule
+    NAMED  = 1  # Named limit object, shared by all packets matching the rule
+    SOURCE = 2  # Per-source meter, with one limit per source host
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,44 @@
+from .LogType import LogType
+from .nft_json import get_match_json
+
+
+class SubChain:
+    """
+    Class which represents a regular nftables chain,
+    containing the rules which share a common match, e.g. `meta l4proto tcp`,
+    and the rule jumping to it from its parent chain.
+    Packets which match none of the chain's rules return to the parent chain, after the jump rule.
+    """
+
+    def __init__(self, name: str, nft_match: dict, rules: list = []) -> None:
+        """
+        Initialize a new SubChain object.
+
+        :param name: name of the chain
+        :param nft_match: nftables match common to the chain's rules, with the form {"template": ..., "match": ...}
+        :param rules: rules of the chain, in order (NFQueue, VerdictMap or SubChain objects)
+        """
+        self.name = name                # Name of this chain
+        self.nft_match = nft_match      # Match common to this chain's rules, checked by the jump rule
+        self.rules = list(rules)        # Rules of this chain, in order
+
+
+    def get_nft_rule(self, drop_proba: float = 1.0, log_type: LogType = LogType.NONE, log_group: int = 100) -> str:
+        """
+        Retrieve the nftables rule jumping to this chain from its parent chain.
+        The arguments are ignored, and only accepted for compatibility with `NFQueue.get_nft_rule`.
+
+        :return: nftables rule jumping to this chain
+        """
+        return f"{self.nft_match['template'].format(self.nft_match['match'])} jump {self.name}"
+
+
+    def get_nft_json(self, drop_proba: float = 1.0, log_type: LogType = LogType.NONE, log_group: int = 100) -> list:
+        """
+        Retrieve the nftables rule jumping to this chain from its parent chain,
+        as a list of libnftables JSON statements, equivalent to `get_nft_rule`.
+        The arguments are ignored, and only accepted for compatibility with `NFQueue.get_nft_json`.
+
+        :return: JSON statements of the nftables rule jumping to this chain
+        """
+        return get_match_json(self.nft_match) + [{"jump": {"target": self.name}}]
@@ -0,0 +1,165 @@
+from __future__ import annotations
+from bisect import bisect_right
+
+
+class ValueSet:
+    """
+    Class which represents the set of values matched by an nftables match,
+    e.g. `ip daddr { 192.168.1.0/24, 10.0.0.1 }` or `tcp dport 1000-2000`.
+
+    Values are stored as a sorted list of disjoint, non-adjacent closed integer intervals,
+    which allows fast membership, inclusion and intersection tests
+    on IP prefixes and port ranges.
+    Values which are not numbers (e.g. ICMP types) must be mapped to integers by the caller.
+    """
+
+    def __init__(self, intervals: list = [], max_value: int = None) -> None:
+        """
+        Initialize a new ValueSet object.
+
+        :param intervals: list of closed intervals, as (lower, upper) tuples, in any order
+        :param max_value: upper bound of the value domain, used to compute complements
+        """
+        self.max_value = max_value
+        self.intervals = ValueSet.normalize(intervals)
+        self.starts = [lower for lower, _ in self.intervals]  # Interval lower bounds, for binary search
+
+
+    @staticmethod
+    def normalize(intervals: list) -> list:
+        """
+        Sort and merge overlapping or adjacent intervals.
+
+        :param intervals: list of closed intervals, as (lower, upper) tuples
+        :return: sorted list of disjoint, non-adjacent intervals
+        """
+        result = []
+        for lower, upper in sorted(intervals):
+            if result and lower <= result[-1][1] + 1:
+                if upper > result[-1][1]:
+                    result[-1] = (result[-1][0], upper)
+            else:
+                result.append((lower, upper))
+        return result
+
+
+    def __eq__(self, other: object) -> bool:
+        """
+        Check whether this ValueSet object contains the same values as another object.
+
+        :param other: object to compare to this ValueSet object
+        :return: True if the other object is a ValueSet containing the same values, False otherwise
+        """
+        if not isinstance(other, self.__class__):
+            return NotImplemented
+        return self.intervals == other.intervals
+
+
+    def __repr__(self) -> str:
+        """
+        Get a string representation of this ValueSet object.
+
+        :return: string representation of this ValueSet object
+        """
+        return f"ValueSet({self.intervals})"
+
+
+    def __len__(self) -> int:
+        """
+        Get the number of values in this ValueSet object.
+
+        :return: number of values in this ValueSet object
+        """
+        return sum(upper - lower + 1 for lower, upper in self.intervals)
+
+
+    def is_empty(self) -> bool:
+        """
+        Check whether this ValueSet object contains no value.
+
+        :return: True if this ValueSet object is empty, False otherwise
+        """
+        return not self.intervals
+
+
+    def contains_interval(self, lower: int, upper: int) -> bool:
+        """
+        Check whether this ValueSet object contains all values of a given interval.
+
+        :param lower: lower bound of the interval
+        :param upper: upper bound of the interval
+        :return: True if all values of the interval belong to this ValueSet object, False otherwise
+        """
+        idx = bisect_right(self.starts, lower) - 1
+        return idx >= 0 and self.intervals[idx][1] >= upper
+
+
+    def issubset(self, other: ValueSet) -> bool:
+        """
+        Check whether all values of this ValueSet object belong to another ValueSet object.
+
+        :param other: ValueSet object to compare to
+        :return: True if this ValueSet object is a subset of the other one, False otherwise
+        """
+        return all(other.contains_interval(lower, upper) for lower, upper in self.intervals)
+
+
+    def isdisjoint(self, other: ValueSet) -> bool:
+        """
+        Check whether this ValueSet object has no value in common with another ValueSet object.
+
+        :param other: ValueSet object to compare to
+        :return: True if the two ValueSet objects have no value in common, False otherwise
+        """
+        return self.intersection(other).is_empty()
+
+
+    def intersection(self, other: ValueSet) -> ValueSet:
+        """
+        Compute the intersection of this ValueSet object and another ValueSet object.
+
+        :param other: ValueSet object to intersect with
+        :return: new ValueSet object containing the values of both ValueSet objects
+        """
+        result = []
+        i = j = 0
+        while i < len(self.intervals) and j < len(other.intervals):
+            lower = max(self.intervals[i][0], other.intervals[j][0])
+            upper = min(self.intervals[i][1], other.intervals[j][1])
+            if lower <= upper:
+                result.append((lower, upper))
+            if self.intervals[i][1] < other.intervals[j][1]:
+                i += 1
+            else:
+                j += 1
+        return ValueSet(result, self.max_value)
+
+
+    def union(self, other: ValueSet) -> ValueSet:
+        """
+        Compute the union of this ValueSet object and another ValueSet object.
+
+        :param other: ValueSet object to unite with
+        :return: new ValueSet object containing the values of either ValueSet object
+        """
+        return ValueSet(self.intervals + other.intervals, self.max_value)
+
+
+    def complement(self) -> ValueSet:
+        """
+        Compute the complement of this ValueSet object, in its value domain.
+
+        :return: new ValueSet object containing the values of the domain which do not belong to this ValueSet object
+        :raises ValueError: if the upper bound of the value domain is unknown
+        """
+        if self.max_value is None:
+            raise ValueError("Cannot compute the complement of a ValueSet with an unbounded domain")
+        result = []
+        lower = 0
+        for start, end in self.intervals:
+            if start > lower:
+                result.append((lower, start - 1))
+            lower = end + 1
+        if lower <= self.max_value:
+            result.append((lower, self.max_value))
+        return ValueSet(result, self.max_value)
@@ -0,0 +1,68 @@
+from .LogType import LogType
+from .NFQueue import NFQueue
+from .nft_json import get_template_expression, get_match_value, get_verdict_json
+
+
+class VerdictMap:
+    """
+    Class which represents a single nftables verdict map rule,
+    e.g. `ip daddr . tcp dport vmap { 10.0.0.1 . 443 : drop, 10.0.0.2 . 80 : jump queue_10 }`,
+    which replaces the rules of multiple NFQueue objects matching exact values of the same fields.
+    """
+
+    def __init__(self, name: str, templates: list) -> None:
+        """
+        Initialize a new VerdictMap object.
+
+        :param name: descriptive name for the verdict map (name of the first NFQueue to be added)
+        :param templates: templates of the nftables matches composing the map's key
+        """
+        self.name = name                  # Descriptive name for this verdict map
+        self.templates = list(templates)  # Templates of the nftables matches composing the key
+        self.nfqueues = []                # List of NFQueue objects replaced by this verdict map
+        self.elements = []                # List of (key, verdict) pairs
+
+
+    def add_nfqueue(self, nfqueue: NFQueue, verdict: str) -> None:
+        """
+        Add an NFQueue object's rule to this verdict map.
+
+        :param nfqueue: NFQueue object to add, which must match exact values of this map's key fields
+        :param verdict: nftables verdict for the NFQueue object's packets, e.g. `drop` or `jump <chain>`
+        """
+        matches = {nft_match["template"]: nft_match["match"] for nft_match in nfqueue.nft_matches}
+        key = " . ".join(str(matches[template]).strip() for template in self.templates)
+        self.nfqueues.append(nfqueue)
+        self.elements.append((key, verdict))
+
+
+    def get_nft_rule(self, drop_proba: float = 1.0, log_type: LogType = LogType.NONE, log_group: int = 100) -> str:
+        """
+        Retrieve the complete nftables rule for this verdict map.
+        The arguments are ignored, as the verdicts are computed when NFQueue objects are added,
+        and are only accepted for compatibility with `NFQueue.get_nft_rule`.
+
+        :return: complete nftables rule for this verdict map
+        """
+        fields = " . ".join(template.replace("{}", "").strip() for template in self.templates)
+        elements = ", ".join(f"{key} : {verdict}" for key, verdict in self.elements)
+        return f"{fields} vmap {{ {elements} }}"
+
+
+    def get_nft_json(self, drop_proba: float = 1.0, log_type: LogType = LogType.NONE, log_group: int = 100) -> list:
+        """
+        Retrieve the complete nftables rule for this verdict map,
+        as a list of libnftables JSON statements, equivalent to `get_nft_rule`.
+        The arguments are ignored, and only accepted for compatibility with `NFQueue.get_nft_json`.
+
+        :return: JSON statements of the nftables rule for this verdict map
+        """
+        fields = [get_template_expression(template)[0] for template in self.templates]
+        elements = []
+        for nfqueue, (_, verdict) in zip(self.nfqueues, self.elements):
+            matches = {nft_match["template"]: nft_match["match"] for nft_match in nfqueue.nft_matches}
+            values = [get_match_value(matches[template])[1] for template in self.templates]
+            key = values[0] if len(values) == 1 else {"concat": values}
+            elements.append([key, get_verdict_json(verdict)])
+        key = fields[0] if len(fields) == 1 else {"concat": fields}
+        return [{"vmap": {"key": key, "data": {"set": elements}}}]
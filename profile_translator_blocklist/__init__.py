@@ -2,8 +2,9 @@
 Package `profile-translator-blocklist`.
 """
 
-from .translator import slugify_name, translate_policy, translate_policies, translate_profile
+from .translator import slugify_name, translate_policy, translate_policies, translate_profile, translate_fleet
 from .Policy import Policy
+from .FirewallOptions import FirewallOptions
 
 
 __all__ = [
@@ -11,5 +12,7 @@ __all__ = [
     "translate_policy",
     "translate_policies",
     "translate_profile",
-    "Policy"
+    "translate_fleet",
+    "Policy",
+    "FirewallOptions"
 ]
@@ -0,0 +1,57 @@
+"""
+Command line interface of the translator:
+translate a device YAML profile to the corresponding pair of NFTables firewall script and NFQueue C source code,
+with `python -m profile_translator_blocklist <profile>`.
+"""
+
+import logging
+import argparse
+from dataclasses import fields
+from .arg_types import uint16, proba, directory
+from .LogType import LogType
+from .RateLimitType import RateLimitType
+from .FirewallOptions import FirewallOptions
+from .translator import translate_profile
+
+
+##### MAIN #####
+if __name__ == "__main__":
+
+    # Command line arguments
+    description = "Translate a device YAML profile to the corresponding pair of NFTables firewall script and NFQueue C source code."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("profile", type=str, help="Path to the device YAML profile")
+    parser.add_argument("-n", "--nfqueue-name", type=str, help="Name of the device's NFQueue (default: device name)")
+    parser.add_argument("-q", "--nfqueue-id", type=uint16, default=0, help="NFQueue start index for the profile's policies (default: 0)")
+    parser.add_argument("-o", "--output-dir", type=directory, help="Output directory for the generated files (default: profile's directory)")
+    verdict_group = parser.add_mutually_exclusive_group()
+    verdict_group.add_argument("-r", "--rate", type=int, help="Rate limit, in packets/second, to apply to matched traffic, instead of a binary verdict")
+    verdict_group.add_argument("-p", "--drop-proba", type=proba, help="Dropping probability to apply to matched traffic, instead of a binary verdict")
+    parser.add_argument("-l", "--log-type", type=lambda log_type: LogType[log_type.upper()], choices=list(LogType), default=LogType.NONE, help="Type of packet logging to be used (default: NONE)")
+    parser.add_argument("-g", "--log-group", type=uint16, default=100, help="Log group number (default: 100)")
+    parser.add_argument("-w", "--workers", type=uint16, default=1, help="Number of worker threads per NFQueue (default: 1)")
+    parser.add_argument("-t", "--test", action="store_true", help="Test mode: use VM instead of router")
+    parser.add_argument("--split-sources", action="store_true", help="Split the NFQueue C source code into one file per NFQueue")
+    parser.add_argument("--merge-sets", action="store_true", help="Merge the kernel-only rules which only differ in the value of one match into a set")
+    parser.add_argument("--verdict-maps", action="store_true", help="Replace the rules matching exact values of the same fields by a verdict map")
+    parser.add_argument("--chain-tree", action="store_true", help="Factor the matches shared by rules into jump rules to sub-chains")
+    parser.add_argument("--device-guard", action="store_true", help="Skip the unicast traffic which does not involve the device's MAC address (bridge hook only)")
+    parser.add_argument("--ct-marks", action="store_true", help="Cache the DROP verdicts given in user space in the connections' conntrack marks")
+    parser.add_argument("--offload", action="store_true", help="Offload the established routed flows which need no further inspection to a flowtable")
+    parser.add_argument("--flowtable-devices", type=str, nargs="+", help="Network interfaces of the flowtable, required by --offload")
+    parser.add_argument("--rate-limits", type=lambda rate_limits: RateLimitType[rate_limits.upper()], choices=list(RateLimitType), default=RateLimitType.INLINE, help="Type of rate limits to be used (default: INLINE)")
+    parser.add_argument("--counters", action="store_true", help="Add a named counter to the rule of each NFQueue")
+    parser.add_argument("--hit-stats", type=str, help="Path to a pcap file of the device's traffic or to the output of `nft -j list counters`, to evaluate the most matched rules first")
+    parser.add_argument("--copy-ranges", action="store_true", help="Only copy to user space the bytes of the packets read by each NFQueue's callback")
+    parser.add_argument("--ct-directions", action="store_true", help="Merge the kernel-only rules matching both directions of the same flows into a single rule")
+    parser.add_argument("--notrack", action="store_true", help="Skip connection tracking for the multicast and broadcast traffic which does not need it")
+    parser.add_argument("--early-drop", type=str, help="Network interface of the device's port, to drop the traffic sent by the device at netdev ingress")
+    parser.add_argument("--remove-redundant", action="store_true", help="Remove the rules whose packets are all matched by another rule with the same verdict")
+    parser.add_argument("--json-output", action="store_true", help="Also write the firewall in the JSON format of libnftables to `firewall.json`")
+    args = parser.parse_args()
+
+    # Translate profile
+    logging.basicConfig(level=logging.INFO)
+    options = FirewallOptions(**{field.name: getattr(args, field.name) for field in fields(FirewallOptions) if hasattr(args, field.name)})
+    translate_profile(args.profile, args.nfqueue_name, args.nfqueue_id, args.output_dir, args.rate, args.drop_proba,
+                      args.log_type, args.log_group, args.workers, options=options)
@@ -0,0 +1,105 @@
+"""
+Read the values of the named counters of a firewall translated with the `counters` option,
+from the output of `nft -j list counters`,
+and map them back to the names of the profile's policies.
+"""
+
+import sys
+from typing import Any
+import json
+import argparse
+
+
+### FUNCTIONS ###
+
+def read_counters(nft_output: Any) -> dict:
+    """
+    Read the values of the named counters from the JSON output of `nft -j list counters`.
+    Counters are only unique within their table, hence are keyed by table.
+
+    :param nft_output: JSON output of `nft -j list counters`,
+                       as a string, a readable file object, or an already decoded object
+    :return: values of the counters, by (family, table, name) tuple,
+             as dictionaries with keys "packets" and "bytes"
+    """
+    if hasattr(nft_output, "read"):
+        nft_output = nft_output.read()
+    if isinstance(nft_output, (str, bytes)):
+        nft_output = json.loads(nft_output)
+
+    counters = {}
+    for item in nft_output.get("nftables", []):
+        counter = item.get("counter", None)
+        if counter is None:
+            # Metadata, or other object
+            continue
+        key = (counter["family"], counter["table"], counter["name"])
+        counters[key] = {"packets": counter.get("packets", 0), "bytes": counter.get("bytes", 0)}
+    return counters
+
+
+def select_counters(counters: dict, family: str, table: str) -> dict:
+    """
+    Select the values of the counters of a single table.
+
+    :param counters: values of the counters, by (family, table, name) tuple, as returned by `read_counters`
+    :param family: family of the table, e.g. "bridge"
+    :param table: name of the table, i.e. the device's name, or the fleet's table name
+    :return: values of the table's counters, by counter name
+    """
+    return {
+        name: values
+        for (counter_family, counter_table, name), values in counters.items()
+        if counter_family == family and counter_table == table
+    }
+
+
+def map_counters(counters: dict, counted_policies: dict, family: str, table: str) -> dict:
+    """
+    Map the values of the named counters of a table back to the policies they count.
+    Policies sharing the same nftables rule share the same counter, hence are given the same values.
+
+    :param counters: values of the counters, by (family, table, name) tuple, as returned by `read_counters`
+    :param counted_policies: names of the policies counted by each counter, by counter name,
+                             as written to `counters.json` by the translator
+    :param family: family of the table holding the counters, e.g. "bridge"
+    :param table: name of the table holding the counters, i.e. the device's name, or the fleet's table name
+    :return: values of the policies, by policy name,
+             as dictionaries with keys "counter", "packets" and "bytes",
+             with zero values for the counters missing from the table
+    """
+    counters = select_counters(counters, family, table)
+    result = {}
+    for counter, policies in counted_policies.items():
+        values = counters.get(counter, {"packets": 0, "bytes": 0})
+        for policy in policies:
+            result[policy] = {"counter": counter, "packets": values["packets"], "bytes": values["bytes"]}
+    return result
+
+
+##### MAIN #####
+if __name__ == "__main__":
+
+    # Command line arguments
+    description = "Map the values of the named nftables counters back to the profile's policies."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("counters", type=str, help="Path to the file `counters.json` written by the translator")
+    parser.add_argument("-t", "--table", type=str, required=True, help="Name of the table holding the counters, i.e. the device's name, or the fleet's table name")
+    parser.add_argument("-f", "--family", type=str, default="bridge", help="Family of the table holding the counters (default: bridge)")
+    parser.add_argument("-i", "--input", type=str, default="-", help="Path to the output of `nft -j list counters` (default: standard input)")
+    args = parser.parse_args()
+
+    # Read counters
+    with open(args.counters, "r") as f:
+        counted_policies = json.load(f)
+    if args.input == "-":
+        counters = read_counters(sys.stdin)
+    else:
+        with open(args.input, "r") as f:
+            counters = read_counters(f)
+
+    # Print policy values, as CSV, most matched policies first
+    policies = map_counters(counters, counted_policies, args.family, args.table)
+    print("policy,counter,packets,bytes")
+    for policy, values in sorted(policies.items(), key=lambda item: -item[1]["packets"]):
+        print(f"{policy},{values['counter']},{values['packets']},{values['bytes']}")
@@ -0,0 +1,191 @@
+"""
+Hit statistics of a device's nftables rules,
+i.e. the number of packets matched by each rule,
+read from a dump of the rules' named counters or computed from a packet capture.
+"""
+
+import struct
+from typing import Any
+from .nft_utils import get_rule_fields, get_counter_names
+from .counter_scraper import read_counters, select_counters
+
+
+### VARIABLES ###
+
+# Magic numbers of the classic pcap file format, with their byte order
+pcap_magic_numbers = {
+    b"\xd4\xc3\xb2\xa1": "<",  # Microsecond timestamps, little endian
+    b"\xa1\xb2\xc3\xd4": ">",  # Microsecond timestamps, big endian
+    b"\x4d\x3c\xb2\xa1": "<",  # Nanosecond timestamps, little endian
+    b"\xa1\xb2\x3c\x4d": ">"   # Nanosecond timestamps, big endian
+}
+
+# Link type of Ethernet captures
+linktype_ethernet = 1
+
+# EtherTypes of the supported protocols
+ether_types = {
+    "vlan": 0x8100,
+    "ip":   0x0800,
+    "arp":  0x0806,
+    "ip6":  0x86dd
+}
+
+# Layer 4 protocols with a source and destination port, by IP protocol number
+port_protocols = {6: "tcp", 17: "udp"}
+
+
+### FUNCTIONS ###
+
+def read_pcap(pcap_path: str) -> list:
+    """
+    Read the frames of a classic pcap file with Ethernet link type.
+
+    :param pcap_path: path to the pcap file
+    :return: list of the captured frames, as bytes
+    :raises ValueError: if the file is not a classic pcap file with Ethernet link type
+    """
+    with open(pcap_path, "rb") as f:
+        data = f.read()
+
+    byte_order = pcap_magic_numbers.get(data[:4], None)
+    if byte_order is None:
+        raise ValueError(f"{pcap_path} is not a classic pcap file")
+    linktype = struct.unpack(f"{byte_order}I", data[20:24])[0]
+    if linktype != linktype_ethernet:
+        raise ValueError(f"{pcap_path} does not contain Ethernet frames")
+
+    frames = []
+    offset = 24
+    while offset + 16 <= len(data):
+        captured_length = struct.unpack(f"{byte_order}I", data[offset+8:offset+12])[0]
+        offset += 16
+        frames.append(data[offset:offset+captured_length])
+        offset += captured_length
+    return frames
+
+
+def get_packet_fields(frame: bytes) -> dict:
+    """
+    Extract the values of the nftables match fields of an Ethernet frame, as integers,
+    indexed by match template, e.g. {"ip daddr {}": 167772161, "tcp dport {}": 443, ...}.
+
+    :param frame: Ethernet frame
+    :return: values of the frame's fields, by match template
+    """
+    fields = {}
+    if len(frame) < 14:
+        return fields
+    fields["ether daddr {}"] = int.from_bytes(frame[0:6], "big")
+    fields["ether saddr {}"] = int.from_bytes(frame[6:12], "big")
+    ether_type = int.from_bytes(frame[12:14], "big")
+    offset = 14
+    while ether_type == ether_types["vlan"] and len(frame) >= offset + 4:
+        ether_type = int.from_bytes(frame[offset+2:offset+4], "big")
+        offset += 4
+    fields["ether type {}"] = ether_type
+    payload = frame[offset:]
+
+    l4_proto = None
+    if ether_type == ether_types["arp"] and len(payload) >= 28:
+        fields["arp operation {}"] = int.from_bytes(payload[6:8], "big")
+        fields["arp saddr ether {}"] = int.from_bytes(payload[8:14], "big")
+        fields["arp saddr ip {}"] = int.from_bytes(payload[14:18], "big")
+        fields["arp daddr ether {}"] = int.from_bytes(payload[18:24], "big")
+        fields["arp daddr ip {}"] = int.from_bytes(payload[24:28], "big")
+    elif ether_type == ether_types["ip"] and len(payload) >= 20:
+        fields["ip length {}"] = int.from_bytes(payload[2:4], "big")
+        fields["ip saddr {}"] = int.from_bytes(payload[12:16], "big")
+        fields["ip daddr {}"] = int.from_bytes(payload[16:20], "big")
+        l4_proto = payload[9]
+        payload = payload[(payload[0] & 0x0f) * 4:]
+    elif ether_type == ether_types["ip6"] and len(payload) >= 40:
+        fields["ip6 saddr {}"] = int.from_bytes(payload[8:24], "big")
+        fields["ip6 daddr {}"] = int.from_bytes(payload[24:40], "big")
+        l4_proto = payload[6]
+        payload = payload[40:]
+
+    if l4_proto is not None:
+        fields["meta l4proto {}"] = l4_proto
+        if l4_proto in port_protocols and len(payload) >= 4:
+            fields[f"{port_protocols[l4_proto]} sport {{}}"] = int.from_bytes(payload[0:2], "big")
+            fields[f"{port_protocols[l4_proto]} dport {{}}"] = int.from_bytes(payload[2:4], "big")
+        elif l4_proto == 1 and len(payload) >= 1:
+            fields["icmp type {}"] = payload[0]
+        elif l4_proto == 58 and len(payload) >= 1:
+            fields["icmpv6 type {}"] = payload[0]
+
+    return fields
+
+
+def may_match(rule_fields: dict, packet_fields: dict) -> bool:
+    """
+    Check whether a packet might be matched by an nftables rule.
+    Conservative: the fields whose matched values are unknown are considered matched.
+
+    :param rule_fields: analysis of the rule, as returned by `get_rule_fields`
+    :param packet_fields: values of the packet's fields, as returned by `get_packet_fields`
+    :return: False if the packet cannot match the rule, True otherwise
+    """
+    for template, values in rule_fields["fields"].items():
+        if values is None:
+            continue
+        value = packet_fields.get(template, None)
+        if value is None or not values.contains_interval(value, value):
+            return False
+    return True
+
+
+def count_pcap_hits(nfqueues: list, pcap_path: str, prefix: str = "") -> dict:
+    """
+    Count the packets of a capture of the device's traffic matched by each rule,
+    each packet being counted for the first rule it might match, in rule order.
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param pcap_path: path to a classic pcap file with Ethernet link type
+    :param prefix: prefix of the names of the counters
+    :return: number of packets matched by each rule, by name of the rule's counter (see `nft_utils.get_counter_names`)
+    """
+    rules = [
+        (name, get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats))
+        for nfqueue, name in zip(nfqueues, get_counter_names(nfqueues, prefix))
+    ]
+    hits = {}
+    for frame in read_pcap(pcap_path):
+        packet_fields = get_packet_fields(frame)
+        for name, rule_fields in rules:
+            if may_match(rule_fields, packet_fields):
+                hits[name] = hits.get(name, 0) + 1
+                break
+    return hits
+
+
+def load_hit_stats(source: Any, nfqueues: list, prefix: str = "", table: tuple = None) -> dict:
+    """
+    Load the hit statistics of a device's rules,
+    either from the values of their named counters, as given by `nft -j list counters`,
+    or from a capture of the device's traffic.
+
+    :param source: values of the counters, by counter name,
+                   or by (family, table, name) tuple, as returned by `counter_scraper.read_counters`,
+                   or path to a pcap file or to a file containing the output of `nft -j list counters`
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param prefix: prefix of the names of the counters
+    :param table: (family, name) tuple of the table holding the rules' counters,
+                  to select them among the counters of all tables
+    :return: number of packets matched by each rule, by name of the rule's counter (see `nft_utils.get_counter_names`)
+    :raises ValueError: if the counters are keyed by table, but the table of the rules' counters is not given
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            magic = f.read(4)
+        if magic in pcap_magic_numbers:
+            return count_pcap_hits(nfqueues, source, prefix)
+        with open(source, "r") as f:
+            source = read_counters(f)
+    # Counters of different tables can share the same name
+    if any(isinstance(key, tuple) for key in source):
+        if table is None:
+            raise ValueError("The table of the rules' counters is needed to select them")
+        source = select_counters(source, *table)
+    return {name: values["packets"] if isinstance(values, dict) else values for name, values in source.items()}
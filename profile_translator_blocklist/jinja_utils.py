@@ -2,7 +2,9 @@
 Jinja2-related functions.
 """
 
+import re
 import jinja2
+from .nft_utils import format_matches
 
 
 def is_list(value: any) -> bool:
@@ -26,6 +28,20 @@ def debug(value: any) -> str:
     return ""
 
 
+def accept_to_return(rule: str) -> str:
+    """
+    Custom filter for Jinja2, to replace the `accept` verdict of an nftables rule by `return`,
+    so that accepted packets are still evaluated by the rules following the jump to the rule's chain.
+
+    :param rule: nftables rule
+    :return: nftables rule, with the `accept` verdict replaced by `return`
+    """
+    if rule == "accept" or rule.endswith(" accept"):
+        return rule[:-len("accept")] + "return"
+    # Verdict map, e.g. `numgen random mod 2 vmap { 0 : drop, 1 : accept }`
+    return re.sub(r": accept(?=,| })", ": return", rule)
+
+
 def create_jinja_env(package: str) -> jinja2.Environment:
     """
     Create a Jinja2 environment with custom filters.
@@ -42,6 +58,8 @@ def create_jinja_env(package: str) -> jinja2.Environment:
     # Add custom Jinja2 filters
     env.filters["debug"] = debug
     env.filters["is_list"] = is_list
+    env.filters["accept_to_return"] = accept_to_return
+    env.filters["format_matches"] = format_matches
     env.filters["any"] = any
     env.filters["all"] = all
     
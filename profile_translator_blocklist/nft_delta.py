@@ -0,0 +1,332 @@
+"""
+Incremental update of a device's firewall between two translations of its profile:
+compute the nftables transaction turning the ruleset of the previous `firewall.nft` script,
+as currently loaded, into the ruleset of the new one,
+by only adding or deleting the changed rules, set elements, sets and chains.
+Rules are identified by the name of their NFQueue, as given by the comment preceding them,
+or by their text if they have none, and deleted by their handle, as given by `nft -j list table`.
+"""
+
+import re
+import sys
+import json
+import argparse
+from typing import Any
+from .nft_utils import split_elements
+
+
+### VARIABLES ###
+
+# Comment preceding the rule of an NFQueue, verdict map or sub-chain, giving its name
+rule_comment = re.compile(r"^# (?:NFQueue|VerdictMap|SubChain) (.+)$")
+
+# Block declarations
+table_declaration = re.compile(r"^table (\S+) (\S+) \{$")
+block_declaration = re.compile(r"^(chain|set|limit|counter|flowtable) (\S+) \{$")
+
+
+### FUNCTIONS ###
+
+def parse_script(nft_script: str) -> dict:
+    """
+    Parse an nftables script written by the translator, e.g. `firewall.nft`.
+
+    :param nft_script: content of the nftables script
+    :return: tables of the script, by (family, name), as dictionaries with keys:
+                - "text": lines of the table's block
+                - "blocks": declarations (sets, limits, counters, flowtables), by (kind, name),
+                            as dictionaries with keys "text", "properties" and "elements"
+                            (list of elements for a set, else None)
+                - "chains": chains, by name, as dictionaries with keys "text", "properties"
+                            and "rules" (list of (identifier, rule) tuples, in rule order)
+    """
+    tables = {}
+    table = None
+    block = None
+    rule_id = None
+    for line in nft_script.splitlines():
+        stripped = line.strip()
+
+        if table is None:
+            match = table_declaration.match(stripped)
+            if match:
+                table = {"text": [line], "blocks": {}, "chains": {}}
+                tables[match.groups()] = table
+            continue
+        table["text"].append(line)
+
+        if block is None:
+            match = block_declaration.match(stripped)
+            if match:
+                kind, name = match.groups()
+                block = {"text": [line], "properties": []}
+                if kind == "chain":
+                    block["rules"] = []
+                    block["occurrences"] = {}
+                    table["chains"][name] = block
+                else:
+                    block["elements"] = [] if kind == "set" else None
+                    table["blocks"][(kind, name)] = block
+            elif stripped == "}":
+                table = None
+            continue
+        block["text"].append(line)
+
+        if stripped == "}":
+            block.pop("occurrences", None)
+            block = None
+            rule_id = None
+        elif not stripped:
+            continue
+        elif stripped.startswith("#"):
+            match = rule_comment.match(stripped)
+            if match:
+                rule_id = match.group(1)
+        elif "rules" not in block:
+            if stripped.startswith("elements = ") and block["elements"] is not None:
+                block["elements"] = split_elements(stripped[len("elements = "):])
+            else:
+                block["properties"].append(stripped)
+        elif stripped.startswith("type "):
+            block["properties"].append(stripped)
+        else:
+            # Identical rules without name are told apart by their occurrence
+            identifier = rule_id if rule_id is not None else stripped
+            occurrence = block["occurrences"].get(identifier, 0)
+            block["occurrences"][identifier] = occurrence + 1
+            block["rules"].append(((identifier, occurrence), stripped))
+            rule_id = None
+
+    return tables
+
+
+def read_handles(nft_output: Any) -> dict:
+    """
+    Read the handles of the rules from the JSON output of `nft -j list table` or `nft -j list ruleset`.
+
+    :param nft_output: JSON output of `nft -j list table`,
+                       as a string, a readable file object, or an already decoded object
+    :return: handles of the rules, in rule order, by (family, table, chain)
+    """
+    if hasattr(nft_output, "read"):
+        nft_output = nft_output.read()
+    if isinstance(nft_output, (str, bytes)):
+        nft_output = json.loads(nft_output)
+
+    handles = {}
+    for item in nft_output.get("nftables", []):
+        rule = item.get("rule", None)
+        if rule is None:
+            # Metadata, or other object
+            continue
+        handles.setdefault((rule["family"], rule["table"], rule["chain"]), []).append(rule["handle"])
+    return handles
+
+
+def get_stable_rules(old_rules: list, new_rules: list) -> set:
+    """
+    Get the identifiers of the rules which can stay in place,
+    i.e. the largest set of rules present in both versions of a chain, in the same relative order.
+
+    :param old_rules: rules of the previous version of the chain, as (identifier, rule) tuples, in rule order
+    :param new_rules: rules of the new version of the chain, as (identifier, rule) tuples, in rule order
+    :return: set of the identifiers of the rules which can stay in place
+    """
+    old_positions = {identifier: i for i, (identifier, _) in enumerate(old_rules)}
+    common = [(old_positions[identifier], identifier) for identifier, _ in new_rules if identifier in old_positions]
+
+    # Longest increasing subsequence of the previous positions, in O(n log n)
+    tails = []        # Index in `common` of the last element of the best subsequence of each length
+    predecessors = []
+    for i, (position, _) in enumerate(common):
+        lower, upper = 0, len(tails)
+        while lower < upper:
+            middle = (lower + upper) // 2
+            if common[tails[middle]][0] < position:
+                lower = middle + 1
+            else:
+                upper = middle
+        predecessors.append(tails[lower - 1] if lower > 0 else None)
+        if lower == len(tails):
+            tails.append(i)
+        else:
+            tails[lower] = i
+
+    stable = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        stable.add(common[i][1])
+        i = predecessors[i]
+    return stable
+
+
+def get_chain_delta(family: str, table: str, chain: str, old_rules: list, new_rules: list, handles: list) -> tuple:
+    """
+    Compute the nftables commands updating the rules of a chain present in both versions of the ruleset.
+    Rules which stay in place are replaced if their text changed,
+    other rules are deleted, and inserted next to the rules staying in place.
+
+    :param family: family of the table
+    :param table: name of the table
+    :param chain: name of the chain
+    :param old_rules: rules of the previous version of the chain, as (identifier, rule) tuples, in rule order
+    :param new_rules: rules of the new version of the chain, as (identifier, rule) tuples, in rule order
+    :param handles: handles of the rules of the previous version of the chain, in rule order
+    :return: list of the commands deleting rules, and list of the commands adding or replacing rules
+    :raises ValueError: if the number of handles does not match the number of rules of the previous version
+    """
+    if len(handles) != len(old_rules):
+        raise ValueError(f"The loaded chain {family} {table} {chain} does not match the previous script "
+                         f"({len(handles)} rules loaded, {len(old_rules)} expected)")
+    old_handles = {identifier: handle for (identifier, _), handle in zip(old_rules, handles)}
+    old_texts = dict(old_rules)
+    stable = get_stable_rules(old_rules, new_rules)
+    prefix = f"{family} {table} {chain}"
+
+    deletions = [f"delete rule {prefix} handle {old_handles[identifier]}"
+                 for identifier, _ in old_rules if identifier not in stable]
+    additions = []
+    run = []  # Rules to insert since the last rule staying in place
+    previous = None
+    for identifier, rule in new_rules + [(None, None)]:
+        if identifier is not None and identifier not in stable:
+            run.append(rule)
+            continue
+        if run and previous is not None:
+            # Each rule is added right after the previous stable rule, hence in reverse order
+            additions += [f"add rule {prefix} position {old_handles[previous]} {rule}" for rule in reversed(run)]
+        elif run and identifier is not None:
+            additions += [f"insert rule {prefix} position {old_handles[identifier]} {rule}" for rule in run]
+        elif run:
+            additions += [f"add rule {prefix} {rule}" for rule in run]
+        run = []
+        if identifier is not None:
+            if rule != old_texts[identifier]:
+                additions.append(f"replace rule {prefix} handle {old_handles[identifier]} {rule}")
+            previous = identifier
+    return deletions, additions
+
+
+def get_full_reload(old_tables: dict, new_script: str) -> str:
+    """
+    Build the nftables transaction replacing the previous tables by the new script.
+
+    :param old_tables: tables of the previous script, as returned by `parse_script`
+    :param new_script: content of the new nftables script
+    :return: nftables transaction, as a script
+    """
+    lines = ["#!/usr/sbin/nft -f", ""]
+    lines += [f"delete table {family} {name}" for family, name in old_tables]
+    lines += [line for line in new_script.splitlines() if not line.startswith("#!")]
+    return "\n".join(lines) + "\n"
+
+
+def get_delta(old_script: str, new_script: str, handles: dict) -> str:
+    """
+    Compute the nftables transaction turning the ruleset of a previous nftables script, as currently loaded,
+    into the ruleset of a new one, by only adding, replacing or deleting the changed rules,
+    set elements, declarations and chains.
+    The transaction is applied atomically by `nft -f`.
+    If the tables, the base chains or the declarations other than set elements changed,
+    the transaction reloads the whole tables instead.
+
+    :param old_script: content of the previous nftables script, e.g. `firewall.nft`
+    :param new_script: content of the new nftables script
+    :param handles: handles of the rules currently loaded, in rule order, by (family, table, chain),
+                    as returned by `read_handles`
+    :return: nftables transaction, as a script
+    :raises ValueError: if the loaded rules do not match the rules of the previous script
+    """
+    old_tables = parse_script(old_script)
+    new_tables = parse_script(new_script)
+
+    # Declarations and chains to create, as table blocks, and commands, in transaction order
+    created = []
+    element_additions = []
+    rule_deletions = []
+    rule_additions = []
+    element_deletions = []
+    removed = []
+
+    for key, old_table in old_tables.items():
+        if key not in new_tables:
+            removed.append(f"delete table {key[0]} {key[1]}")
+
+    for key, new_table in new_tables.items():
+        family, name = key
+        old_table = old_tables.get(key, None)
+        if old_table is None:
+            created += new_table["text"]
+            continue
+        prefix = f"{family} {name}"
+        new_blocks = []
+
+        for (kind, block_name), new_block in new_table["blocks"].items():
+            old_block = old_table["blocks"].get((kind, block_name), None)
+            if old_block is None:
+                new_blocks += new_block["text"]
+                continue
+            if old_block["properties"] != new_block["properties"]:
+                return get_full_reload(old_tables, new_script)
+            if new_block["elements"] is not None:
+                old_elements = set(old_block["elements"] or [])
+                new_elements = set(new_block["elements"] or [])
+                added = [element for element in new_block["elements"] or [] if element not in old_elements]
+                deleted = [element for element in old_block["elements"] or [] if element not in new_elements]
+                if added:
+                    element_additions.append(f"add element {prefix} {block_name} {{ {', '.join(added)} }}")
+                if deleted:
+                    element_deletions.append(f"delete element {prefix} {block_name} {{ {', '.join(deleted)} }}")
+        for kind, block_name in old_table["blocks"]:
+            if (kind, block_name) not in new_table["blocks"]:
+                removed.append(f"delete {kind} {prefix} {block_name}")
+
+        for chain, new_chain in new_table["chains"].items():
+            old_chain = old_table["chains"].get(chain, None)
+            if old_chain is None:
+                new_blocks += new_chain["text"]
+                continue
+            if old_chain["properties"] != new_chain["properties"]:
+                return get_full_reload(old_tables, new_script)
+            deletions, additions = get_chain_delta(family, name, chain, old_chain["rules"], new_chain["rules"],
+                                                   handles.get((family, name, chain), []))
+            rule_deletions += deletions
+            rule_additions += additions
+        for chain in old_table["chains"]:
+            if chain not in new_table["chains"]:
+                # Chains must be empty to be deleted
+                removed.insert(0, f"flush chain {prefix} {chain}")
+                removed.append(f"delete chain {prefix} {chain}")
+
+        if new_blocks:
+            created += new_table["text"][:1] + new_blocks + ["}"]
+
+    lines = ["#!/usr/sbin/nft -f", ""]
+    lines += created + element_additions + rule_deletions + rule_additions + element_deletions + removed
+    return "\n".join(lines) + "\n"
+
+
+##### MAIN #####
+if __name__ == "__main__":
+
+    # Command line arguments
+    description = "Compute the nftables transaction updating a loaded firewall to a new translation of its profile."
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("previous", type=str, help="Path to the previous nftables script, as currently loaded")
+    parser.add_argument("new", type=str, help="Path to the new nftables script")
+    parser.add_argument("-i", "--input", type=str, default="-", help="Path to the output of `nft -j list ruleset` (default: standard input)")
+    args = parser.parse_args()
+
+    # Read scripts and handles
+    with open(args.previous, "r") as f:
+        old_script = f.read()
+    with open(args.new, "r") as f:
+        new_script = f.read()
+    if args.input == "-":
+        handles = read_handles(sys.stdin)
+    else:
+        with open(args.input, "r") as f:
+            handles = read_handles(f)
+
+    # Print transaction, to be applied with `nft -f`
+    sys.stdout.write(get_delta(old_script, new_script, handles))
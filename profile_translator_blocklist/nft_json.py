@@ -0,0 +1,424 @@
+"""
+Rendering of a device's firewall in the JSON format of libnftables (`nft -j`),
+as an alternative to the text script `firewall.nft`.
+The document is built from the rule objects (NFQueue, VerdictMap, SubChain) and the declarations of the firewall,
+each nftables match being converted from its template and its value,
+and each stat from its structured data (rates, names of the limits, meters and timers).
+"""
+
+import re
+from collections import deque
+from typing import Any
+from .nft_utils import get_random_threshold, split_elements
+
+
+### VARIABLES ###
+
+# Version of the libnftables JSON schema
+json_schema_version = 1
+
+# Protocols of the payload expressions
+payload_protocols = ["ether", "vlan", "arp", "ip", "ip6", "tcp", "udp", "udplite", "sctp", "dccp", "icmp", "icmpv6", "igmp", "th"]
+
+# Relational operators, longest first
+operators = ["==", "!=", "<=", ">=", "<", ">"]
+
+# Verdicts with a target chain
+jump_verdicts = ["jump", "goto"]
+
+# Templates of the stat matches which are not a single comparison
+timer_template = "ct state != new ct id != @{}"
+named_limit_template = "limit name {}"
+meter_template = "update @{}"
+
+# Rates of the limits, e.g. `10/second` or `10 kbytes/second burst 5 packets`
+rate_pattern = re.compile(r"^(\d+)\s*(\w*bytes)?/(\w+)(?:\s+burst\s+(\d+)\s+(\w+))?$")
+
+# Durations, e.g. `1m`
+duration_pattern = re.compile(r"^(\d+)([smhdw])$")
+duration_units = {"s": 1, "m": 60, "h": 60 * 60, "d": 60 * 60 * 24, "w": 60 * 60 * 24 * 7}
+
+
+### EXPRESSION FUNCTIONS ###
+
+def parse_expression(tokens: deque) -> dict:
+    """
+    Convert a single nftables expression of a match template, e.g. `ip saddr`, `meta l4proto` or `ct original packets`.
+
+    :param tokens: remaining tokens of the template
+    :return: JSON expression
+    :raises ValueError: if the expression is not supported
+    """
+    token = tokens.popleft()
+    if token == "meta":
+        return {"meta": {"key": tokens.popleft()}}
+    if token == "ct":
+        ct = {}
+        if tokens and tokens[0] in ["original", "reply"]:
+            ct["dir"] = tokens.popleft()
+        if tokens and tokens[0] in ["ip", "ip6"]:
+            ct["family"] = tokens.popleft()
+        ct["key"] = tokens.popleft()
+        return {"ct": ct}
+    if token in payload_protocols:
+        field = tokens.popleft()
+        if token == "arp" and field in ["saddr", "daddr"] and tokens and tokens[0] in ["ip", "ether"]:
+            field += " " + tokens.popleft()
+        return {"payload": {"protocol": token, "field": field}}
+    raise ValueError(f"Unsupported nftables expression \"{token}\"")
+
+
+def get_expression(expression: str) -> dict:
+    """
+    Convert an nftables expression which might be a concatenation, e.g. `ip daddr . tcp dport`.
+
+    :param expression: nftables expression
+    :return: JSON expression
+    :raises ValueError: if the expression is not supported
+    """
+    tokens = deque(expression.split())
+    expressions = [parse_expression(tokens)]
+    while tokens and tokens[0] == ".":
+        tokens.popleft()
+        expressions.append(parse_expression(tokens))
+    if tokens:
+        raise ValueError(f"Unsupported nftables expression \"{expression}\"")
+    return expressions[0] if len(expressions) == 1 else {"concat": expressions}
+
+
+def get_template_expression(template: str) -> tuple:
+    """
+    Convert the fixed part of an nftables match template, e.g. `ct packets > {}`,
+    to its JSON expression and relational operator.
+
+    :param template: nftables match template, with a single placeholder for the match value
+    :return: JSON expression and relational operator, as a tuple
+    :raises ValueError: if the template is not supported
+    """
+    expression = template.replace("{}", "").strip()
+    op = "=="
+    for operator in operators:
+        if expression.endswith(" " + operator):
+            expression, op = expression[:-len(operator)].strip(), operator
+            break
+    return get_expression(expression), op
+
+
+### VALUE FUNCTIONS ###
+
+def get_atom(value: str) -> Any:
+    """
+    Convert a single nftables value, e.g. `443`, `"name"`, `1000-2000`, `10.0.0.0/24` or `@set`.
+
+    :param value: nftables value
+    :return: JSON value
+    """
+    value = value.strip()
+    if value.startswith('"') and value.endswith('"'):
+        return value[1:-1]
+    if value.isdigit():
+        return int(value)
+    if "/" in value and not value.startswith("@"):
+        address, length = value.rsplit("/", 1)
+        if length.isdigit():
+            return {"prefix": {"addr": address, "len": int(length)}}
+    bounds = [bound.strip() for bound in value.split("-")]
+    if len(bounds) == 2 and all(bounds):
+        if all(bound.isdigit() for bound in bounds):
+            return {"range": [int(bounds[0]), int(bounds[1])]}
+        if all(re.match(r"^[0-9a-fA-F.:]+$", bound) and re.search(r"[.:]", bound) for bound in bounds):
+            # Address range
+            return {"range": bounds}
+    return value
+
+
+def get_element(value: str) -> Any:
+    """
+    Convert an nftables value which might be a concatenation, e.g. `10.0.0.1 . 443`.
+
+    :param value: nftables value
+    :return: JSON value
+    """
+    values = [get_atom(part) for part in value.split(" . ")]
+    return values[0] if len(values) == 1 else {"concat": values}
+
+
+def get_match_value(match: Any) -> tuple:
+    """
+    Convert the value of an nftables match, e.g. `443`, `{ 80, 443 }` or `!= 10.0.0.1`,
+    to its JSON value and its relational operator, if the value carries one.
+
+    :param match: value of the nftables match
+    :return: relational operator, or None, and JSON value, as a tuple
+    """
+    if isinstance(match, int):
+        return None, match
+    value = str(match).strip()
+    op = next((operator for operator in operators if value.startswith(operator)), None)
+    if op is not None:
+        value = value[len(op):].strip()
+    if value.startswith("{") and value.endswith("}"):
+        return op, {"set": [get_element(element) for element in split_elements(value)]}
+    return op, get_element(value)
+
+
+def get_limit(rate: str, over: bool = True) -> dict:
+    """
+    Convert the rate of an nftables limit, e.g. `10/second`, to the JSON limit statement's properties.
+
+    :param rate: rate of the limit
+    :param over: whether the limit matches the packets over the rate
+    :return: properties of the JSON limit statement
+    :raises ValueError: if the rate is not supported
+    """
+    match = rate_pattern.match(str(rate).strip())
+    if match is None:
+        raise ValueError(f"Unsupported nftables rate: {rate}")
+    value, unit, per, burst, burst_unit = match.groups()
+    limit = {"rate": int(value), "per": per}
+    if unit is not None:
+        limit["rate_unit"] = unit
+    if burst is not None:
+        limit["burst"] = int(burst)
+        if burst_unit != "packets":
+            limit["burst_unit"] = burst_unit
+    if over:
+        limit["inv"] = True
+    return limit
+
+
+def parse_duration(duration: str) -> int:
+    """
+    Convert an nftables duration to seconds, e.g. `1m` to 60.
+
+    :param duration: nftables duration, with a single unit
+    :return: duration, in seconds
+    :raises ValueError: if the duration is not supported
+    """
+    match = duration_pattern.match(str(duration))
+    if match is None:
+        raise ValueError(f"Unsupported nftables duration: {duration}")
+    return int(match.group(1)) * duration_units[match.group(2)]
+
+
+### STATEMENT FUNCTIONS ###
+
+def get_match_json(nft_match: dict) -> list:
+    """
+    Convert an nftables match or stat, with the form {"template": ..., "match": ...},
+    to libnftables JSON statements, e.g. `{"template": "tcp dport {}", "match": 443}` to
+    `[{"match": {"op": "==", "left": {"payload": {"protocol": "tcp", "field": "dport"}}, "right": 443}}]`.
+    Rate, named limit, meter and duration stats are converted from their structured data.
+
+    :param nft_match: nftables match or stat
+    :return: list of JSON statements
+    :raises ValueError: if the match is not supported
+    """
+    template, match = nft_match["template"], nft_match["match"]
+    if template == timer_template:
+        # Connection within its allowed duration
+        return [
+            {"match": {"op": "!=", "left": {"ct": {"key": "state"}}, "right": "new"}},
+            {"match": {"op": "!=", "left": {"ct": {"key": "id"}}, "right": f"@{match}"}}
+        ]
+    if template.startswith("limit rate "):
+        return [{"limit": get_limit(match, template.startswith("limit rate over "))}]
+    if template == named_limit_template:
+        return [{"limit": nft_match["name"]}]
+    if template == meter_template:
+        return [{"set": {
+            "op": "update", "elem": get_expression(nft_match["key"]), "set": f"@{nft_match['name']}",
+            "stmt": [{"limit": get_limit(nft_match["rate"])}]
+        }}]
+    left, op = get_template_expression(template)
+    value_op, right = get_match_value(match)
+    return [{"match": {"op": value_op or op, "left": left, "right": right}}]
+
+
+def get_matches_json(nft_matches: list) -> list:
+    """
+    Convert nftables matches, with the form {"template": ..., "match": ...}, to libnftables JSON statements.
+
+    :param nft_matches: list of nftables matches
+    :return: list of JSON statements
+    """
+    return [statement for nft_match in nft_matches for statement in get_match_json(nft_match)]
+
+
+def get_verdict_json(verdict: str) -> dict:
+    """
+    Convert an nftables verdict, e.g. `drop` or `jump <chain>`, to a JSON verdict statement.
+
+    :param verdict: nftables verdict
+    :return: JSON verdict statement
+    """
+    kind, _, target = verdict.strip().partition(" ")
+    return {kind: {"target": target}} if kind in jump_verdicts else {kind: None}
+
+
+def get_random_verdict_json(drop_proba: float) -> dict:
+    """
+    Build the JSON verdict map which drops packets with the given probability, and accepts the others,
+    equivalent to `nft_utils.get_random_verdict`.
+
+    :param drop_proba: dropping probability, strictly between 0 and 1
+    :return: JSON verdict map statement, keyed by a `numgen` expression
+    """
+    modulus, threshold = get_random_threshold(drop_proba)
+    interval = lambda lower, upper: lower if lower == upper else {"range": [lower, upper]}
+    return {"vmap": {
+        "key": {"numgen": {"mode": "random", "mod": modulus}},
+        "data": {"set": [
+            [interval(0, threshold - 1), {"drop": None}],
+            [interval(threshold, modulus - 1), {"accept": None}]
+        ]}
+    }}
+
+
+### RENDERING FUNCTIONS ###
+
+def get_set_type(nft_type: str) -> Any:
+    """
+    Convert the type of a set to JSON, e.g. `ipv4_addr . inet_service` to `["ipv4_addr", "inet_service"]`.
+
+    :param nft_type: type of the set, in the nftables text format
+    :return: JSON type of the set
+    """
+    types = [part.strip() for part in nft_type.split(" . ")]
+    return types[0] if len(types) == 1 else types
+
+
+def get_chain(family: str, table: str, name: str, hook: dict = None) -> dict:
+    """
+    Build the JSON object declaring a chain.
+
+    :param family: family of the table
+    :param table: name of the table
+    :param name: name of the chain
+    :param hook: hook of a base chain, with keys "hook", "priority" and "device", or None for a regular chain
+    :return: JSON chain object
+    """
+    chain = {"family": family, "table": table, "name": name}
+    if hook is not None:
+        chain.update({"type": "filter", "hook": hook["hook"], "prio": hook["priority"]})
+        if hook.get("device", None):
+            chain["dev"] = hook["device"]
+        chain["policy"] = "accept"
+    return {"chain": chain}
+
+
+def get_rule(family: str, table: str, chain: str, statements: list) -> dict:
+    """
+    Build the JSON object adding a rule.
+
+    :param family: family of the table
+    :param table: name of the table
+    :param chain: name of the chain
+    :param statements: JSON statements of the rule
+    :return: JSON rule object
+    """
+    return {"rule": {"family": family, "table": table, "chain": chain, "expr": statements}}
+
+
+def get_firewall_json(nft_dict: dict) -> dict:
+    """
+    Build the libnftables JSON document of a device's firewall,
+    equivalent to the script rendered from the template `firewall.nft.j2`.
+
+    :param nft_dict: data of the firewall, as given to the template `firewall.nft.j2`
+    :return: libnftables JSON document, to be applied with `nft -j -f`
+    """
+    drop_proba, log_type, log_group = nft_dict["drop_proba"], nft_dict["log_type"], nft_dict["log_group"]
+    hook = nft_dict["hook"]
+    family, table = hook["family"], nft_dict["device"]["name"]
+    rule = lambda chain, statements: get_rule(family, table, chain, statements)
+
+    objects = [{"metainfo": {"json_schema_version": json_schema_version}}]
+    objects.append({"table": {"family": family, "name": table}})
+
+    # Declarations
+    for nft_set in nft_dict.get("nft_sets", []):
+        objects.append({"set": {
+            "family": family, "table": table, "name": nft_set["name"], "type": get_set_type(nft_set["type"]),
+            "flags": ["interval"], "auto-merge": True, "elem": [get_element(element) for element in nft_set["elements"]]
+        }})
+    for nft_limit in nft_dict.get("nft_limits", []):
+        objects.append({"limit": dict({"family": family, "table": table, "name": nft_limit["name"]}, **get_limit(nft_limit["rate"]))})
+    for nft_meter in nft_dict.get("nft_meters", []):
+        objects.append({"set": {
+            "family": family, "table": table, "name": nft_meter["name"], "type": get_set_type(nft_meter["type"]),
+            "flags": ["dynamic", "timeout"], "timeout": parse_duration(nft_meter["timeout"])
+        }})
+    for nft_counter in nft_dict.get("nft_counters", []):
+        objects.append({"counter": {"family": family, "table": table, "name": nft_counter["name"], "packets": 0, "bytes": 0}})
+    for timer in nft_dict.get("nft_timers", []):
+        objects.append({"set": {
+            "family": family, "table": table, "name": timer["name"], "type": {"typeof": {"ct": {"key": "id"}}},
+            "flags": ["dynamic", "timeout"]
+        }})
+
+    # Chain skipping connection tracking
+    if nft_dict.get("notrack", []):
+        objects.append(get_chain(family, table, "notrack", {"hook": "prerouting", "priority": -300}))
+        for nft_matches in nft_dict["notrack"]:
+            objects.append(rule("notrack", get_matches_json(nft_matches) + [{"notrack": None}]))
+
+    # Base chain
+    objects.append(get_chain(family, table, hook["hook"], hook))
+    if nft_dict.get("device_mac", None):
+        device_mac = nft_dict["device_mac"]
+        objects.append(rule(hook["hook"], [
+            {"match": {"op": "!=", "left": {"meta": {"key": "pkttype"}}, "right": {"set": ["broadcast", "multicast"]}}},
+            {"match": {"op": "!=", "left": {"payload": {"protocol": "ether", "field": "saddr"}}, "right": device_mac}},
+            {"match": {"op": "!=", "left": {"payload": {"protocol": "ether", "field": "daddr"}}, "right": device_mac}},
+            {"return": None}
+        ]))
+    for timer in nft_dict.get("nft_timers", []):
+        # Start the duration timer of the new connections
+        objects.append(rule(hook["hook"], get_matches_json(timer["nft_matches"]) + [
+            {"match": {"op": "==", "left": {"ct": {"key": "state"}}, "right": "new"}},
+            {"set": {"op": "add", "elem": {"elem": {"val": {"ct": {"key": "id"}}, "timeout": timer["timeout"]}}, "set": f"@{timer['name']}"}}
+        ]))
+    if nft_dict.get("ct_marks", None):
+        objects.append(rule(hook["hook"], [
+            {"match": {"op": "==", "left": {"ct": {"key": "mark"}}, "right": nft_dict["ct_marks"]["drop"]}},
+            {"drop": None}
+        ]))
+    for nfqueue in nft_dict["nfqueues"]:
+        objects.append(rule(hook["hook"], nfqueue.get_nft_json(drop_proba, log_type, log_group)))
+
+    # Regular chains
+    for sub_chain in nft_dict.get("sub_chains", []):
+        objects.append(get_chain(family, table, sub_chain.name))
+        for nfqueue in sub_chain.rules:
+            objects.append(rule(sub_chain.name, nfqueue.get_nft_json(drop_proba, log_type, log_group)))
+    for verdict_chain in nft_dict.get("verdict_chains", []):
+        objects.append(get_chain(family, table, verdict_chain["name"]))
+        objects.append(rule(verdict_chain["name"], verdict_chain["nfqueue"].get_nft_json(drop_proba, log_type, log_group)))
+
+    # Table dropping the device's traffic at netdev ingress
+    if nft_dict.get("early_drop", None) and nft_dict.get("early_drops", []):
+        early_table = f"{table}_early"
+        objects.append({"table": {"family": "netdev", "name": early_table}})
+        objects.append(get_chain("netdev", early_table, "ingress",
+                                 {"hook": "ingress", "priority": -500, "device": nft_dict["early_drop"]}))
+        for nfqueue in nft_dict["early_drops"]:
+            objects.append(get_rule("netdev", early_table, "ingress", nfqueue.get_nft_json(drop_proba, log_type, log_group)))
+
+    # Table offloading the established flows
+    flowtable = nft_dict.get("flowtable", None)
+    if flowtable:
+        offload_table = f"{table}_offload"
+        objects.append({"table": {"family": "inet", "name": offload_table}})
+        objects.append({"flowtable": {
+            "family": "inet", "table": offload_table, "name": "ft", "hook": "ingress", "prio": 0, "dev": list(flowtable["devices"])
+        }})
+        objects.append(get_chain("inet", offload_table, "forward", {"hook": "forward", "priority": 0}))
+        for exclusion in flowtable["exclusions"]:
+            objects.append(get_rule("inet", offload_table, "forward", get_matches_json(exclusion) + [{"return": None}]))
+        objects.append(get_rule("inet", offload_table, "forward", [
+            {"match": {"op": "==", "left": {"ct": {"key": "state"}}, "right": "established"}},
+            {"flow": {"op": "add", "flowtable": "@ft"}}
+        ]))
+
+    return {"nftables": objects}
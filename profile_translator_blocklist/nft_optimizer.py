@@ -0,0 +1,1114 @@
+"""
+Optimization passes over the NFQueue objects of a profile,
+to reduce the number of nftables rules every packet is evaluated against.
+"""
+
+import re
+import heapq
+from bisect import bisect_right
+from .LogType import LogType
+from .NFQueue import NFQueue
+from .VerdictMap import VerdictMap
+from .SubChain import SubChain
+from .nft_utils import field_types, implied_matches, split_elements, parse_value, get_rule_fields, may_overlap, is_subset, get_counter_names, format_matches
+
+
+### VARIABLES ###
+
+# Maximum number of elements of an anonymous set,
+# above which a named set is declared instead
+max_anonymous_set_size = 16
+
+# Templates of the matches rules are dispatched on, by sub-chain level
+dispatch_templates = [
+    "ether type {}",
+    "meta l4proto {}",
+    "ip saddr {}",
+    "ip daddr {}",
+    "ip6 saddr {}",
+    "ip6 daddr {}"
+]
+
+# Minimum number of rules sharing a match for them to be moved to a sub-chain
+min_sub_chain_size = 4
+
+# Templates of the address matches which can be shared between devices, with their nftables type
+address_templates = {
+    "ip saddr {}":  "ipv4_addr",
+    "ip daddr {}":  "ipv4_addr",
+    "ip6 saddr {}": "ipv6_addr",
+    "ip6 daddr {}": "ipv6_addr"
+}
+
+# Templates of the matches which have the same value for all packets of a flow direction,
+# and can be evaluated in an inet table, with the template matching the reply direction
+flow_templates = {
+    "meta l4proto {}": "meta l4proto {}",
+    "ip saddr {}":     "ip daddr {}",
+    "ip daddr {}":     "ip saddr {}",
+    "ip6 saddr {}":    "ip6 daddr {}",
+    "ip6 daddr {}":    "ip6 saddr {}",
+    "tcp sport {}":    "tcp dport {}",
+    "tcp dport {}":    "tcp sport {}",
+    "udp sport {}":    "udp dport {}",
+    "udp dport {}":    "udp sport {}"
+}
+
+# Templates of the matches on a flow's tuple,
+# with the conntrack expression of the same field in the flow's original direction,
+# and the value matching any value of the field
+ct_tuple_templates = {
+    "ip saddr {}":  ("ct original ip saddr", "0.0.0.0/0"),
+    "ip daddr {}":  ("ct original ip daddr", "0.0.0.0/0"),
+    "ip6 saddr {}": ("ct original ip6 saddr", "::/0"),
+    "ip6 daddr {}": ("ct original ip6 daddr", "::/0"),
+    "tcp sport {}": ("ct original proto-src", "0-65535"),
+    "tcp dport {}": ("ct original proto-dst", "0-65535"),
+    "udp sport {}": ("ct original proto-src", "0-65535"),
+    "udp dport {}": ("ct original proto-dst", "0-65535")
+}
+
+# Destination addresses of the multicast and broadcast traffic, by match template
+multicast_addresses = {
+    "ip daddr {}":  parse_value("{ 224.0.0.0/4, 255.255.255.255 }", "ipv4_addr"),
+    "ip6 daddr {}": parse_value("ff00::/8", "ipv6_addr")
+}
+
+# Templates of the source address matches, with the key of the corresponding device address
+source_templates = {
+    "ether saddr {}": "mac",
+    "ip saddr {}":    "ipv4",
+    "ip6 saddr {}":   "ipv6"
+}
+
+# Key of the per-source meters, by protocol family of the rule's matches, with their nftables type
+meter_keys = {
+    "ip6 ": ("ip6 saddr", "ipv6_addr"),
+    "ip ":  ("ip saddr", "ipv4_addr"),
+    "":     ("ether saddr", "ether_addr")
+}
+
+# Timeout of the per-source meters' elements, after which an idle source's bucket is freed
+meter_timeout = "1m"
+
+
+### FUNCTIONS ###
+
+def is_kernel_only(nfqueue: NFQueue) -> bool:
+    """
+    Check whether an NFQueue object's rule gives a final verdict in the kernel,
+    without queueing packets to user space nor updating a stateful match.
+
+    :param nfqueue: NFQueue object to check
+    :return: True if the NFQueue object's rule is kernel-only and stateless, False otherwise
+    """
+    return nfqueue.queue_num < 0 and nfqueue.nft_stats.get("rate", {}).get("match", 0) == 0
+
+
+def get_map_key(nfqueue: NFQueue) -> tuple:
+    """
+    Get the key of the verdict map an NFQueue object's rule can be part of,
+    i.e. the templates of its matches, if they all match a single exact value.
+
+    :param nfqueue: NFQueue object to check
+    :return: sorted tuple of the templates of the NFQueue object's matches,
+             or None if the NFQueue object's rule cannot be part of a verdict map
+    """
+    if not nfqueue.nft_matches or any(stat != "rate" or data["match"] != 0 for stat, data in nfqueue.nft_stats.items()):
+        return None
+    for nft_match in nfqueue.nft_matches:
+        elements = split_elements(nft_match["match"])
+        if elements is None or len(elements) != 1 or "/" in elements[0] or "-" in elements[0]:
+            return None
+        values = parse_value(elements[0], field_types.get(nft_match["template"], None))
+        if values is None or len(values) != 1:
+            return None
+    return tuple(sorted(nft_match["template"] for nft_match in nfqueue.nft_matches))
+
+
+def get_set_name(nfqueue: NFQueue, template: str) -> str:
+    """
+    Build the name of the named set replacing a match of an NFQueue object's rule,
+    e.g. `lan_tcp_ip_daddr` for the `ip daddr {}` match of NFQueue `lan-tcp`.
+
+    :param nfqueue: NFQueue object the set belongs to
+    :param template: template of the match replaced by the set
+    :return: name of the named set
+    """
+    field = "_".join(word for word in template.split() if word != "{}")
+    return f"{nfqueue.get_name_slug()}_{field}"
+
+
+def merge_into_sets(
+        nfqueues:      list,
+        log_type:      LogType = LogType.NONE,
+        max_anonymous: int     = max_anonymous_set_size,
+        prefix:        str     = ""
+    ) -> tuple:
+    """
+    Merge the rules of NFQueue objects which only differ in the value of one match,
+    e.g. `ip daddr a drop` and `ip daddr b drop`, into a single rule matching a set,
+    e.g. `ip daddr { a, b } drop`.
+    Only kernel-only, stateless rules are merged, as they all share the same verdict.
+    A rule is only moved up to the position of the merged rule
+    if it cannot match the same packets as the other rules in between.
+    Rules are not merged if they are logged with their name (CSV logging).
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param log_type: type of packet logging used
+    :param max_anonymous: maximum number of elements of an anonymous set,
+                          above which a named set is declared instead
+    :param prefix: prefix of the names of the named sets
+    :return: list of NFQueue objects after merging, in rule order,
+             and list of named sets to declare, as dictionaries with keys "name", "type" and "elements"
+    """
+    if log_type == LogType.CSV:
+        return list(nfqueues), []
+
+    groups = []         # Groups of merged NFQueue objects, by position of their first member
+    groups_by_key = {}  # Index of the groups which can still be joined, by key of their common matches
+    keys_by_group = {}  # Keys under which each group is indexed, by group position
+    barriers = []       # Positions of the rules which cannot be merged
+    barrier_fields = [] # Analysis of the rules which cannot be merged
+
+    for nfqueue in nfqueues:
+        position = len(groups)
+        groups.append([nfqueue])
+
+        if not is_kernel_only(nfqueue):
+            barriers.append(position)
+            barrier_fields.append(get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats))
+            continue
+
+        # Candidate keys: one per match which can be turned into a set
+        stats_key = NFQueue.get_matches_key(list(nfqueue.nft_stats.values()))
+        keys = []
+        for i, nft_match in enumerate(nfqueue.nft_matches):
+            if split_elements(nft_match["match"]) is None:
+                continue
+            others = nfqueue.nft_matches[:i] + nfqueue.nft_matches[i+1:]
+            keys.append((nft_match["template"], NFQueue.get_matches_key(others), stats_key))
+
+        # Join the first group this rule can safely be moved up to
+        fields = None
+        joined = False
+        for key in keys:
+            head = groups_by_key.get(key, None)
+            if head is None:
+                continue
+            if fields is None:
+                fields = get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats)
+            between = range(bisect_right(barriers, head), len(barriers))
+            if any(may_overlap(fields, barrier_fields[j]) for j in between):
+                continue
+            groups[head].append(nfqueue)
+            groups[position] = None
+            # The group now varies on this key's match only
+            for other_key in keys_by_group.pop(head, []):
+                if other_key != key:
+                    groups_by_key.pop(other_key, None)
+            keys_by_group[head] = [key]
+            joined = True
+            break
+
+        if not joined:
+            for key in keys:
+                groups_by_key.setdefault(key, position)
+            keys_by_group[position] = [key for key in keys if groups_by_key[key] == position]
+
+    # Build the merged NFQueue objects
+    result = []
+    nft_sets = []
+    for position, group in enumerate(groups):
+        if group is None:
+            continue
+        if len(group) == 1:
+            result.append(group[0])
+            continue
+
+        head = group[0]
+        template = keys_by_group[position][0][0]
+        elements = {}  # Insertion-ordered set of the elements of the merged match
+        for nfqueue in group:
+            nft_match = next(m for m in nfqueue.nft_matches if m["template"] == template)
+            for element in split_elements(nft_match["match"]):
+                elements[element] = None
+        elements = list(elements)
+
+        if len(elements) > max_anonymous and template in field_types and field_types[template] != "integer":
+            nft_set = {
+                "name": prefix + get_set_name(head, template),
+                "type": field_types[template],
+                "elements": elements
+            }
+            nft_sets.append(nft_set)
+            merged_match = f"@{nft_set['name']}"
+        else:
+            merged_match = "{ " + ", ".join(elements) + " }"
+
+        nft_matches = [
+            {"template": m["template"], "match": merged_match} if m["template"] == template else m
+            for m in head.nft_matches
+        ]
+        merged = NFQueue(head.name, nft_matches, head.queue_num, head.workers)
+        merged.nft_stats = head.nft_stats
+        merged.policies = [policy for nfqueue in group for policy in nfqueue.policies]
+        result.append(merged)
+
+    return result, nft_sets
+
+
+def build_verdict_maps(
+        nfqueues:   list,
+        drop_proba: float   = 1.0,
+        log_type:   LogType = LogType.NONE,
+        log_group:  int     = 100,
+        prefix:     str     = ""
+    ) -> tuple:
+    """
+    Replace the rules of NFQueue objects which match exact values of the same fields,
+    e.g. `ip daddr a tcp dport 443 drop` and `ip daddr b tcp dport 80 queue num 10`,
+    by a single verdict map rule on the concatenation of these fields,
+    e.g. `ip daddr . tcp dport vmap { a . 443 : drop, b . 80 : jump <chain> }`.
+    Verdicts which cannot be map values (queueing, logging) jump to a dedicated verdict chain.
+    A rule is only moved up to the position of the verdict map
+    if it cannot match the same packets as the other rules in between.
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param drop_proba: dropping probability applied to matched traffic
+    :param log_type: type of packet logging used
+    :param log_group: log group ID used
+    :param prefix: prefix of the names of the verdict chains
+    :return: list of NFQueue and VerdictMap objects, in rule order,
+             and list of verdict chains to declare, as dictionaries with keys
+             "name", "rule" (nftables rule of the chain) and "nfqueue" (NFQueue object giving this rule)
+    """
+    keys = [get_map_key(nfqueue) for nfqueue in nfqueues]
+    fields = [get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats) for nfqueue in nfqueues]
+    groups = []         # Positions of the members of each group, by position of their first member
+    groups_by_key = {}  # Index of the groups which can still be joined, by verdict map key
+
+    for position, key in enumerate(keys):
+        groups.append([position])
+        if key is None:
+            continue
+        head = groups_by_key.get(key, None)
+        if head is not None:
+            # Rules with the same key match different exact values, hence cannot overlap
+            members = set(groups[head])
+            if not any(
+                    k not in members and keys[k] != key and may_overlap(fields[position], fields[k])
+                    for k in range(head + 1, position)
+                ):
+                groups[head].append(position)
+                groups[position] = None
+                continue
+        groups_by_key[key] = position
+
+    # Build the verdict maps
+    result = []
+    verdict_chains = {}  # Verdict chains, indexed by rule
+    for position, group in enumerate(groups):
+        if group is None:
+            continue
+        if len(group) == 1:
+            result.append(nfqueues[position])
+            continue
+
+        head = nfqueues[position]
+        verdict_map = VerdictMap(head.name, [nft_match["template"] for nft_match in head.nft_matches])
+        for member in group:
+            nfqueue = nfqueues[member]
+            verdict_rule = NFQueue(nfqueue.name, [], nfqueue.queue_num, nfqueue.workers)
+            verdict_rule.policies = nfqueue.policies
+            rule = verdict_rule.get_nft_rule(drop_proba, log_type, log_group)
+            if rule in ["drop", "accept"]:
+                verdict = rule
+            else:
+                if rule not in verdict_chains:
+                    verdict_chains[rule] = {"name": f"{prefix}{nfqueue.get_name_slug()}_verdict", "rule": rule, "nfqueue": verdict_rule}
+                verdict = f"jump {verdict_chains[rule]['name']}"
+            verdict_map.add_nfqueue(nfqueue, verdict)
+        result.append(verdict_map)
+
+    return result, list(verdict_chains.values())
+
+
+def get_dispatch_value(rule: object, template: str) -> str:
+    """
+    Get the single exact value a rule matches for the given match template,
+    either explicitly (e.g. `meta l4proto tcp`) or implicitly (e.g. `tcp dport 80` implies `meta l4proto tcp`).
+
+    :param rule: rule to check (NFQueue, VerdictMap or SubChain object)
+    :param template: match template to get the value of
+    :return: value matched by the rule, as it appears in the nftables script,
+             or None if the rule does not match a single exact value
+    """
+    if not isinstance(rule, NFQueue):
+        return None
+    for nft_match in rule.nft_matches:
+        if nft_match["template"] == template:
+            elements = split_elements(nft_match["match"])
+            if elements is None or len(elements) != 1:
+                return None
+            values = parse_value(elements[0], field_types.get(template, None))
+            return elements[0] if values is not None and len(values) == 1 else None
+    for nft_match in rule.nft_matches:
+        for prefix, implied in implied_matches.items():
+            if nft_match["template"].startswith(prefix):
+                for implied_template, implied_match in implied:
+                    if implied_template == template:
+                        return implied_match
+    return None
+
+
+def strip_match(nfqueue: NFQueue, template: str) -> NFQueue:
+    """
+    Copy an NFQueue object, without the match with the given template,
+    which is checked by the jump rule of the sub-chain the copy belongs to.
+
+    :param nfqueue: NFQueue object to copy
+    :param template: template of the match to remove
+    :return: copy of the NFQueue object, without the given match
+    """
+    nft_matches = [nft_match for nft_match in nfqueue.nft_matches if nft_match["template"] != template]
+    stripped = NFQueue(nfqueue.name, nft_matches, nfqueue.queue_num, nfqueue.workers)
+    stripped.nft_stats = nfqueue.nft_stats
+    stripped.policies = nfqueue.policies
+    return stripped
+
+
+def build_chain_tree(
+        rules:     list,
+        templates: list = dispatch_templates,
+        min_size:  int  = min_sub_chain_size,
+        prefix:    str  = ""
+    ) -> tuple:
+    """
+    Factor the matches shared by rules, e.g. `meta l4proto tcp`, into jump rules to sub-chains,
+    so that each packet only evaluates the rules relevant to its protocol family.
+    Rules are dispatched on the first given match template, then recursively on the next ones.
+    A rule is only moved up to the position of the jump rule
+    if it cannot match the same packets as the other rules in between.
+    As sub-chains are jumped to, packets matching none of their rules
+    continue with the rules following the jump rule, which preserves the verdicts.
+
+    :param rules: list of rules, in order (NFQueue, VerdictMap or SubChain objects)
+    :param templates: templates of the matches to dispatch on, by sub-chain level
+    :param min_size: minimum number of rules sharing a match for them to be moved to a sub-chain
+    :param prefix: prefix of the names of the sub-chains
+    :return: list of rules, in order, with the dispatched rules replaced by SubChain objects,
+             and list of all SubChain objects to declare, including nested ones
+    """
+    if not templates:
+        return list(rules), []
+
+    template = templates[0]
+    values = [get_dispatch_value(rule, template) for rule in rules]
+    fields = []
+    for rule in rules:
+        if isinstance(rule, NFQueue):
+            fields.append(get_rule_fields(rule.nft_matches, rule.nft_stats))
+        elif isinstance(rule, SubChain):
+            # Upper bound of the packets matched by the sub-chain's rules
+            fields.append(get_rule_fields([rule.nft_match]))
+        else:
+            fields.append(None)
+    groups = []           # Positions of the members of each group, by position of their first member
+    groups_by_value = {}  # Index of the groups which can still be joined, by dispatch value
+
+    def overlap(i: int, j: int) -> bool:
+        return fields[i] is None or fields[j] is None or may_overlap(fields[i], fields[j])
+
+    for position, value in enumerate(values):
+        groups.append([position])
+        if value is None:
+            continue
+        head = groups_by_value.get(value, None)
+        if head is not None:
+            # Rules matching another single value of the dispatch field cannot overlap
+            members = set(groups[head])
+            if not any(
+                    k not in members and (values[k] is None or values[k] == value) and overlap(position, k)
+                    for k in range(head + 1, position)
+                ):
+                groups[head].append(position)
+                groups[position] = None
+                continue
+        groups_by_value[value] = position
+
+    # Build the sub-chains, for the groups which are large enough
+    moved = set()
+    heads = {}
+    for position, group in enumerate(groups):
+        if group is not None and len(group) >= min_size:
+            heads[position] = group
+            moved.update(group)
+
+    result = []
+    sub_chains = []
+    names = set()
+    field = "_".join(word for word in template.split() if word != "{}")
+    for position, rule in enumerate(rules):
+        if position in heads:
+            base_name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}{field}_{values[position]}")
+            name = base_name
+            suffix = 2
+            while name in names:
+                name = f"{base_name}_{suffix}"
+                suffix += 1
+            names.add(name)
+            members = [strip_match(rules[member], template) for member in heads[position]]
+            chain_rules, nested = build_chain_tree(members, templates[1:], min_size, f"{name}_")
+            sub_chain = SubChain(name, {"template": template, "match": values[position]}, chain_rules)
+            result.append(sub_chain)
+            sub_chains.append(sub_chain)
+            sub_chains += nested
+        elif position not in moved:
+            result.append(rule)
+
+    # Dispatch the remaining rules on the next match template
+    result, nested = build_chain_tree(result, templates[1:], min_size, prefix)
+    return result, sub_chains + nested
+
+
+def share_addresses(devices: list, min_devices: int = 2) -> list:
+    """
+    Replace the exact IP addresses matched by the rules of multiple devices,
+    e.g. the gateway's or a phone's, by references to named sets shared by these devices,
+    e.g. `ip daddr @addr_192_168_1_1`.
+
+    :param devices: lists of rules of each device, as lists of rule lists (one per chain),
+                    which are modified in place
+    :param min_devices: minimum number of devices matching an address for it to be shared
+    :return: list of named sets to declare, as dictionaries with keys "name", "type" and "elements"
+    """
+    def get_address(nft_match: dict) -> str:
+        if nft_match["template"] not in address_templates:
+            return None
+        elements = split_elements(nft_match["match"])
+        if elements is None or len(elements) != 1:
+            return None
+        values = parse_value(elements[0], address_templates[nft_match["template"]])
+        return elements[0] if values is not None and len(values) == 1 else None
+
+    # Devices matching each address
+    users = {}
+    for idx, rule_lists in enumerate(devices):
+        for rules in rule_lists:
+            for rule in rules:
+                if not isinstance(rule, NFQueue):
+                    continue
+                for nft_match in rule.nft_matches:
+                    address = get_address(nft_match)
+                    if address is not None:
+                        users.setdefault((address_templates[nft_match["template"]], address), set()).add(idx)
+
+    # Named sets, in order of first use
+    nft_sets = {}
+    for (set_type, address), idxs in users.items():
+        if len(idxs) >= min_devices:
+            name = re.sub(r"[^a-zA-Z0-9_]", "_", f"addr_{address}")
+            nft_sets[address] = {"name": name, "type": set_type, "elements": [address]}
+
+    # Replace the shared addresses by references to the named sets
+    for rule_lists in devices:
+        for rules in rule_lists:
+            for i, rule in enumerate(rules):
+                if not isinstance(rule, NFQueue) or not any(get_address(m) in nft_sets for m in rule.nft_matches):
+                    continue
+                nft_matches = []
+                for nft_match in rule.nft_matches:
+                    address = get_address(nft_match)
+                    if address in nft_sets:
+                        nft_match = {"template": nft_match["template"], "match": f"@{nft_sets[address]['name']}"}
+                    nft_matches.append(nft_match)
+                shared = NFQueue(rule.name, nft_matches, rule.queue_num, rule.workers)
+                shared.nft_stats = rule.nft_stats
+                shared.policies = rule.policies
+                rules[i] = shared
+
+    return list(nft_sets.values())
+
+
+def get_offload_exclusions(nfqueues: list, drop_proba: float = 1.0) -> list:
+    """
+    Compute the nftables matches of the flows which cannot be offloaded to a flowtable,
+    as the device's rules need to see their later packets,
+    i.e. flows queued to user space, subject to stateful or per-packet matches,
+    or given a stochastic verdict.
+    Flows only matching kernel rules on flow-constant fields are given their verdict on their first packet,
+    hence can be offloaded once established.
+
+    Offloaded flows bypass the rules in both directions,
+    therefore each exclusion is also given in the reply direction.
+    The matches which cannot be evaluated per flow are left out,
+    which only widens the exclusion.
+
+    :param nfqueues: list of NFQueue objects of the device, before any optimization pass
+    :param drop_proba: dropping probability applied to matched traffic
+    :return: list of the distinct matches of the flows to exclude from offloading,
+             as lists of nftables matches with the form {"template": ..., "match": ...},
+             in order, or None if no flow can be offloaded
+    """
+    exclusions = {}  # Exclusions, indexed by their nftables match, in insertion order
+    for nfqueue in nfqueues:
+        per_flow = all(nft_match["template"] in flow_templates for nft_match in nfqueue.nft_matches)
+        stateless = all(stat["match"] == 0 for stat in nfqueue.nft_stats.values())
+        if nfqueue.queue_num < 0 and drop_proba in [0.0, 1.0] and per_flow and stateless:
+            continue
+
+        nft_matches = [nft_match for nft_match in nfqueue.nft_matches if nft_match["template"] in flow_templates]
+        if not nft_matches:
+            # All flows might need inspection
+            return None
+        for reply in [False, True]:
+            exclusion = [{"template": flow_templates[m["template"]], "match": m["match"]} if reply else m for m in nft_matches]
+            exclusions.setdefault(format_matches(exclusion), exclusion)
+
+    return list(exclusions.values())
+
+
+def build_rate_limits(nfqueues: list, per_source: bool = False, prefix: str = "") -> tuple:
+    """
+    Replace the anonymous rate limits of NFQueue objects' rules, e.g. `limit rate over 10/second`,
+    by named limit objects, e.g. `limit name "<name>"`, which can be listed and reset at runtime,
+    or by per-source meters, e.g. `update @<name> { ip saddr limit rate over 10/second }`,
+    which give each source host its own bucket.
+    Meters are keyed on the source address of the rule's protocol family,
+    or on the source MAC address if the rule does not match an IP family.
+    Besides their nftables match, the replaced rate stats keep the name of their limit or meter,
+    and the key and rate of their meter, to be rendered to JSON.
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param per_source: use per-source meters instead of named limits
+    :param prefix: prefix of the names of the limits and meters
+    :return: list of NFQueue objects, in rule order,
+             list of named limits to declare, as dictionaries with keys "name" and "rate",
+             and list of meters to declare, as dictionaries with keys "name", "type" and "timeout"
+    """
+    result = []
+    nft_limits = []
+    nft_meters = []
+    names = set()
+    for nfqueue in nfqueues:
+        rate = nfqueue.nft_stats.get("rate", {}).get("match", 0)
+        if rate == 0:
+            result.append(nfqueue)
+            continue
+
+        base_name = f"{prefix}{nfqueue.get_name_slug()}_{'meter' if per_source else 'rate'}"
+        name = base_name
+        suffix = 2
+        while name in names:
+            name = f"{base_name}_{suffix}"
+            suffix += 1
+        names.add(name)
+
+        if per_source:
+            family = next(
+                family for family in meter_keys
+                if any(nft_match["template"].startswith(family) for nft_match in nfqueue.nft_matches) or not family
+            )
+            key, key_type = meter_keys[family]
+            nft_meters.append({"name": name, "type": key_type, "timeout": meter_timeout})
+            rate_stat = {"template": "update @{}", "match": f"{name} {{ {key} limit rate over {rate} }}", "name": name, "key": key, "rate": rate}
+        else:
+            nft_limits.append({"name": name, "rate": rate})
+            rate_stat = {"template": "limit name {}", "match": f"\"{name}\"", "name": name}
+
+        limited = NFQueue(nfqueue.name, nfqueue.nft_matches, nfqueue.queue_num, nfqueue.workers)
+        limited.nft_stats = dict(nfqueue.nft_stats, rate=rate_stat)
+        limited.policies = nfqueue.policies
+        result.append(limited)
+
+    return result, nft_limits, nft_meters
+
+
+def add_counters(rules: list, sub_chains: list = [], prefix: str = "") -> tuple:
+    """
+    Add a named counter to the rule of each NFQueue object, in the chain and its sub-chains,
+    e.g. `... counter name "<name>" drop`, named after the NFQueue object (see `get_counter_names`).
+    The sub-chains' rules are updated in place.
+    Verdict map rules are left without counters, as they give multiple verdicts.
+
+    :param rules: list of rules of the chain, in order
+    :param sub_chains: list of sub-chains of the chain
+    :param prefix: prefix of the names of the counters
+    :return: list of rules of the chain, in order,
+             and list of counters to declare, as dictionaries with keys
+             "name" and "policies" (names of the policies whose traffic the counter counts)
+    """
+    nft_counters = []
+    nfqueues = [rule for rule in rules + [rule for sub_chain in sub_chains for rule in sub_chain.rules] if isinstance(rule, NFQueue)]
+    names = iter(get_counter_names(nfqueues, prefix))
+
+    def count(rule: object) -> object:
+        if not isinstance(rule, NFQueue):
+            return rule
+        name = next(names)
+        counted = NFQueue(rule.name, rule.nft_matches, rule.queue_num, rule.workers)
+        counted.nft_stats = rule.nft_stats
+        counted.policies = rule.policies
+        counted.counter = name
+        nft_counters.append({"name": name, "policies": [policy_dict["policy"].name for policy_dict in rule.policies]})
+        return counted
+
+    rules = [count(rule) for rule in rules]
+    for sub_chain in sub_chains:
+        sub_chain.rules = [count(rule) for rule in sub_chain.rules]
+    return rules, nft_counters
+
+
+def get_direction_keys(nfqueue: NFQueue) -> tuple:
+    """
+    Get the keys identifying an NFQueue object's rule, and the rule matching the reverse direction of the same flows,
+    i.e. the rule with swapped source and destination matches.
+
+    :param nfqueue: NFQueue object to check
+    :return: key of the rule, and key of the rule matching the reverse direction,
+             or None if the rule cannot be merged with the rule matching the reverse direction,
+             i.e. if it is not kernel-only and stateless, or does not match single values of its flow's tuple
+    """
+    if not is_kernel_only(nfqueue) or any(data["match"] != 0 for data in nfqueue.nft_stats.values()):
+        return None
+    tuple_matches = []
+    other_matches = []
+    for nft_match in nfqueue.nft_matches:
+        if nft_match["template"] not in ct_tuple_templates:
+            other_matches.append(nft_match)
+            continue
+        elements = split_elements(nft_match["match"])
+        if elements is None or len(elements) != 1:
+            return None
+        tuple_matches.append((nft_match["template"], elements[0]))
+    if not tuple_matches:
+        return None
+    others_key = NFQueue.get_matches_key(other_matches)
+    key = (frozenset(tuple_matches), others_key)
+    reverse_key = (frozenset((flow_templates[template], value) for template, value in tuple_matches), others_key)
+    return key, reverse_key
+
+
+def merge_directions(nfqueues: list, log_type: LogType = LogType.NONE) -> list:
+    """
+    Merge the rules of NFQueue objects matching both directions of the same flows,
+    e.g. `tcp sport 80 ip saddr a ip daddr b drop` and `tcp dport 80 ip saddr b ip daddr a drop`,
+    into a single rule matching the flows' original tuple against both orientations,
+    e.g. `meta l4proto tcp ct original ip saddr . ct original ip daddr . ct original proto-src . ct original proto-dst
+    { a . b . 80 . 0-65535, b . a . 0-65535 . 80 } drop`.
+    Only kernel-only, stateless rules are merged, as they all share the same verdict.
+    A rule is only moved up to the position of the rule matching the reverse direction
+    if it cannot match the same packets as the other rules in between.
+    Rules are not merged if they are logged with their name (CSV logging).
+    Untracked packets are not matched by the merged rules.
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param log_type: type of packet logging used
+    :return: list of NFQueue objects after merging, in rule order
+    """
+    if log_type == LogType.CSV:
+        return list(nfqueues)
+
+    groups = []           # Merged NFQueue objects, by position of the first one
+    heads_by_key = {}     # Positions of the rules which can still be merged, by key
+    barriers = []         # Positions of the rules which cannot be moved over
+    barrier_fields = []   # Analysis of the rules which cannot be moved over
+
+    for nfqueue in nfqueues:
+        position = len(groups)
+        groups.append([nfqueue])
+
+        if not is_kernel_only(nfqueue):
+            barriers.append(position)
+            barrier_fields.append(get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats))
+            continue
+
+        keys = get_direction_keys(nfqueue)
+        if keys is None:
+            continue
+        key, reverse_key = keys
+        head = heads_by_key.get(reverse_key, None) if reverse_key != key else None
+        if head is not None:
+            fields = get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats)
+            between = range(bisect_right(barriers, head), len(barriers))
+            if not any(may_overlap(fields, barrier_fields[j]) for j in between):
+                groups[head].append(nfqueue)
+                groups[position] = None
+                del heads_by_key[reverse_key]
+                continue
+        heads_by_key.setdefault(key, position)
+
+    # Build the merged NFQueue objects
+    result = []
+    for group in groups:
+        if group is None:
+            continue
+        if len(group) == 1:
+            result.append(group[0])
+            continue
+
+        head, tail = group
+        templates = [
+            template for template in ct_tuple_templates
+            if any(nft_match["template"] == template for nft_match in head.nft_matches + tail.nft_matches)
+        ]
+        elements = {}  # Insertion-ordered set of the elements of the merged match
+        for nfqueue in group:
+            values = {nft_match["template"]: nft_match["match"] for nft_match in nfqueue.nft_matches}
+            element = " . ".join(str(values.get(template, ct_tuple_templates[template][1])) for template in templates)
+            elements[element] = None
+
+        nft_matches = [nft_match for nft_match in head.nft_matches if nft_match["template"] not in ct_tuple_templates]
+        # The layer 4 protocol is implied by the port matches, but not by the conntrack expressions
+        protocols = [template.split()[0] for template in templates if template.startswith(("tcp ", "udp "))]
+        if protocols and not any(nft_match["template"] == "meta l4proto {}" for nft_match in nft_matches):
+            nft_matches.append({"template": "meta l4proto {}", "match": protocols[0]})
+        template = " . ".join(ct_tuple_templates[template][0] for template in templates) + " {}"
+        nft_matches.append({"template": template, "match": "{ " + ", ".join(elements) + " }"})
+        merged = NFQueue(head.name, nft_matches, head.queue_num, head.workers)
+        merged.nft_stats = head.nft_stats
+        merged.policies = head.policies + tail.policies
+        result.append(merged)
+
+    return result
+
+
+def depends_on_conntrack(nfqueue: NFQueue, ct_marks: bool = False, ct_directions: bool = False) -> bool:
+    """
+    Check whether the verdict given by an NFQueue object's rule depends on the packets' conntrack entries.
+
+    :param nfqueue: NFQueue object to check
+    :param ct_marks: whether the DROP verdicts given in user space are cached in the conntrack marks
+    :param ct_directions: whether the rules matching both directions of the same flows are merged
+                          into a rule matching the flows' conntrack original tuple
+    :return: True if the NFQueue object's rule depends on conntrack, False otherwise
+    """
+    if any(nft_match["template"].startswith("ct ") for nft_match in nfqueue.nft_matches):
+        return True
+    if any(data["match"] != 0 and data["template"].startswith("ct ") for data in nfqueue.nft_stats.values()):
+        return True
+    if ct_marks and nfqueue.queue_num >= 0:
+        return True
+    return ct_directions and get_direction_keys(nfqueue) is not None
+
+
+def get_notrack_matches(nfqueues: list, ct_marks: bool = False, ct_directions: bool = False) -> list:
+    """
+    Get the matches of the rules of NFQueue objects which only match multicast or broadcast traffic,
+    and whose verdict does not depend on conntrack, for this traffic to skip connection tracking.
+    A rule is only selected if it cannot match the same packets as a rule depending on conntrack.
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param ct_marks: whether the DROP verdicts given in user space are cached in the conntrack marks
+    :param ct_directions: whether the rules matching both directions of the same flows are merged
+                          into a rule matching the flows' conntrack original tuple
+    :return: list of the distinct matches of the traffic which can skip connection tracking,
+             as lists of nftables matches with the form {"template": ..., "match": ...}, in rule order
+    """
+    stateful_fields = [
+        get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats)
+        for nfqueue in nfqueues if depends_on_conntrack(nfqueue, ct_marks, ct_directions)
+    ]
+    result = {}  # Matches, indexed by their nftables match, in insertion order
+    for nfqueue in nfqueues:
+        if depends_on_conntrack(nfqueue, ct_marks, ct_directions):
+            continue
+        fields = get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats)
+        is_multicast = any(
+            fields["fields"].get(template, None) is not None and fields["fields"][template].issubset(addresses)
+            for template, addresses in multicast_addresses.items()
+        )
+        if not is_multicast or any(may_overlap(fields, other) for other in stateful_fields):
+            continue
+        result.setdefault(format_matches(nfqueue.nft_matches), list(nfqueue.nft_matches))
+    return list(result.values())
+
+
+def remove_conntrack_stats(nfqueues: list) -> tuple:
+    """
+    Remove the rules of NFQueue objects checking packet count or duration statistics,
+    which are read from the packets' conntrack entries,
+    for a table whose hook runs before connection tracking, e.g. netdev ingress.
+    Such rules never match there, hence are removed, along with the timers of their durations.
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :return: list of the remaining NFQueue objects, in rule order,
+             and list of the removed NFQueue objects, in rule order
+    """
+    kept = []
+    removed = []
+    for nfqueue in nfqueues:
+        if any(nfqueue.nft_stats.get(stat, {}).get("match", 0) != 0 for stat in ["packet-count", "duration"]):
+            removed.append(nfqueue)
+        else:
+            kept.append(nfqueue)
+    return kept, removed
+
+
+def split_early_drops(nfqueues: list, device: dict, drop_proba: float = 1.0) -> tuple:
+    """
+    Split the rules of NFQueue objects which drop traffic sent by the device,
+    to drop it at netdev ingress, on the device's port, before bridge processing.
+    Only kernel-only, stateless rules which do not depend on conntrack are moved,
+    if they only match the device's source address,
+    and cannot match the same packets as the queued rules before them.
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param device: device metadata, with its addresses
+    :param drop_proba: dropping probability of the kernel-only rules
+    :return: list of the remaining NFQueue objects, in rule order,
+             and list of the NFQueue objects dropping traffic at netdev ingress, in rule order
+    """
+    if drop_proba != 1.0:
+        return list(nfqueues), []
+
+    # Addresses of the device
+    device_addresses = {}
+    for template, key in source_templates.items():
+        address = device.get(key, None)
+        if address is not None:
+            addresses = parse_value(str(address).lower(), field_types[template])
+            if addresses is not None:
+                device_addresses[template] = addresses
+
+    remaining = []
+    early_drops = []
+    barrier_fields = []  # Analysis of the queued rules
+    for nfqueue in nfqueues:
+        fields = get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats)
+        if not is_kernel_only(nfqueue):
+            barrier_fields.append(fields)
+            remaining.append(nfqueue)
+            continue
+        is_stateless = all(data["match"] == 0 for data in nfqueue.nft_stats.values()) and not depends_on_conntrack(nfqueue)
+        from_device = any(
+            fields["fields"].get(template, None) is not None and template not in fields["inexact"]
+            and fields["fields"][template].issubset(addresses)
+            for template, addresses in device_addresses.items()
+        )
+        if is_stateless and from_device and not any(may_overlap(fields, other) for other in barrier_fields):
+            early_drops.append(nfqueue)
+        else:
+            remaining.append(nfqueue)
+    return remaining, early_drops
+
+
+def reorder_rules(nfqueues: list, hits: dict, prefix: str = "") -> list:
+    """
+    Reorder the rules of NFQueue objects so that the most matched rules are evaluated first,
+    without changing the verdict of any packet:
+    a rule is only moved before another one if no packet can match both.
+    Rules are greedily picked by decreasing number of hits,
+    among the rules which come after all the rules they might overlap with,
+    and stay in their original order otherwise.
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param hits: number of packets matched by each rule, by name of the rule's counter (see `get_counter_names`)
+    :param prefix: prefix of the names of the counters
+    :return: list of the NFQueue objects, in the new rule order
+    """
+    fields = [get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats) for nfqueue in nfqueues]
+    rule_hits = [hits.get(name, 0) for name in get_counter_names(nfqueues, prefix)]
+
+    # Rules which must stay after each rule, as they might match the same packets
+    successors = [[] for _ in nfqueues]
+    blockers = [0] * len(nfqueues)  # Number of rules each rule must stay after, which are not placed yet
+    for j in range(len(nfqueues)):
+        for i in range(j):
+            if may_overlap(fields[i], fields[j]):
+                successors[i].append(j)
+                blockers[j] += 1
+
+    # Place the most matched rule among the rules which can be placed
+    result = []
+    candidates = [(-rule_hits[j], j) for j in range(len(nfqueues)) if blockers[j] == 0]
+    heapq.heapify(candidates)
+    while candidates:
+        _, i = heapq.heappop(candidates)
+        result.append(nfqueues[i])
+        for j in successors[i]:
+            blockers[j] -= 1
+            if blockers[j] == 0:
+                heapq.heappush(candidates, (-rule_hits[j], j))
+
+    return result
+
+
+def get_cover_index_key(fields: dict) -> tuple:
+    """
+    Get the key under which a rule is indexed as a candidate to cover other rules,
+    i.e. the templates of its fields, and the template its values are looked up by,
+    which is its most selective field, e.g. `ip daddr` for a host rule.
+
+    :param fields: analysis of the rule, as returned by `get_rule_fields`
+    :return: sorted tuple of the templates of the rule's fields, and pivot template (None if the rule has no field),
+             or None if the rule's matched packets are not exactly known
+    """
+    if fields["stateful"] or fields["inexact"] or any(values is None for values in fields["fields"].values()):
+        return None
+    templates = tuple(sorted(fields["fields"]))
+
+    def share(template: str) -> tuple:
+        # Share of the field's domain matched by the rule
+        values = fields["fields"][template]
+        return (len(values) / (values.max_value + 1) if values.max_value is not None else len(values), template)
+
+    return templates, min(templates, key=share) if templates else None
+
+
+def add_cover_candidate(index: dict, fields: dict, position: int) -> None:
+    """
+    Index a rule as a candidate to cover other rules.
+    Single values of the pivot field are hashed, other intervals are scanned,
+    so that looking up the host rules of large profiles stays fast.
+
+    :param index: index of the candidate rules, by key as returned by `get_cover_index_key`,
+                  as dictionaries with keys "points" and "ranges"
+    :param fields: analysis of the rule, as returned by `get_rule_fields`
+    :param position: position of the rule
+    """
+    key = get_cover_index_key(fields)
+    if key is None:
+        return
+    entry = index.setdefault(key, {"points": {}, "ranges": []})
+    _, pivot = key
+    if pivot is None:
+        entry["ranges"].append((float("-inf"), float("inf"), position, fields))
+        return
+    for lower, upper in fields["fields"][pivot].intervals:
+        if lower == upper:
+            entry["points"].setdefault(lower, []).append((position, fields))
+        else:
+            entry["ranges"].append((lower, upper, position, fields))
+
+
+def find_cover_candidates(index: dict, fields: dict) -> list:
+    """
+    Find the indexed rules which match all packets matched by a rule.
+
+    :param index: index of the candidate rules, as built by `add_cover_candidate`
+    :param fields: analysis of the rule, as returned by `get_rule_fields`
+    :return: positions of the indexed rules covering the rule, in increasing order
+    """
+    result = set()
+    for (templates, pivot), entry in index.items():
+        if any(fields["fields"].get(template, None) is None for template in templates):
+            continue
+        candidates = [(position, other) for _, _, position, other in entry["ranges"]]
+        if pivot is not None:
+            values = fields["fields"][pivot]
+            if values.is_empty():
+                candidates += [candidate for points in entry["points"].values() for candidate in points]
+            else:
+                lower, upper = values.intervals[0]
+                if lower == upper:
+                    candidates += entry["points"].get(lower, [])
+                candidates = [
+                    (position, other) for position, other in candidates
+                    if other["fields"][pivot].contains_interval(lower, lower)
+                ]
+        result.update(position for position, other in candidates if is_subset(fields, other))
+    return sorted(result)
+
+
+def add_barrier(index: dict, fields: dict, position: int) -> None:
+    """
+    Index a rule which other rules cannot be moved past if they might match the same packets.
+    Single values of each field are hashed, so that the barriers a host rule might overlap are found quickly.
+
+    :param index: index of the barriers, with keys "fields" (analysis of the rules, by position),
+                  "positions" (positions of all barriers)
+                  and "templates" (barriers by template, as dictionaries with keys "points", "others" and "positions")
+    :param fields: analysis of the barrier, as returned by `get_rule_fields`
+    :param position: position of the barrier
+    """
+    index["fields"][position] = fields
+    index["positions"].append(position)
+    for template, values in fields["fields"].items():
+        entry = index["templates"].setdefault(template, {"points": {}, "others": [], "positions": set()})
+        entry["positions"].add(position)
+        if values is not None and len(values) == 1:
+            entry["points"].setdefault(values.intervals[0][0], []).append(position)
+        else:
+            entry["others"].append(position)
+
+
+def find_barriers(index: dict, fields: dict) -> list:
+    """
+    Find the indexed barriers which might match the same packets as a rule.
+    Only the barriers sharing the value of one of the rule's single-valued fields,
+    or not matching a single value of this field, are compared to the rule.
+
+    :param index: index of the barriers, as built by `add_barrier`
+    :param fields: analysis of the rule, as returned by `get_rule_fields`
+    :return: positions of the barriers which might match the same packets as the rule
+    """
+    candidates = index["positions"]
+    for template, values in fields["fields"].items():
+        entry = index["templates"].get(template, None)
+        if entry is None or values is None or len(values) != 1:
+            continue
+        num_missing = len(index["positions"]) - len(entry["positions"])
+        points = entry["points"].get(values.intervals[0][0], [])
+        if len(points) + len(entry["others"]) + num_missing < len(candidates):
+            candidates = points + entry["others"]
+            if num_missing > 0:
+                candidates += [position for position in index["positions"] if position not in entry["positions"]]
+    return [position for position in candidates if may_overlap(fields, index["fields"][position])]
+
+
+def remove_redundant_rules(nfqueues: list, log_type: LogType = LogType.NONE) -> tuple:
+    """
+    Remove the rules of NFQueue objects which never change the verdict of a packet:
+        - rules whose packets are all matched by an earlier stateless rule, hence never reached;
+        - kernel-only, stateless rules whose packets are all matched by a later kernel-only, stateless rule,
+          with the same verdict, if no other rule in between might match the same packets.
+    IP prefixes and port ranges are compared as intervals, e.g. a host rule is covered by a subnet rule.
+    Kernel-only rules are not merged into later rules if they are logged with their name (CSV logging).
+
+    :param nfqueues: list of NFQueue objects, in rule order
+    :param log_type: type of packet logging used
+    :return: list of the remaining NFQueue objects, in rule order,
+             and list of the removed NFQueue objects, as (removed, covering) tuples,
+             where `covering` is the NFQueue object matching all packets of the removed one
+    """
+    fields = [get_rule_fields(nfqueue.nft_matches, nfqueue.nft_stats) for nfqueue in nfqueues]
+    removed = []
+
+    # Rules shadowed by an earlier rule
+    shadowing = {}  # Index of the earlier rules which terminate evaluation
+    kept = []
+    for position, nfqueue in enumerate(nfqueues):
+        covering = find_cover_candidates(shadowing, fields[position])
+        if covering:
+            removed.append((nfqueue, nfqueues[covering[0]]))
+            continue
+        kept.append(position)
+        add_cover_candidate(shadowing, fields[position], position)
+    if log_type == LogType.CSV:
+        return [nfqueues[position] for position in kept], removed
+
+    # Kernel-only rules covered by a later kernel-only rule, with the same verdict
+    later = {}  # Index of the later kernel-only rules
+    barriers = {"fields": {}, "positions": [], "templates": {}}  # Index of the later rules which are not kernel-only
+    remaining = []
+    for position in reversed(kept):
+        nfqueue = nfqueues[position]
+        if not is_kernel_only(nfqueue):
+            add_barrier(barriers, fields[position], position)
+            remaining.append(position)
+            continue
+        covering = None
+        candidates = find_cover_candidates(later, fields[position])
+        if candidates:
+            # The rule's packets might not reach the covering rules after the first barrier it might overlap
+            first_barrier = min(find_barriers(barriers, fields[position]), default=len(nfqueues))
+            covering = next((candidate for candidate in candidates if candidate < first_barrier), None)
+        if covering is not None:
+            removed.append((nfqueue, nfqueues[covering]))
+            continue
+        remaining.append(position)
+        add_cover_candidate(later, fields[position], position)
+
+    return [nfqueues[position] for position in reversed(remaining)], removed
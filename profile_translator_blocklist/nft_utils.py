@@ -0,0 +1,333 @@
+"""
+nftables-related functions,
+to analyze the values matched by nftables rules.
+"""
+
+import re
+import ipaddress
+from fractions import Fraction
+from typing import Any
+from .ValueSet import ValueSet
+
+
+### VARIABLES ###
+
+# nftables data types of the supported match fields, indexed by match template
+field_types = {
+    "ether saddr {}":      "ether_addr",
+    "ether daddr {}":      "ether_addr",
+    "ether type {}":       "ether_type",
+    "arp operation {}":    "arp_op",
+    "arp saddr ether {}":  "ether_addr",
+    "arp daddr ether {}":  "ether_addr",
+    "arp saddr ip {}":     "ipv4_addr",
+    "arp daddr ip {}":     "ipv4_addr",
+    "ip saddr {}":         "ipv4_addr",
+    "ip daddr {}":         "ipv4_addr",
+    "ip6 saddr {}":        "ipv6_addr",
+    "ip6 daddr {}":        "ipv6_addr",
+    "ip length {}":        "integer",
+    "meta l4proto {}":     "inet_proto",
+    "tcp sport {}":        "inet_service",
+    "tcp dport {}":        "inet_service",
+    "udp sport {}":        "inet_service",
+    "udp dport {}":        "inet_service",
+    "icmp type {}":        "icmp_type",
+    "icmpv6 type {}":      "icmpv6_type"
+}
+
+# Upper bound of the value domain of each nftables data type
+type_max_values = {
+    "ether_addr":   2 ** 48 - 1,
+    "ether_type":   2 ** 16 - 1,
+    "arp_op":       2 ** 16 - 1,
+    "ipv4_addr":    2 ** 32 - 1,
+    "ipv6_addr":    2 ** 128 - 1,
+    "integer":      2 ** 16 - 1,
+    "inet_proto":   2 ** 8 - 1,
+    "inet_service": 2 ** 16 - 1,
+    "icmp_type":    2 ** 8 - 1,
+    "icmpv6_type":  2 ** 8 - 1
+}
+
+# Numeric values of the symbolic constants of each nftables data type
+symbolic_values = {
+    "ether_type": {"ip": 0x0800, "arp": 0x0806, "ip6": 0x86dd},
+    "arp_op": {"request": 1, "reply": 2},
+    "inet_proto": {"icmp": 1, "igmp": 2, "tcp": 6, "udp": 17, "ipv6-icmp": 58, "icmpv6": 58},
+    "inet_service": {"domain": 53, "bootps": 67, "bootpc": 68, "http": 80, "ntp": 123, "https": 443, "mqtt": 1883},
+    "icmp_type": {
+        "echo-reply": 0, "destination-unreachable": 3, "redirect": 5, "echo-request": 8,
+        "router-advertisement": 9, "router-solicitation": 10, "time-exceeded": 11
+    },
+    "icmpv6_type": {
+        "destination-unreachable": 1, "packet-too-big": 2, "time-exceeded": 3,
+        "echo-request": 128, "echo-reply": 129, "nd-router-solicit": 133, "nd-router-advert": 134,
+        "nd-neighbor-solicit": 135, "nd-neighbor-advert": 136
+    }
+}
+
+# Matches implied by the prefix of a match template,
+# e.g. `tcp dport 80` only matches TCP packets.
+implied_matches = {
+    "tcp ":    [("meta l4proto {}", "tcp")],
+    "udp ":    [("meta l4proto {}", "udp")],
+    "icmp ":   [("meta l4proto {}", "icmp"), ("ether type {}", "ip")],
+    "icmpv6 ": [("meta l4proto {}", "icmpv6"), ("ether type {}", "ip6")],
+    "ip ":     [("ether type {}", "ip")],
+    "ip6 ":    [("ether type {}", "ip6")],
+    "arp ":    [("ether type {}", "arp")]
+}
+
+# Maximum modulus of the random number generated to give a stochastic verdict in the kernel
+numgen_max_modulus = 10000
+
+
+### FUNCTIONS ###
+
+def get_random_threshold(drop_proba: float) -> tuple:
+    """
+    Get the modulus and threshold of the random number generated to drop packets with the given probability,
+    i.e. packets are dropped if the random number, between 0 and the modulus excluded, is below the threshold.
+    The probability is approximated by the closest fraction with a denominator up to `numgen_max_modulus`.
+
+    :param drop_proba: dropping probability, strictly between 0 and 1
+    :return: modulus and threshold, as a tuple
+    """
+    fraction = Fraction(drop_proba).limit_denominator(numgen_max_modulus)
+    modulus, threshold = fraction.denominator, fraction.numerator
+    if threshold == 0 or threshold == modulus:
+        # Probability too close to 0 or 1, use the finest resolution
+        modulus = numgen_max_modulus
+        threshold = min(max(round(drop_proba * modulus), 1), modulus - 1)
+    return modulus, threshold
+
+
+def get_random_verdict(drop_proba: float) -> str:
+    """
+    Build the nftables verdict which drops packets with the given probability, and accepts the others,
+    e.g. `numgen random mod 4 vmap { 0 : drop, 1-3 : accept }` for a probability of 0.25.
+
+    :param drop_proba: dropping probability, strictly between 0 and 1
+    :return: nftables verdict, as a `numgen` verdict map
+    """
+    modulus, threshold = get_random_threshold(drop_proba)
+    interval = lambda lower, upper: str(lower) if lower == upper else f"{lower}-{upper}"
+    return f"numgen random mod {modulus} vmap {{ {interval(0, threshold - 1)} : drop, {interval(threshold, modulus - 1)} : accept }}"
+
+
+def format_matches(nft_matches: list) -> str:
+    """
+    Format nftables matches, with the form {"template": ..., "match": ...}, as a single nftables match,
+    e.g. `meta l4proto tcp tcp dport 443`.
+
+    :param nft_matches: list of nftables matches
+    :return: nftables match, as a string
+    """
+    return " ".join(nft_match["template"].format(nft_match["match"]) for nft_match in nft_matches)
+
+
+def split_elements(match: Any) -> list:
+    """
+    Split an nftables match value into its elements,
+    e.g. `{ 80, 443 }` into `["80", "443"]`.
+
+    :param match: nftables match value
+    :return: list of elements of the match value, as strings,
+             or None if the match value is not a plain value or set of values (e.g. a negation)
+    """
+    value = str(match).strip()
+    if not value or value.startswith(("!=", "<", ">", "@", "$")):
+        return None
+    if value.startswith("{") and value.endswith("}"):
+        return [element.strip() for element in value[1:-1].split(",") if element.strip()]
+    return [value]
+
+
+def parse_element(element: str, value_type: str) -> tuple:
+    """
+    Parse a single nftables value, address prefix or range, as an interval of integers.
+
+    :param element: value to parse
+    :param value_type: nftables data type of the value
+    :return: closed interval, as a (lower, upper) tuple, or None if the value could not be parsed
+    """
+    element = element.strip()
+
+    # Range of values, e.g. 1000-2000 or 192.168.1.1-192.168.1.10
+    if "-" in element and value_type in ["ipv4_addr", "ipv6_addr", "integer", "inet_service", "inet_proto"]:
+        lower, _, upper = element.partition("-")
+        lower = parse_element(lower, value_type)
+        upper = parse_element(upper, value_type)
+        if lower is None or upper is None:
+            return None
+        return (lower[0], upper[1])
+
+    try:
+        if value_type in ["ipv4_addr", "ipv6_addr"]:
+            network = ipaddress.ip_network(element, strict=False)
+            return (int(network.network_address), int(network.broadcast_address))
+        if value_type == "ether_addr":
+            value = int(element.replace(":", ""), 16)
+            return (value, value)
+        if element in symbolic_values.get(value_type, {}):
+            value = symbolic_values[value_type][element]
+            return (value, value)
+        value = int(element, 0)
+        return (value, value)
+    except ValueError:
+        return None
+
+
+def parse_value(match: Any, value_type: str) -> ValueSet:
+    """
+    Parse an nftables match value as the set of values it matches.
+    Supports single values, prefixes, ranges, anonymous sets,
+    negations (`!= ...`) and comparisons (`< ...`, `>= ...`).
+
+    :param match: nftables match value
+    :param value_type: nftables data type of the value
+    :return: set of values matched, or None if the match value could not be parsed
+    """
+    if value_type not in type_max_values:
+        return None
+    max_value = type_max_values[value_type]
+    value = str(match).strip()
+
+    # Negation
+    if value.startswith("!="):
+        negated = parse_value(value[2:], value_type)
+        return negated.complement() if negated is not None else None
+
+    # Comparison
+    comparison = re.fullmatch(r"(<=|>=|<|>)\s*(\S+)", value)
+    if comparison:
+        operator, operand = comparison.groups()
+        interval = parse_element(operand, value_type)
+        if interval is None:
+            return None
+        bounds = {
+            "<":  (0, interval[0] - 1),
+            "<=": (0, interval[1]),
+            ">":  (interval[1] + 1, max_value),
+            ">=": (interval[0], max_value)
+        }
+        lower, upper = bounds[operator]
+        return ValueSet([(lower, upper)] if lower <= upper else [], max_value)
+
+    # Range with spaces, e.g. 100 - 200
+    value = re.sub(r"\s*-\s*", "-", value)
+
+    # Single value or anonymous set
+    elements = split_elements(value)
+    if elements is None:
+        return None
+    intervals = []
+    for element in elements:
+        interval = parse_element(element, value_type)
+        if interval is None:
+            return None
+        intervals.append(interval)
+    return ValueSet(intervals, max_value)
+
+
+def get_rule_fields(nft_matches: list, nft_stats: dict = {}) -> dict:
+    """
+    Analyze the values matched by an nftables rule, field by field.
+
+    :param nft_matches: list of nftables matches of the rule, with the form {"template": ..., "match": ...}
+    :param nft_stats: dictionary of nftables statistics of the rule, with the same form
+    :return: dictionary containing:
+                - "fields": mapping between each matched field (match template)
+                            and the set of values matched, or None if unknown
+                - "inexact": set of fields for which the set of values is only an upper bound
+                - "stateful": whether the rule contains stateful matches (e.g. rate limits)
+    """
+    result = {"fields": {}, "inexact": set(), "stateful": False}
+
+    def add_field(template: str, match: Any) -> None:
+        value_set = parse_value(match, field_types.get(template, None))
+        if value_set is None:
+            result["inexact"].add(template)
+            result["fields"].setdefault(template, None)
+            return
+        previous = result["fields"].get(template, None)
+        result["fields"][template] = value_set if previous is None else previous.intersection(value_set)
+
+    for nft_match in nft_matches:
+        template = nft_match["template"]
+        add_field(template, nft_match["match"])
+        for prefix, implied in implied_matches.items():
+            if template.startswith(prefix):
+                for implied_template, implied_match in implied:
+                    add_field(implied_template, implied_match)
+
+    for stat, data in nft_stats.items():
+        if stat == "rate":
+            result["stateful"] = result["stateful"] or data["match"] != 0
+        else:
+            add_field(data["template"], data["match"])
+
+    return result
+
+
+def may_overlap(fields_a: dict, fields_b: dict) -> bool:
+    """
+    Check whether a packet might be matched by two nftables rules.
+    Conservative: returns True unless the rules are provably disjoint.
+
+    :param fields_a: analysis of the first rule, as returned by `get_rule_fields`
+    :param fields_b: analysis of the second rule, as returned by `get_rule_fields`
+    :return: False if no packet can match both rules, True otherwise
+    """
+    for template, values_a in fields_a["fields"].items():
+        values_b = fields_b["fields"].get(template, None)
+        if values_a is not None and values_b is not None and values_a.isdisjoint(values_b):
+            return False
+    return True
+
+
+def is_subset(fields_a: dict, fields_b: dict) -> bool:
+    """
+    Check whether all packets matched by a first nftables rule are also matched by a second one.
+    Conservative: returns False unless the inclusion is provable.
+
+    :param fields_a: analysis of the first rule, as returned by `get_rule_fields`
+    :param fields_b: analysis of the second rule, as returned by `get_rule_fields`
+    :return: True if the first rule's matched packets are a subset of the second rule's, False otherwise
+    """
+    if fields_b["stateful"]:
+        return False
+    for template, values_b in fields_b["fields"].items():
+        if values_b is None or template in fields_b["inexact"]:
+            return False
+        values_a = fields_a["fields"].get(template, None)
+        if values_a is None or not values_a.issubset(values_b):
+            return False
+    return True
+
+
+def get_counter_names(nfqueues: list, prefix: str = "") -> list:
+    """
+    Get the names of the named counters of NFQueue objects' rules,
+    i.e. their prefixed name slugs, made unique by a numbered suffix, e.g. `<name>_2`.
+    The suffixes are given in the order of the NFQueue objects' names,
+    so that a rule keeps the name of its counter whatever the rule order,
+    e.g. once the rules are reordered or dispatched to sub-chains.
+
+    :param nfqueues: list of NFQueue objects
+    :param prefix: prefix of the names of the counters
+    :return: list of the names of the counters, in the order of the NFQueue objects
+    """
+    slugs = [f"{prefix}{nfqueue.get_name_slug()}" for nfqueue in nfqueues]
+    names = [None] * len(nfqueues)
+    taken = set()
+    for i in sorted(range(len(nfqueues)), key=lambda i: (slugs[i], nfqueues[i].name)):
+        name = slugs[i]
+        suffix = 2
+        while name in taken:
+            name = f"{slugs[i]}_{suffix}"
+            suffix += 1
+        taken.add(name)
+        names[i] = name
+    return names
@@ -0,0 +1,82 @@
+"""
+Generation of synthetic device profiles of a given size,
+mixing the code paths of the translator,
+for the scaling tests and the benchmarks of the generated artifacts.
+"""
+
+import ipaddress
+
+
+### VARIABLES ###
+
+# Device of the generated profiles
+generated_device = {
+    "name": "generated-device",
+    "mac":  "11:22:33:44:55:66",
+    "ipv4": "192.168.1.2"
+}
+
+
+### FUNCTIONS ###
+
+def generate_policies(num_policies: int) -> dict:
+    """
+    Generate policies mixing the code paths of the translator:
+    kernel-only policies, NFQueue policies sharing the same nftables match,
+    and NFQueue policies with domain names, each in its own NFQueue.
+
+    :param num_policies: number of policies to generate
+    :return: generated policies, by name
+    """
+    policies = {}
+    base_addr = ipaddress.IPv4Address("10.0.0.1")
+    for i in range(num_policies):
+        kind = i % 4
+        if kind == 0:
+            # TCP with a distinct host
+            policies[f"tcp-host-{i}"] = {
+                "protocols": {
+                    "tcp": {"dst-port": 443},
+                    "ipv4": {"src": "self", "dst": str(base_addr + i)}
+                },
+                "bidirectional": True
+            }
+        elif kind == 1:
+            # UDP with the gateway, on a distinct port
+            policies[f"udp-port-{i}"] = {
+                "protocols": {
+                    "udp": {"dst-port": 1024 + i},
+                    "ipv4": {"src": "self", "dst": "gateway"}
+                }
+            }
+        elif kind == 2:
+            # DNS query, all sharing the same nftables match
+            policies[f"dns-query-{i}"] = {
+                "protocols": {
+                    "dns": {"qtype": "A", "domain-name": f"host{i}.example.com"},
+                    "udp": {"dst-port": 53},
+                    "ipv4": {"src": "self", "dst": "gateway"}
+                },
+                "bidirectional": True
+            }
+        else:
+            # TCP with a domain name, on a distinct port
+            policies[f"tcp-domain-{i}"] = {
+                "protocols": {
+                    "tcp": {"dst-port": 8000 + i},
+                    "ipv4": {"src": "self", "dst": f"www.host{i}.example.com"}
+                },
+                "bidirectional": True
+            }
+    return policies
+
+
+def generate_profile(num_policies: int, device: dict = generated_device) -> dict:
+    """
+    Generate a device profile with the given number of policies.
+
+    :param num_policies: number of policies to generate
+    :param device: device metadata of the profile
+    :return: generated device profile
+    """
+    return {"device-info": dict(device), "single-policies": generate_policies(num_policies)}
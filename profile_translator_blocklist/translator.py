@@ -8,15 +8,22 @@ of NFTables firewall script and NFQueue C source code.
 from typing import Iterable
 import os
 import importlib
+import json
 import re
 import yaml
 from typing import Tuple
+from dataclasses import replace
 # Custom modules
 from .arg_types import uint16, proba, directory
 from .jinja_utils import create_jinja_env
 from .LogType import LogType
+from .RateLimitType import RateLimitType
+from .FirewallOptions import FirewallOptions
 from .Policy import Policy
 from .NFQueue import NFQueue
+from .hit_stats import load_hit_stats
+from .nft_json import get_firewall_json
+from .nft_optimizer import merge_into_sets, build_verdict_maps, build_chain_tree, share_addresses, get_offload_exclusions, build_rate_limits, add_counters, reorder_rules, merge_directions, get_notrack_matches, split_early_drops, remove_redundant_rules, remove_conntrack_stats
 from pyyaml_loaders import IncludeLoader
 
 # Package name
@@ -27,6 +34,25 @@ package = module_relative_path.rpartition(".")[0]
 import logging
 logger = logging.getLogger(module_relative_path)
 
+# Hooks of the base chain, on the router and in test mode (VM)
+production_hook = {"family": "bridge", "hook": "prerouting", "priority": 0, "device": None}
+test_hook = {"family": "netdev", "hook": "ingress", "priority": 0, "device": "enp0s8"}
+
+# Default NFQueue ID increment between policies
+nfq_id_inc = 10
+
+# Overload protection settings of the NFQueues
+queue_setting_keys = ["bypass", "maxlen", "fail-open"]
+
+# Options of the single-device firewall which are not supported in fleet mode
+fleet_unsupported_options = ["device_guard", "ct_marks", "offload", "flowtable_devices", "notrack", "early_drop", "remove_redundant", "json_output"]
+
+# Conntrack marks caching the verdicts of the connections judged in user space
+# Only DROP verdicts are cached: the later messages of an accepted connection must still be checked
+ct_mark_values = {
+    "drop": 2
+}
+
 
 ##### FUNCTIONS #####
 
@@ -61,6 +87,56 @@ def flatten_policies(single_policy_name: str, single_policy: dict, acc: dict = {
             flatten_policies(subpolicy, single_policy[subpolicy], acc)
 
 
+def get_hook(test: bool = False, *overrides: dict) -> dict:
+    """
+    Build the hook of a table's base chain,
+    from the default hook of the mode, overridden by the given settings, in order.
+
+    :param test: test mode: use the VM's ingress interface instead of the router's bridge
+    :param overrides: settings overriding the default hook, with keys "family", "hook", "priority" and "device",
+                      or None
+    :return: hook of the base chain, as a dictionary with keys "family", "hook", "priority" and "device"
+    :raises ValueError: if a setting is unknown, or if a netdev hook is not an ingress or egress hook on a device
+    """
+    hook = dict(test_hook if test else production_hook)
+    for override in overrides:
+        for key, value in (override or {}).items():
+            if key not in hook:
+                raise ValueError(f"\"{key}\" is not a valid hook setting (must be one of {', '.join(hook)})")
+            hook[key] = value
+    hook["priority"] = int(hook["priority"])
+    if hook["family"] == "netdev" and (hook["hook"] not in ["ingress", "egress"] or not hook["device"]):
+        raise ValueError("A netdev hook must be an ingress or egress hook on a device")
+    return hook
+
+
+def get_nfq_id_inc(workers: int = 1) -> int:
+    """
+    Get the NFQueue ID increment between policies,
+    large enough to hold the queues of the workers of both directions of a policy.
+
+    :param workers: number of worker threads per NFQueue
+    :return: NFQueue ID increment, as a multiple of 10
+    """
+    # Rounded up to a multiple of the default increment
+    return nfq_id_inc * -(-2 * workers // nfq_id_inc)
+
+
+def init_global_accs() -> dict:
+    """
+    Initialize the global accumulators used while parsing a profile's policies.
+
+    :return: dictionary containing the empty global accumulators
+    """
+    return {
+        "custom_parsers": set(),
+        "nfqueues": [],
+        "nfqueues_by_matches": {},  # Index of the NFQueues, by key of their nftables matches
+        "domain_names": {},         # Domain names, as an insertion-ordered set
+        "nft_timers": {}            # Timers of the duration counters, by name of their nftables set
+    }
+
+
 def parse_policy(
         policy_data: dict,
         global_accs: dict,
@@ -68,7 +144,9 @@ def parse_policy(
         rate:        int     = None,
         drop_proba:  float   = 1.0,
         log_type:    LogType = LogType.NONE,
-        log_group:   int     = 100
+        log_group:   int     = 100,
+        workers:     int     = 1,
+        queue_settings: dict = None
     ) -> Tuple[Policy, bool]:
     """
     Parse a policy.
@@ -79,6 +157,9 @@ def parse_policy(
     :param drop_proba: Dropping probability, between 0 and 1, to apply to matched traffic
     :param log_type: Type of packet logging to be used
     :param log_group: Log group ID to be used
+    :param workers: Number of worker threads, each reading its own queue, for a new NFQueue
+    :param queue_settings: Default overload protection settings of the NFQueues,
+                           overridden by the policy's `queue` settings
     :return: the parsed policy, as a `Policy` object, and a boolean indicating whether a new NFQueue was created
     """
     # If rate limit is given, add it to policy data
@@ -87,6 +168,8 @@ def parse_policy(
 
     # Create and parse policy
     policy = Policy(**policy_data)
+    if queue_settings:
+        policy.queue_settings = dict(queue_settings, **policy.queue_settings)
 
     # If policy has domain name match,
     # add domain name to global list
@@ -94,24 +177,28 @@ def parse_policy(
     for direction in ["saddr", "daddr"]:
         domain_names = hosts.get(direction, {}).get("domain_names", [])
         for name in domain_names:
-            if name not in global_accs["domain_names"]:
-                global_accs["domain_names"].append(name)
+            global_accs["domain_names"][name] = None
     
     # Add nftables rules
-    not_nfq = not policy.nfq_matches and (drop_proba == 0.0 or drop_proba == 1.0)
+    # Policies without nfqueue matches are given their verdict in the kernel, even if stochastic
+    not_nfq = not policy.nfq_matches
     nfqueue_id = -1 if not_nfq else nfqueue_id
     policy.build_nft_rule(nfqueue_id, drop_proba, log_type, log_group)
     new_nfq = False
-    try:
-        # Check if nft match is already stored
-        nfqueue = next(nfqueue for nfqueue in global_accs["nfqueues"] if nfqueue.contains_policy_matches(policy))
-    except StopIteration:
+    # Check if nft match is already stored
+    matches_key = NFQueue.get_matches_key(policy.nft_matches)
+    nfqueue = global_accs["nfqueues_by_matches"].get(matches_key, None)
+    if nfqueue is None:
         # No nfqueue with this nft match
-        nfqueue = NFQueue(policy.name, policy.nft_matches, nfqueue_id)
+        nfqueue = NFQueue(policy.name, policy.nft_matches, nfqueue_id, workers)
         global_accs["nfqueues"].append(nfqueue)
+        global_accs["nfqueues_by_matches"][matches_key] = nfqueue
         new_nfq = nfqueue_id != -1
-    finally:
-        nfqueue.add_policy(policy)
+    nfqueue.add_policy(policy)
+
+    # Add duration counter timers (if any)
+    for timer in policy.get_nft_timers():
+        global_accs["nft_timers"].setdefault(timer["name"], timer)
     
     # Add custom parser (if any)
     if policy.custom_parser:
@@ -120,11 +207,90 @@ def parse_policy(
     return policy, new_nfq
 
 
+def get_nft_timers(global_accs: dict) -> list:
+    """
+    Get the timers of the duration counters checked by the rules of the NFQueues.
+    The policies sharing an NFQueue are checked against the timer with the longest timeout only,
+    hence the other timers are left out.
+
+    :param global_accs: Dictionary containing the global accumulators
+    :return: list of timers, as dictionaries with keys "name", "timeout", "nft_match" and "nft_matches"
+    """
+    checked = {nfqueue.nft_stats["duration"]["match"] for nfqueue in global_accs["nfqueues"] if "duration" in nfqueue.nft_stats}
+    return [timer for name, timer in global_accs["nft_timers"].items() if name in checked]
+
+
+def check_conntrack_stats(global_accs: dict, hook: dict) -> None:
+    """
+    Remove the rules checking packet count or duration statistics, with a warning,
+    if the base chain's hook runs before connection tracking (netdev family),
+    as these statistics are read from the packets' conntrack entries.
+    The timers of the removed rules' durations are left out of the firewall.
+
+    :param global_accs: Dictionary containing the global accumulators
+    :param hook: hook of the base chain, as returned by `get_hook`
+    """
+    if hook["family"] != "netdev":
+        return
+    global_accs["nfqueues"], removed = remove_conntrack_stats(global_accs["nfqueues"])
+    for nfqueue in removed:
+        logger.warning("Rule %s checks packet count or duration statistics, which need connection tracking, "
+                       "not available to netdev tables. Removing it.", nfqueue.name)
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    """
+    Write content to a file, only if the file does not already contain it,
+    to preserve the file's modification time for incremental builds.
+
+    :param path: path to the file to write
+    :param content: content to write
+    :return: True if the file has been written, False if it was already up to date
+    """
+    try:
+        with open(path, "r") as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "w") as f:
+        f.write(content)
+    return True
+
+
+def write_counters(nft_counters: list, output_dir: str) -> None:
+    """
+    Write the names of the policies counted by each named counter to `counters.json`,
+    to map the counters' values back to the profile's policies.
+
+    Args:
+        nft_counters (list): Named counters, as dictionaries with keys "name" and "policies"
+        output_dir (str): Output directory for the generated files
+    """
+    content = json.dumps({nft_counter["name"]: nft_counter["policies"] for nft_counter in nft_counters}, indent=4)
+    write_if_changed(os.path.join(output_dir, "counters.json"), content + "\n")
+
+
+def write_firewall_json(nft_dict: dict, output_dir: str) -> None:
+    """
+    Write the device's firewall in the JSON format of libnftables to `firewall.json`,
+    to be applied with `nft -j -f`, equivalent to `firewall.nft`.
+
+    Args:
+        nft_dict (dict): Data of the firewall, as given to the template `firewall.nft.j2`
+        output_dir (str): Output directory for the generated files
+    """
+    content = json.dumps(get_firewall_json(nft_dict), indent=4)
+    write_if_changed(os.path.join(output_dir, "firewall.json"), content + "\n")
+
+
 def validate_args(
         output_dir: str = os.getcwd(),
         nfqueue_id: int = 0,
         rate:       int = None,
         drop_proba: float = None,
+        workers:    int = 1,
+        queue_settings: dict = None
     ) -> dict:
     """
     Validate arguments for the translation process.
@@ -134,8 +300,11 @@ def validate_args(
         nfqueue_id (int): NFQueue start index for this profile's policies (must be an integer between 0 and 65535)
         rate (int): Rate limit, in packets/second, to apply to matched traffic, instead of a binary verdict
         drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
+        workers (int): Number of worker threads per NFQueue
+        queue_settings (dict): Default overload protection settings of the NFQueues
     Raises:
-        ValueError: If rate and drop_proba are both provided
+        ValueError: If rate and drop_proba are both provided, if the number of workers is not positive,
+                    or if an overload protection setting is unknown
     """
     # Initialize result dictionary
     args = {}
@@ -164,18 +333,288 @@ def validate_args(
         drop_proba = 1.0
     args["drop_proba"] = drop_proba
 
+    # Workers: positive unsigned 16-bit integer
+    workers = uint16(workers)
+    if workers < 1:
+        raise ValueError(f"\"{workers}\" is not a valid number of workers (must be a positive integer)")
+    args["workers"] = workers
+
+    # Queue settings: known overload protection settings
+    queue_settings = dict(queue_settings) if queue_settings else {}
+    for key in queue_settings:
+        if key not in queue_setting_keys:
+            raise ValueError(f"\"{key}\" is not a valid queue setting (must be one of {', '.join(queue_setting_keys)})")
+    args["queue_settings"] = queue_settings
+
     return args
 
 
+def validate_queue_nums(nfqueues: list) -> None:
+    """
+    Validate the queue numbers allocated to the NFQueues,
+    which grow with the number of policies and workers from the NFQueue start index.
+
+    Args:
+        nfqueues (list): NFQueue objects of the device
+    Raises:
+        ValueError: If the highest queue number read by the NFQueues' workers is not an unsigned 16-bit integer
+    """
+    last_queue_num = max((nfqueue.queue_num + nfqueue.workers - 1 for nfqueue in nfqueues if nfqueue.queue_num >= 0), default=0)
+    if last_queue_num > 65535:
+        raise ValueError(f"Too many NFQueues: the highest queue number is {last_queue_num} (must be at most 65535), "
+                         "use a lower NFQueue start index or fewer workers")
+
+
+def optimize_rules(
+        device:       dict,
+        global_accs:  dict,
+        drop_proba:   float   = 1.0,
+        log_type:     LogType = LogType.NONE,
+        log_group:    int     = 100,
+        options:      FirewallOptions = None,
+        prefix:       str     = "",
+        table:        tuple   = None
+    ) -> dict:
+    """
+    Apply the optimization passes requested by the options to a device's nftables rules.
+
+    Args:
+        device (dict): Device metadata
+        global_accs (dict): Global accumulators containing policy data
+        drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
+        log_type (LogType): Type of packet logging to be used
+        log_group (int): Log group number (must be an integer between 0 and 65535)
+        options (FirewallOptions): Options of the firewall, of which the passes use
+                                   `merge_sets`, `verdict_maps`, `chain_tree`, `device_guard`, `rate_limits`,
+                                   `counters`, `hit_stats`, `ct_directions` and `early_drop`
+        prefix (str): Prefix of the names of the generated sets and chains
+        table (tuple): (family, name) tuple of the table of the device's chain,
+                       selecting the counters of the hit statistics read from nftables
+    Returns:
+        dict: rules of the device's chain ("nfqueues"), named sets ("nft_sets"),
+              named limits ("nft_limits"), per-source meters ("nft_meters"), named counters ("nft_counters"),
+              sub-chains ("sub_chains"), verdict chains ("verdict_chains"),
+              rules dropping traffic at netdev ingress ("early_drops"),
+              and MAC address of the device if its traffic can be guarded, else None ("device_mac")
+    """
+    options = options if options is not None else FirewallOptions()
+
+    # Guard against the traffic not involving the device, if all policies involve the device
+    device_mac = None
+    if options.device_guard and global_accs["nfqueues"] and all(
+            policy_dict["policy"].is_device for nfqueue in global_accs["nfqueues"] for policy_dict in nfqueue.policies
+        ):
+        device_mac = device.get("mac", None)
+
+    # Evaluate the most matched rules first, if needed
+    nfqueues = global_accs["nfqueues"]
+    if options.hit_stats is not None:
+        nfqueues = reorder_rules(nfqueues, load_hit_stats(options.hit_stats, nfqueues, prefix, table), prefix)
+
+    # Drop the traffic sent by the device at netdev ingress, if needed
+    # The split rules are not part of the chain's optimizations
+    early_drops = []
+    if options.early_drop is not None:
+        nfqueues, early_drops = split_early_drops(nfqueues, device, drop_proba)
+
+    # Merge the rules matching both directions of the same flows, if needed
+    # The merged rules only match single values of the flows' tuples, so directions are merged before sets
+    if options.ct_directions:
+        nfqueues = merge_directions(nfqueues, log_type)
+
+    # Replace anonymous rate limits by named limits or per-source meters, if needed
+    nft_limits = []
+    nft_meters = []
+    if options.rate_limits != RateLimitType.INLINE:
+        nfqueues, nft_limits, nft_meters = build_rate_limits(nfqueues, options.rate_limits == RateLimitType.SOURCE, prefix)
+
+    # Merge rules into sets, if needed
+    # The rules matching sets cannot be part of verdict maps, so sets are merged first
+    nft_sets = []
+    if options.merge_sets:
+        nfqueues, nft_sets = merge_into_sets(nfqueues, log_type, prefix=prefix)
+
+    # Replace rules by verdict maps, if needed
+    # The rules of verdict maps cannot be counted individually
+    verdict_maps = options.verdict_maps
+    if verdict_maps and options.counters:
+        logger.warning("Verdict maps are not supported with counters. Disabling them.")
+        verdict_maps = False
+    verdict_chains = []
+    if verdict_maps:
+        nfqueues, verdict_chains = build_verdict_maps(nfqueues, drop_proba, log_type, log_group, prefix)
+
+    # Dispatch rules to sub-chains, if needed
+    sub_chains = []
+    if options.chain_tree:
+        nfqueues, sub_chains = build_chain_tree(nfqueues, prefix=prefix)
+
+    # Count the traffic matched by each rule, if needed
+    nft_counters = []
+    if options.counters:
+        nfqueues, nft_counters = add_counters(nfqueues, sub_chains, prefix)
+
+    return {
+        "nfqueues": nfqueues,
+        "device_mac": device_mac,
+        "nft_sets": nft_sets,
+        "nft_limits": nft_limits,
+        "nft_meters": nft_meters,
+        "nft_counters": nft_counters,
+        "sub_chains": sub_chains,
+        "verdict_chains": verdict_chains,
+        "early_drops": early_drops
+    }
+
+
+def write_nfqueues(
+        device:       dict,
+        global_accs:  dict,
+        nfqueue_name: str     = None,
+        output_dir:   str     = os.getcwd(),
+        drop_proba:   float   = 1.0,
+        split_sources: bool   = False,
+        ct_marks:     bool    = False,
+        copy_ranges:  bool    = False
+    ) -> None:
+    """
+    Write NFQueue C source code and CMake file with given parameters, if the device has NFQueues.
+
+    Args:
+        device (dict): Device metadata
+        global_accs (dict): Global accumulators containing policy data
+        nfqueue_name (str): Name of the device's NFQueue
+        output_dir (str): Output directory for the generated files
+        drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
+        split_sources (bool): Split the NFQueue C source code into a shared header `nfqueues.h`,
+                              one file `callback_<nfqueue>.c` per NFQueue, and `main.c`,
+                              instead of a single file `nfqueues.c`
+        ct_marks (bool): Cache the DROP verdicts in the connections' conntrack marks
+        copy_ranges (bool): Only copy to user space the bytes of the packets read by each NFQueue's callback
+    Raises:
+        ValueError: If the NFQueues need more than 65535 threads
+    """
+    num_threads = sum(q.workers for q in global_accs["nfqueues"] if q.queue_num >= 0)
+    if num_threads == 0:
+        return
+    # Thread IDs are unsigned 16-bit integers
+    if num_threads > 65535:
+        raise ValueError(f"Too many NFQueue threads: {num_threads} (must be at most 65535)")
+
+    # Sort collections which are not ordered,
+    # for the generated files to be identical across runs
+    custom_parsers = sorted(global_accs["custom_parsers"])
+
+    ct_marks = ct_mark_values if ct_marks else None
+
+    # NFQueues with overload protection settings or a copy range are read by threads applying them on the queue handle
+    queue_threads = any(
+        nfqueue.get_queue_settings()["maxlen"] is not None or nfqueue.get_queue_settings()["fail-open"]
+        or (copy_ranges and nfqueue.get_copy_range() is not None)
+        for nfqueue in global_accs["nfqueues"] if nfqueue.queue_num >= 0
+    )
+
+    # Jinja2 environment
+    templates = {}
+    env = create_jinja_env(package)
+    templates["header.c"]       = env.get_template("header.c.j2")
+    templates["callback.c"]     = env.get_template("callback.c.j2")
+    templates["main.c"]         = env.get_template("main.c.j2")
+    templates["CMakeLists.txt"] = env.get_template("CMakeLists.txt.j2")
+
+    # Create nfqueue C file by rendering Jinja2 templates
+    header_dict = {
+        "device": device["name"],
+        "custom_parsers": custom_parsers,
+        "domain_names": global_accs["domain_names"],
+        "drop_proba": drop_proba,
+        "num_threads": num_threads,
+        "nfqueues": global_accs["nfqueues"],
+        "split": split_sources,
+        "ct_marks": ct_marks,
+        "queue_threads": queue_threads
+    }
+    header = templates["header.c"].render(header_dict)
+    callback_dict = {
+        "nft_table": f"bridge {device['name']}",
+        "nfqueues": global_accs["nfqueues"],
+        "drop_proba": drop_proba,
+        "split": split_sources,
+        "ct_marks": ct_marks
+    }
+    main_dict = {
+        "custom_parsers": custom_parsers,
+        "nfqueues": global_accs["nfqueues"],
+        "domain_names": global_accs["domain_names"],
+        "drop_proba": drop_proba,
+        "num_threads": num_threads,
+        "split": split_sources,
+        "ct_marks": ct_marks,
+        "copy_ranges": copy_ranges,
+        "queue_threads": queue_threads
+    }
+    main = templates["main.c"].render(main_dict)
+
+    if split_sources:
+        # Write one C file per NFQueue, which only changes with the NFQueue's policies
+        write_if_changed(os.path.join(output_dir, "nfqueues.h"), header)
+        sources = ["main.c"]
+        write_if_changed(os.path.join(output_dir, "main.c"), main)
+        for nfqueue in global_accs["nfqueues"]:
+            if nfqueue.queue_num < 0:
+                continue
+            callback_dict["nfqueues"] = [nfqueue]
+            callback = templates["callback.c"].render(callback_dict)
+            source = f"callback_{nfqueue.get_name_slug()}.c"
+            write_if_changed(os.path.join(output_dir, source), callback)
+            sources.append(source)
+    else:
+        # Write policy C file
+        callback = templates["callback.c"].render(callback_dict)
+        with open(os.path.join(output_dir, "nfqueues.c"), "w+") as fw:
+            fw.write(header)
+            fw.write(callback)
+            fw.write(main)
+        sources = ["nfqueues.c"]
+
+    # Create CMake file
+    cmake_dict = {
+        "device":  device["name"],
+        "nfqueue_name": slugify_name(nfqueue_name),
+        "sources": sources,
+        "custom_parsers": custom_parsers,
+        "domain_names": global_accs["domain_names"],
+        "ct_marks": ct_marks,
+        "queue_threads": queue_threads
+    }
+    write_if_changed(os.path.join(output_dir, "CMakeLists.txt"), templates["CMakeLists.txt"].render(cmake_dict))
+
+
+def get_options(options: FirewallOptions = None, **kwargs) -> FirewallOptions:
+    """
+    Build the options of the firewall from an options object, overridden by individual options.
+
+    Args:
+        options (FirewallOptions): Options of the firewall (default options if None)
+        kwargs: Individual options, named after the fields of `FirewallOptions`
+    Returns:
+        FirewallOptions: Options of the firewall, leaving the given object unchanged
+    Raises:
+        TypeError: If an individual option is not a field of `FirewallOptions`
+    """
+    return replace(options if options is not None else FirewallOptions(), **kwargs)
+
+
 def write_firewall(
         device:       dict,
         global_accs:  dict,
+        *,
         nfqueue_name: str     = None,
         output_dir:   str     = os.getcwd(),
         drop_proba:   float   = 1.0,
         log_type:     LogType = LogType.NONE,
         log_group:    int     = 100,
-        test:         bool    = False
+        options:      FirewallOptions = None
     ) -> None:
     """
     Write NFTables firewall script and NFQueue C source code with given parameters.
@@ -188,71 +627,95 @@ def write_firewall(
         drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
         log_type (LogType): Type of packet logging to be used
         log_group (int): Log group number (must be an integer between 0 and 65535)
-        test (bool): Test mode: use VM instead of router
+        options (FirewallOptions): Options of the firewall and NFQueue C source code (default options if None)
+    Raises:
+        ValueError: If the queue numbers of the NFQueues exceed 65535,
+                    or if flowtable offload is enabled without the flowtable's network interfaces
     """
     args = validate_args(output_dir=output_dir, drop_proba=drop_proba)
     drop_proba = args["drop_proba"]
+    validate_queue_nums(global_accs["nfqueues"])
+    options = options if options is not None else FirewallOptions()
+
+    # Stochastic verdicts are given per packet, hence cannot be cached per connection
+    if options.ct_marks and drop_proba not in [0.0, 1.0]:
+        logger.warning("Conntrack marks are not supported with a stochastic verdict. Disabling them.")
+        options = replace(options, ct_marks=False)
+
+    # Remove the rules which never change the verdict of a packet, if needed
+    # The removed NFQueues are not part of the firewall nor of the NFQueue C source code
+    if options.remove_redundant:
+        global_accs["nfqueues"], removed = remove_redundant_rules(global_accs["nfqueues"], log_type)
+        for nfqueue, covering in removed:
+            logger.info("Rule %s is covered by rule %s. Removing it.", nfqueue.name, covering.name)
+
+    # Hook of the base chain
+    hook = get_hook(options.test, device.get("hook", None), options.hook)
+
+    # Packet count and duration statistics are read from conntrack, which netdev tables do not use
+    check_conntrack_stats(global_accs, hook)
+
+    # The guard matches the Ethernet header of the packets, which is only available to bridge and netdev tables
+    if options.device_guard and hook["family"] not in ["bridge", "netdev"]:
+        logger.warning(f"Device guard is not supported by {hook['family']} tables. Disabling it.")
+        options = replace(options, device_guard=False)
+
+    # Rules dropping traffic at netdev ingress cannot use the counters of the device's table
+    if options.early_drop and options.counters:
+        logger.warning("Early drop is not supported with counters. Disabling it.")
+        options = replace(options, early_drop=None)
 
     # Jinja2 environment
-    templates = {}
     env = create_jinja_env(package)
-    templates["firewall.nft"]   = env.get_template("firewall.nft.j2")
-    templates["header.c"]       = env.get_template("header.c.j2")
-    templates["callback.c"]     = env.get_template("callback.c.j2")
-    templates["main.c"]         = env.get_template("main.c.j2")
-    templates["CMakeLists.txt"] = env.get_template("CMakeLists.txt.j2")
+    template = env.get_template("firewall.nft.j2")
 
     # Create nftables script
     nft_dict = {
         "device": device,
-        "nfqueues": global_accs["nfqueues"],
         "drop_proba": drop_proba,
         "log_type": log_type,
         "log_group": log_group,
-        "test": test
+        "ct_marks": ct_mark_values if options.ct_marks else None,
+        "nft_timers": get_nft_timers(global_accs),
+        "flowtable": None,
+        "notrack": [],
+        "early_drop": options.early_drop,
+        "hook": hook
     }
-    templates["firewall.nft"].stream(nft_dict).dump(os.path.join(output_dir, "firewall.nft"))
-
-    # If needed, create NFQueue-related files
-    num_threads = len([q for q in global_accs["nfqueues"] if q.queue_num >= 0])
-    if num_threads > 0:
-        # Create nfqueue C file by rendering Jinja2 templates
-        header_dict = {
-            "device": device["name"],
-            "custom_parsers": global_accs["custom_parsers"],
-            "domain_names": global_accs["domain_names"],
-            "drop_proba": drop_proba,
-            "num_threads": num_threads,
-        }
-        header = templates["header.c"].render(header_dict)
-        callback_dict = {
-            "nft_table": f"bridge {device['name']}",
-            "nfqueues": global_accs["nfqueues"],
-            "drop_proba": drop_proba
-        }
-        callback = templates["callback.c"].render(callback_dict)
-        main_dict = {
-            "custom_parsers": global_accs["custom_parsers"],
-            "nfqueues": global_accs["nfqueues"],
-            "domain_names": global_accs["domain_names"],
-            "num_threads": num_threads
-        }
-        main = templates["main.c"].render(main_dict)
 
-        # Write policy C file
-        with open(os.path.join(output_dir, "nfqueues.c"), "w+") as fw:
-            fw.write(header)
-            fw.write(callback)
-            fw.write(main)
+    # Skip connection tracking for the multicast and broadcast traffic which does not need it, if needed
+    if options.notrack and hook["family"] == "netdev":
+        logger.warning("Connection tracking is not used by netdev tables. Disabling notrack.")
+    elif options.notrack:
+        nft_dict["notrack"] = get_notrack_matches(global_accs["nfqueues"], options.ct_marks, options.ct_directions)
+
+    # Offload the established flows which need no further inspection to a flowtable, if needed
+    # The flowtable is declared on the network interfaces the flows are forwarded between
+    if options.offload and not options.flowtable_devices:
+        raise ValueError("Flowtable offload needs the network interfaces of the flowtable (flowtable_devices)")
+    if options.flowtable_devices and not options.offload:
+        logger.warning("Flowtable devices are only used with offload. Ignoring them.")
+    if options.offload:
+        exclusions = get_offload_exclusions(global_accs["nfqueues"], drop_proba)
+        if exclusions is None:
+            logger.warning("All flows of device %s might need inspection. Disabling flowtable.", device["name"])
+        else:
+            nft_dict["flowtable"] = {"devices": list(options.flowtable_devices), "exclusions": exclusions}
+
+    nft_dict.update(optimize_rules(device, global_accs, drop_proba, log_type, log_group, options, table=(hook["family"], device["name"])))
+    template.stream(nft_dict).dump(os.path.join(output_dir, "firewall.nft"))
+
+    # Write the names of the policies counted by each counter, if needed
+    if options.counters:
+        write_counters(nft_dict["nft_counters"], output_dir)
+
+    # Write the firewall in the JSON format of libnftables, if needed
+    if options.json_output:
+        write_firewall_json(nft_dict, output_dir)
 
-        # Create CMake file
-        cmake_dict = {
-            "device":  device["name"],
-            "nfqueue_name": slugify_name(nfqueue_name),
-            "custom_parsers": global_accs["custom_parsers"],
-            "domain_names": global_accs["domain_names"]
-        }
-        templates["CMakeLists.txt"].stream(cmake_dict).dump(os.path.join(output_dir, "CMakeLists.txt"))
+    # If needed, create NFQueue-related files
+    write_nfqueues(device, global_accs, nfqueue_name=nfqueue_name, output_dir=output_dir, drop_proba=drop_proba,
+                   split_sources=options.split_sources, ct_marks=options.ct_marks, copy_ranges=options.copy_ranges)
 
 
 def translate_policy(
@@ -265,7 +728,10 @@ def translate_policy(
         drop_proba:   float   = None,
         log_type:     LogType = LogType.NONE,
         log_group:    int     = 100,
-        test:         bool    = False
+        workers:      int     = 1,
+        queue_settings: dict  = None,
+        options:      FirewallOptions = None,
+        **kwargs
     ) -> None:
     """
     Translate a policy to the corresponding pair of NFTables firewall script and NFQueue C source code.
@@ -279,12 +745,21 @@ def translate_policy(
         drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
         log_type (LogType): Type of packet logging to be used
         log_group (int): Log group number (must be an integer between 0 and 65535)
-        test (bool): Test mode: use VM instead of router
+        workers (int): Number of worker threads per NFQueue, spreading the NFQueue's flows over consecutive queues
+        queue_settings (dict): Default overload protection settings of the NFQueues, overridden by each policy's `queue` settings:
+                               "bypass" to accept the packets if no program listens to the queue,
+                               "maxlen" for the maximum number of packets waiting in the queue,
+                               "fail-open" to accept the packets instead of dropping them when the queue is full
+        options (FirewallOptions): Options of the firewall and NFQueue C source code (default options if None)
+        kwargs: Individual options of the firewall, named after the fields of `FirewallOptions`, overriding `options`
     """
     ## Argument validation
-    args = validate_args(output_dir, nfqueue_id, rate, drop_proba)
+    args = validate_args(output_dir, nfqueue_id, rate, drop_proba, workers, queue_settings)
     output_dir = args["output_dir"]
     drop_proba = args["drop_proba"]
+    workers = args["workers"]
+    queue_settings = args["queue_settings"]
+    options = get_options(options, **kwargs)
 
     ## Prepare policy data
     policy_data = {
@@ -293,12 +768,8 @@ def translate_policy(
     }
 
     ## Parse policy
-    global_accs = {
-        "custom_parsers": set(),
-        "nfqueues": [],
-        "domain_names": []
-    }
-    policy, _ = parse_policy(policy_data, global_accs, nfqueue_id, rate, drop_proba, log_type, log_group)
+    global_accs = init_global_accs()
+    policy, _ = parse_policy(policy_data, global_accs, nfqueue_id, rate, drop_proba, log_type, log_group, workers, queue_settings)
     policy_name = policy.get_name()
     if policy_dict.get("bidirectional", False):
         policy_data_backward = {
@@ -307,11 +778,19 @@ def translate_policy(
             "policy_name": f"{policy_name}-backward",
             "is_backward": True
         }
-        parse_policy(policy_data_backward, global_accs, nfqueue_id + 1, rate, drop_proba, log_type, log_group)
+        parse_policy(policy_data_backward, global_accs, nfqueue_id + workers, rate, drop_proba, log_type, log_group, workers, queue_settings)
 
     ## Output
     nfqueue_name = policy_name if nfqueue_name is None else nfqueue_name
-    write_firewall(device, global_accs, nfqueue_name, output_dir, drop_proba, log_type, log_group, test)
+    write_firewall(
+        device, global_accs,
+        nfqueue_name=nfqueue_name,
+        output_dir=output_dir,
+        drop_proba=drop_proba,
+        log_type=log_type,
+        log_group=log_group,
+        options=options
+    )
 
 
 def translate_policies(
@@ -324,7 +803,10 @@ def translate_policies(
         drop_proba:   float   = None,
         log_type:     LogType = LogType.NONE,
         log_group:    int     = 100,
-        test:         bool    = False
+        workers:      int     = 1,
+        queue_settings: dict  = None,
+        options:      FirewallOptions = None,
+        **kwargs
 ) -> None:
     """
     Translate a list of policies to the corresponding pair of NFTables firewall script and NFQueue C source code.
@@ -338,20 +820,25 @@ def translate_policies(
         drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
         log_type (LogType): Type of packet logging to be used
         log_group (int): Log group number (must be an integer between 0 and 65535)
-        test (bool): Test mode: use VM instead of router
+        workers (int): Number of worker threads per NFQueue, spreading the NFQueue's flows over consecutive queues
+        queue_settings (dict): Default overload protection settings of the NFQueues, overridden by each policy's `queue` settings:
+                               "bypass" to accept the packets if no program listens to the queue,
+                               "maxlen" for the maximum number of packets waiting in the queue,
+                               "fail-open" to accept the packets instead of dropping them when the queue is full
+        options (FirewallOptions): Options of the firewall and NFQueue C source code (default options if None)
+        kwargs: Individual options of the firewall, named after the fields of `FirewallOptions`, overriding `options`
     """
     # Argument validation
-    args = validate_args(output_dir, nfqueue_id, rate, drop_proba)
+    args = validate_args(output_dir, nfqueue_id, rate, drop_proba, workers, queue_settings)
     output_dir = args["output_dir"]
     drop_proba = args["drop_proba"]
+    workers = args["workers"]
+    queue_settings = args["queue_settings"]
+    options = get_options(options, **kwargs)
 
     # Initialize loop variables
-    nfq_id_inc = 10
-    global_accs = {
-        "custom_parsers": set(),
-        "nfqueues": [],
-        "domain_names": []
-    }
+    nfq_id_step = get_nfq_id_inc(workers)
+    global_accs = init_global_accs()
 
     # Loop over given policies
     for policy_dict in policies:
@@ -361,10 +848,11 @@ def translate_policies(
             "profile_data": policy_dict,
             "device": device
         }
-        policy, new_nfq_fwd = parse_policy(policy_data, global_accs, nfqueue_id, rate, drop_proba, log_type, log_group)
+        policy, new_nfq_fwd = parse_policy(policy_data, global_accs, nfqueue_id, rate, drop_proba, log_type, log_group, workers, queue_settings)
         policy_name = policy.get_name()
 
         # Backward
+        new_nfq_bwd = False
         if policy_dict.get("bidirectional", False):
             policy_data_backward = {
                 "profile_data": policy_dict,
@@ -372,58 +860,53 @@ def translate_policies(
                 "policy_name": f"{policy_name}-backward",
                 "is_backward": True
             }
-            _, new_nfq_bwd = parse_policy(policy_data_backward, global_accs, nfqueue_id + 1, rate, drop_proba, log_type, log_group)
+            _, new_nfq_bwd = parse_policy(policy_data_backward, global_accs, nfqueue_id + workers, rate, drop_proba, log_type, log_group, workers, queue_settings)
 
         # Increment nfqueue_id if needed
         if new_nfq_fwd or new_nfq_bwd:
-            nfqueue_id += nfq_id_inc
+            nfqueue_id += nfq_id_step
     
     # Output
     nfqueue_name = device.get("name", policy_name) if nfqueue_name is None else nfqueue_name
-    write_firewall(device, global_accs, nfqueue_name, output_dir, drop_proba, log_type, log_group, test)
-
-
-def translate_profile(
+    write_firewall(
+        device, global_accs,
+        nfqueue_name=nfqueue_name,
+        output_dir=output_dir,
+        drop_proba=drop_proba,
+        log_type=log_type,
+        log_group=log_group,
+        options=options
+    )
+
+
+def parse_profile(
         profile_path: str,
-        nfqueue_name: str     = None,
         nfqueue_id:   int     = 0,
-        output_dir:   str     = os.getcwd(),
         rate:         int     = None,
-        drop_proba:   float   = None,
+        drop_proba:   float   = 1.0,
         log_type:     LogType = LogType.NONE,
         log_group:    int     = 100,
-        test:         bool    = False
-    ) -> None:
+        workers:      int     = 1,
+        queue_settings: dict  = None
+    ) -> Tuple[dict, dict, int]:
     """
-    Translate a device YAML profile to the corresponding pair of NFTables firewall script and NFQueue C source code.
+    Parse the policies of a device YAML profile.
 
     Args:
         profile_path (str): Path to the device YAML profile
-        nfqueue_name (str): Name of the device's NFQueue
-        nfqueue_id (int): NFQueue start index for this profile's policies (must be an integer between 0 and 65535)
-        output_dir (str): Output directory for the generated files
+        nfqueue_id (int): NFQueue start index for this profile's policies
         rate (int): Rate limit, in packets/second, to apply to matched traffic, instead of a binary verdict
         drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
         log_type (LogType): Type of packet logging to be used
         log_group (int): Log group number (must be an integer between 0 and 65535)
-        test (bool): Test mode: use VM instead of router
+        workers (int): Number of worker threads per NFQueue
+        queue_settings (dict): Default overload protection settings of the NFQueues
+    Returns:
+        Tuple[dict, dict, int]: device metadata, global accumulators containing policy data,
+                                and next free NFQueue index
     """
-    # Retrieve device profile's path
-    device_path = os.path.abspath(os.path.dirname(profile_path))
-    if output_dir is None:
-        output_dir = device_path
-    # Argument validation
-    args = validate_args(output_dir, nfqueue_id, rate, drop_proba)
-    output_dir = args["output_dir"]
-    nfqueue_id = args["nfqueue_id"]
-    rate = args["rate"]
-    drop_proba = args["drop_proba"]
-
-
-    ### MAIN ###
-
     # NFQueue ID increment
-    nfq_id_inc = 10
+    nfq_id_step = get_nfq_id_inc(workers)
 
     # Load the device profile
     profile = {}
@@ -434,15 +917,8 @@ def translate_profile(
     # Get device info
     device = profile["device-info"]
 
-    # Set device's NFQueue name if not provided as argument
-    nfqueue_name = nfqueue_name if nfqueue_name is not None else device["name"]
-
     # Global accumulators
-    global_accs = {
-        "custom_parsers": set(),
-        "nfqueues": [],
-        "domain_names": []
-    }
+    global_accs = init_global_accs()
 
 
     ## Loop over the device's individual policies
@@ -459,9 +935,10 @@ def translate_profile(
             
             # Parse policy
             is_backward = profile_data.get("bidirectional", False)
-            _, new_nfq_fwd = parse_policy(policy_data, global_accs, nfqueue_id, rate, drop_proba, log_type, log_group)
+            _, new_nfq_fwd = parse_policy(policy_data, global_accs, nfqueue_id, rate, drop_proba, log_type, log_group, workers, queue_settings)
 
             # Parse policy in backward direction, if needed
+            new_nfq_bwd = False
             if is_backward:
                 policy_data_backward = {
                     "profile_data": profile_data,
@@ -469,15 +946,220 @@ def translate_profile(
                     "policy_name": f"{policy_name}-backward",
                     "is_backward": True
                 }
-                _, new_nfq_bwd = parse_policy(policy_data_backward, global_accs, nfqueue_id + 1, rate, drop_proba, log_type, log_group)
+                _, new_nfq_bwd = parse_policy(policy_data_backward, global_accs, nfqueue_id + workers, rate, drop_proba, log_type, log_group, workers, queue_settings)
 
             # Update nfqueue variables if needed
             if new_nfq_fwd or new_nfq_bwd:
-                nfqueue_id += nfq_id_inc
+                nfqueue_id += nfq_id_step
+
+    return device, global_accs, nfqueue_id
+
+
+def translate_profile(
+        profile_path: str,
+        nfqueue_name: str     = None,
+        nfqueue_id:   int     = 0,
+        output_dir:   str     = os.getcwd(),
+        rate:         int     = None,
+        drop_proba:   float   = None,
+        log_type:     LogType = LogType.NONE,
+        log_group:    int     = 100,
+        workers:      int     = 1,
+        queue_settings: dict  = None,
+        options:      FirewallOptions = None,
+        **kwargs
+    ) -> None:
+    """
+    Translate a device YAML profile to the corresponding pair of NFTables firewall script and NFQueue C source code.
+
+    Args:
+        profile_path (str): Path to the device YAML profile
+        nfqueue_name (str): Name of the device's NFQueue
+        nfqueue_id (int): NFQueue start index for this profile's policies (must be an integer between 0 and 65535)
+        output_dir (str): Output directory for the generated files
+        rate (int): Rate limit, in packets/second, to apply to matched traffic, instead of a binary verdict
+        drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
+        log_type (LogType): Type of packet logging to be used
+        log_group (int): Log group number (must be an integer between 0 and 65535)
+        workers (int): Number of worker threads per NFQueue, spreading the NFQueue's flows over consecutive queues
+        queue_settings (dict): Default overload protection settings of the NFQueues, overridden by each policy's `queue` settings:
+                               "bypass" to accept the packets if no program listens to the queue,
+                               "maxlen" for the maximum number of packets waiting in the queue,
+                               "fail-open" to accept the packets instead of dropping them when the queue is full
+        options (FirewallOptions): Options of the firewall and NFQueue C source code (default options if None)
+        kwargs: Individual options of the firewall, named after the fields of `FirewallOptions`, overriding `options`
+    """
+    # Retrieve device profile's path
+    device_path = os.path.abspath(os.path.dirname(profile_path))
+    if output_dir is None:
+        output_dir = device_path
+    # Argument validation
+    args = validate_args(output_dir, nfqueue_id, rate, drop_proba, workers, queue_settings)
+    output_dir = args["output_dir"]
+    nfqueue_id = args["nfqueue_id"]
+    rate = args["rate"]
+    drop_proba = args["drop_proba"]
+    workers = args["workers"]
+    queue_settings = args["queue_settings"]
+    options = get_options(options, **kwargs)
+
+
+    ### MAIN ###
+
+    device, global_accs, _ = parse_profile(profile_path, nfqueue_id, rate, drop_proba, log_type, log_group, workers, queue_settings)
+
+    # Set device's NFQueue name if not provided as argument
+    nfqueue_name = nfqueue_name if nfqueue_name is not None else device["name"]
 
 
     ### OUTPUT ###
 
-    write_firewall(device, global_accs, nfqueue_name, output_dir, drop_proba, log_type, log_group, test)
+    write_firewall(
+        device, global_accs,
+        nfqueue_name=nfqueue_name,
+        output_dir=output_dir,
+        drop_proba=drop_proba,
+        log_type=log_type,
+        log_group=log_group,
+        options=options
+    )
 
     logger.info(f"Done translating {profile_path}.")
+
+
+def translate_fleet(
+        profile_paths: Iterable[str],
+        table_name:   str     = "fleet",
+        nfqueue_id:   int     = 0,
+        output_dir:   str     = os.getcwd(),
+        rate:         int     = None,
+        drop_proba:   float   = None,
+        log_type:     LogType = LogType.NONE,
+        log_group:    int     = 100,
+        workers:      int     = 1,
+        queue_settings: dict  = None,
+        options:      FirewallOptions = None,
+        **kwargs
+    ) -> None:
+    """
+    Translate multiple device YAML profiles to a single NFTables firewall script,
+    with one table and one base chain dispatching packets to per-device chains
+    through verdict maps on their source and destination MAC addresses,
+    and to the NFQueue C source code of each device, in a sub-directory named after the device.
+
+    Each device's rules are only evaluated for the unicast traffic involving the device's MAC address,
+    if all its policies involve the device, and for all broadcast and multicast traffic.
+    Accepted packets are still evaluated by the other devices' chains,
+    as they would be by the other devices' tables.
+    Packets queued to user space however leave the table with the user space verdict.
+
+    Args:
+        profile_paths (Iterable[str]): Paths to the device YAML profiles
+        table_name (str): Name of the nftables table
+        nfqueue_id (int): NFQueue start index for the profiles' policies (must be an integer between 0 and 65535)
+        output_dir (str): Output directory for the generated files
+        rate (int): Rate limit, in packets/second, to apply to matched traffic, instead of a binary verdict
+        drop_proba (float): Dropping probability to apply to matched traffic, instead of a binary verdict
+        log_type (LogType): Type of packet logging to be used
+        log_group (int): Log group number (must be an integer between 0 and 65535)
+        workers (int): Number of worker threads per NFQueue, spreading the NFQueue's flows over consecutive queues
+        queue_settings (dict): Default overload protection settings of the NFQueues, overridden by each policy's `queue` settings:
+                               "bypass" to accept the packets if no program listens to the queue,
+                               "maxlen" for the maximum number of packets waiting in the queue,
+                               "fail-open" to accept the packets instead of dropping them when the queue is full
+        options (FirewallOptions): Options of the firewall and NFQueue C source code (default options if None),
+                                   of which the options in `fleet_unsupported_options` are not supported
+        kwargs: Individual options of the firewall, named after the fields of `FirewallOptions`, overriding `options`
+    """
+    # Argument validation
+    args = validate_args(output_dir, nfqueue_id, rate, drop_proba, workers, queue_settings)
+    output_dir = args["output_dir"]
+    nfqueue_id = args["nfqueue_id"]
+    rate = args["rate"]
+    drop_proba = args["drop_proba"]
+    workers = args["workers"]
+    queue_settings = args["queue_settings"]
+    options = get_options(options, **kwargs)
+
+    # Options of the single-device firewall, which are not supported by the fleet's table
+    default_options = FirewallOptions()
+    for name in fleet_unsupported_options:
+        if getattr(options, name) != getattr(default_options, name):
+            logger.warning(f"Option {name} is not supported in fleet mode. Ignoring it.")
+    options = replace(options, **{name: getattr(default_options, name) for name in fleet_unsupported_options})
+    # Devices are dispatched to their chain on their MAC address
+    options = replace(options, device_guard=True)
+
+    # Accepted packets return from their device's chain,
+    # which requires the accepting rules to be directly in the device's chain
+    if drop_proba != 1.0 and (options.verdict_maps or options.chain_tree):
+        logger.warning("Verdict maps and sub-chains are only supported with a drop verdict in fleet mode. Disabling them.")
+        options = replace(options, verdict_maps=False, chain_tree=False)
+
+    # Hook of the base chain
+    hook = get_hook(options.test, options.hook)
+
+    devices = []
+    mac_addresses = set()
+    for profile_path in profile_paths:
+        # Parse profile, with NFQueue indices following the previous profile's
+        device, global_accs, nfqueue_id = parse_profile(profile_path, nfqueue_id, rate, drop_proba, log_type, log_group, workers, queue_settings)
+        validate_queue_nums(global_accs["nfqueues"])
+        check_conntrack_stats(global_accs, hook)
+
+        # Write device's NFQueue C source code
+        device_dir = os.path.join(output_dir, device["name"])
+        os.makedirs(device_dir, exist_ok=True)
+        write_nfqueues(device, global_accs, device["name"], device_dir, drop_proba, options.split_sources, copy_ranges=options.copy_ranges)
+
+        # Optimize device's rules
+        device_slug = slugify_name(device["name"])
+        rules = optimize_rules(device, global_accs, drop_proba, log_type, log_group, options,
+                               prefix=f"{device_slug}_", table=(hook["family"], table_name))
+        mac = rules["device_mac"].lower() if rules["device_mac"] is not None else None
+        if mac in mac_addresses:
+            # MAC addresses are verdict map keys, so they must be unique
+            mac = None
+        mac_addresses.add(mac)
+        devices.append({
+            "name": device["name"],
+            "chain": f"device_{device_slug}",
+            "mac": mac,
+            "nfqueues": list(rules["nfqueues"]),
+            "nft_sets": rules["nft_sets"],
+            "nft_limits": rules["nft_limits"],
+            "nft_meters": rules["nft_meters"],
+            "nft_counters": rules["nft_counters"],
+            "sub_chains": rules["sub_chains"],
+            "verdict_chains": rules["verdict_chains"],
+            "nft_timers": get_nft_timers(global_accs)
+        })
+        logger.info(f"Done translating {profile_path}.")
+
+    # Share the addresses matched by multiple devices as named sets
+    shared_sets = share_addresses([
+        [device["nfqueues"]] + [sub_chain.rules for sub_chain in device["sub_chains"]]
+        for device in devices
+    ])
+
+    # Create nftables script
+    env = create_jinja_env(package)
+    nft_dict = {
+        "hook": hook,
+        "table": table_name,
+        "devices": devices,
+        "dispatched": [device for device in devices if device["mac"] is not None],
+        "nft_sets": shared_sets + [nft_set for device in devices for nft_set in device["nft_sets"]],
+        "nft_timers": [timer for device in devices for timer in device["nft_timers"]],
+        "nft_limits": [nft_limit for device in devices for nft_limit in device["nft_limits"]],
+        "nft_meters": [nft_meter for device in devices for nft_meter in device["nft_meters"]],
+        "nft_counters": [nft_counter for device in devices for nft_counter in device["nft_counters"]],
+        "drop_proba": drop_proba,
+        "log_type": log_type,
+        "log_group": log_group
+    }
+    env.get_template("firewall_fleet.nft.j2").stream(nft_dict).dump(os.path.join(output_dir, "firewall.nft"))
+
+    # Write the names of the policies counted by each counter, if needed
+    if options.counters:
+        write_counters(nft_dict["nft_counters"], output_dir)
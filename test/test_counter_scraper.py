@@ -0,0 +1,49 @@
+import json
+from profile_translator_blocklist import translate_policies
+from profile_translator_blocklist.counter_scraper import read_counters, map_counters
+
+
+### TEST FUNCTIONS ###
+
+def test_counter_scraper(tmp_path) -> None:
+    """
+    Test the mapping of the named counters' values, from the output of `nft -j list counters`,
+    back to the policies of a translated profile.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.1"}}},
+        {"protocols": {"udp": {"dst-port": 123}, "ipv4": {"src": "self", "dst": "10.0.0.2"}}}
+    ]
+    translate_policies(device, policies, output_dir=str(tmp_path), counters=True)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    counted_policies = json.loads((tmp_path / "counters.json").read_text())
+    assert len(counted_policies) == 2
+    for counter in counted_policies:
+        assert f"counter {counter} {{" in nft_script
+        assert f"counter name \"{counter}\" drop" in nft_script
+
+    # Stand-in for the output of `nft -j list counters`,
+    # with counters of the same name in other tables
+    tcp_counter, udp_counter = counted_policies
+    nft_output = json.dumps({"nftables": [
+        {"metainfo": {"version": "1.0.6", "json_schema_version": 1}},
+        {"counter": {"family": "bridge", "name": tcp_counter, "table": "sample-device", "handle": 1, "packets": 42, "bytes": 2520}},
+        {"counter": {"family": "netdev", "name": tcp_counter, "table": "sample-device_early", "handle": 1, "packets": 7, "bytes": 420}},
+        {"counter": {"family": "bridge", "name": tcp_counter, "table": "fleet", "handle": 1, "packets": 100, "bytes": 6000}}
+    ]})
+    counters = read_counters(nft_output)
+    assert counters == {
+        ("bridge", "sample-device", tcp_counter): {"packets": 42, "bytes": 2520},
+        ("netdev", "sample-device_early", tcp_counter): {"packets": 7, "bytes": 420},
+        ("bridge", "fleet", tcp_counter): {"packets": 100, "bytes": 6000}
+    }
+    values = map_counters(counters, counted_policies, "bridge", "sample-device")
+    assert values[counted_policies[tcp_counter][0]] == {"counter": tcp_counter, "packets": 42, "bytes": 2520}
+    assert values[counted_policies[udp_counter][0]]["packets"] == 0
+    values = map_counters(counters, counted_policies, "bridge", "fleet")
+    assert values[counted_policies[tcp_counter][0]]["packets"] == 100
@@ -0,0 +1,94 @@
+import json
+import struct
+import ipaddress
+import pytest
+from profile_translator_blocklist import translate_policies
+from profile_translator_blocklist.hit_stats import get_packet_fields, load_hit_stats
+
+
+### HELPER FUNCTIONS ###
+
+def tcp_frame(saddr: str, daddr: str, dport: int) -> bytes:
+    """
+    Build an Ethernet frame containing an IPv4 TCP segment.
+
+    Args:
+        saddr (str): IPv4 source address
+        daddr (str): IPv4 destination address
+        dport (int): TCP destination port
+    Returns:
+        bytes: Ethernet frame
+    """
+    ether = bytes.fromhex("112233445566") + bytes.fromhex("aabbccddeeff") + struct.pack(">H", 0x0800)
+    tcp = struct.pack(">HHIIBBHHH", 40000, dport, 0, 0, 5 << 4, 0x02, 1024, 0, 0)
+    ip = struct.pack(">BBHHHBBH4s4s", 0x45, 0, 20 + len(tcp), 0, 0, 64, 6, 0,
+                     ipaddress.ip_address(saddr).packed, ipaddress.ip_address(daddr).packed)
+    return ether + ip + tcp
+
+
+def write_pcap(path: str, frames: list) -> None:
+    """
+    Write Ethernet frames to a classic pcap file.
+
+    Args:
+        path (str): path to the pcap file
+        frames (list): Ethernet frames
+    """
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for frame in frames:
+            f.write(struct.pack("<IIII", 0, 0, len(frame), len(frame)))
+            f.write(frame)
+
+
+### TEST FUNCTIONS ###
+
+def test_get_packet_fields() -> None:
+    """
+    Test the extraction of the nftables match fields of an Ethernet frame.
+    """
+    fields = get_packet_fields(tcp_frame("192.168.1.2", "10.0.0.1", 443))
+    assert fields["ether type {}"] == 0x0800
+    assert fields["meta l4proto {}"] == 6
+    assert fields["ip daddr {}"] == int(ipaddress.ip_address("10.0.0.1"))
+    assert fields["tcp dport {}"] == 443
+
+
+def test_translate_hit_stats(tmp_path) -> None:
+    """
+    Test the reordering of the rules from the hit statistics of a packet capture,
+    or of the rules' counters.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"tcp": {"dst-port": 22}, "ipv4": {"src": "self", "dst": "10.0.0.1"}}},
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.2"}}}
+    ]
+    pcap_path = tmp_path / "traffic.pcap"
+    write_pcap(str(pcap_path), [tcp_frame("192.168.1.2", "10.0.0.2", 443)] * 3 + [tcp_frame("192.168.1.2", "10.0.0.1", 22)])
+    translate_policies(device, policies, output_dir=str(tmp_path), hit_stats=str(pcap_path))
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert nft_script.index("tcp dport 443") < nft_script.index("tcp dport 22")
+
+    # Hits of the counters, as read from `nft -j list counters`
+    translate_policies(device, policies, output_dir=str(tmp_path), counters=True)
+    counters = list(json.loads((tmp_path / "counters.json").read_text()))
+    hits = {counters[0]: {"packets": 1, "bytes": 60}}
+    translate_policies(device, policies, output_dir=str(tmp_path), hit_stats=hits)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert nft_script.index("tcp dport 22") < nft_script.index("tcp dport 443")
+    assert load_hit_stats(hits, []) == {counters[0]: 1}
+
+    # Hits of the counters of all tables, as returned by `read_counters`
+    hits = {("bridge", "sample-device", counters[0]): {"packets": 1, "bytes": 60},
+            ("bridge", "other-device", counters[1]): {"packets": 9, "bytes": 540}}
+    translate_policies(device, policies, output_dir=str(tmp_path), hit_stats=hits)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert nft_script.index("tcp dport 22") < nft_script.index("tcp dport 443")
+    assert load_hit_stats(hits, [], table=("bridge", "other-device")) == {counters[1]: 9}
+    with pytest.raises(ValueError):
+        load_hit_stats(hits, [])
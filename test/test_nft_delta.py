@@ -0,0 +1,114 @@
+import json
+import pytest
+from profile_translator_blocklist import translate_policies
+from profile_translator_blocklist.nft_delta import parse_script, read_handles, get_delta
+
+
+### TEST VARIABLES ###
+device = {
+    "name": "sample-device",
+    "mac":  "11:22:33:44:55:66",
+    "ipv4": "192.168.1.2"
+}
+policies = [
+    {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": f"10.0.0.{i}"}}}
+    for i in range(1, 5)
+]
+
+
+### HELPER FUNCTIONS ###
+
+def translate(tmp_path, name: str, policies: list, **kwargs) -> str:
+    """
+    Translate policies, and read the resulting nftables script.
+
+    Args:
+        tmp_path (Path): temporary directory
+        name (str): name of the output directory
+        policies (list): policies to translate
+        kwargs (dict): additional arguments of `translate_policies`
+    Returns:
+        str: content of the nftables script
+    """
+    output_dir = tmp_path / name
+    output_dir.mkdir()
+    translate_policies(device, policies, output_dir=str(output_dir), **kwargs)
+    return (output_dir / "firewall.nft").read_text()
+
+
+def load(nft_script: str, first_handle: int = 10) -> str:
+    """
+    Stand-in for the output of `nft -j list ruleset` once the script is loaded,
+    giving consecutive handles to the rules.
+
+    Args:
+        nft_script (str): content of the loaded nftables script
+        first_handle (int): handle of the first rule
+    Returns:
+        str: JSON listing of the loaded rules
+    """
+    items = [{"metainfo": {"version": "1.0.6", "json_schema_version": 1}}]
+    handle = first_handle
+    for (family, table), content in parse_script(nft_script).items():
+        for chain, data in content["chains"].items():
+            for _ in data["rules"]:
+                items.append({"rule": {"family": family, "table": table, "chain": chain, "handle": handle}})
+                handle += 1
+    return json.dumps({"nftables": items})
+
+
+### TEST FUNCTIONS ###
+
+def test_delta_rules(tmp_path) -> None:
+    """
+    Test the transaction updating the rules of a loaded firewall,
+    which only deletes, adds or moves the changed rules.
+    """
+    old_script = translate(tmp_path, "old", policies, device_guard=True)
+    handles = read_handles(load(old_script))
+    # Handle 10 is the device guard, handles 11 to 14 the policies
+    assert handles == {("bridge", "sample-device", "prerouting"): list(range(10, 15))}
+
+    # Same ruleset
+    assert get_delta(old_script, old_script, handles) == "#!/usr/sbin/nft -f\n\n"
+
+    # Removed, added and moved rules
+    new_policy = {"protocols": {"udp": {"dst-port": 53}, "ipv4": {"src": "self", "dst": "10.0.0.9"}}}
+    new_script = translate(tmp_path, "new", [policies[3], policies[0], policies[2], new_policy], device_guard=True)
+    delta = get_delta(old_script, new_script, handles).splitlines()
+    assert delta[2:] == [
+        "delete rule bridge sample-device prerouting handle 12",
+        "delete rule bridge sample-device prerouting handle 14",
+        "add rule bridge sample-device prerouting position 10 meta l4proto tcp tcp dport 443 ip saddr 192.168.1.2 ip daddr 10.0.0.4 drop",
+        "add rule bridge sample-device prerouting position 13 meta l4proto udp udp dport 53 ip saddr 192.168.1.2 ip daddr 10.0.0.9 drop"
+    ]
+
+    # The loaded rules must match the previous script
+    with pytest.raises(ValueError):
+        get_delta(old_script, new_script, read_handles(load(new_script.replace("10.0.0.1 drop", "10.0.0.1 drop\n        tcp dport 80 drop"))))
+
+
+def test_delta_sets(tmp_path) -> None:
+    """
+    Test the transaction updating the elements of a named set,
+    and the full reload of the tables if the base chain's properties changed.
+    """
+    many_policies = [
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": f"10.0.0.{i}"}}}
+        for i in range(1, 40)
+    ]
+    old_script = translate(tmp_path, "old", many_policies, merge_sets=True)
+    new_script = translate(tmp_path, "new", many_policies[:-1] + [
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.100"}}}
+    ], merge_sets=True)
+    handles = read_handles(load(old_script))
+    delta = get_delta(old_script, new_script, handles).splitlines()
+    assert len(delta) == 4
+    assert delta[2].startswith("add element bridge sample-device ") and delta[2].endswith(" { 10.0.0.100 }")
+    assert delta[3].startswith("delete element bridge sample-device ") and delta[3].endswith(" { 10.0.0.39 }")
+
+    # Base chain priority changed
+    hook_script = translate(tmp_path, "hook", many_policies, merge_sets=True, hook={"priority": -100})
+    delta = get_delta(old_script, hook_script, handles)
+    assert "delete table bridge sample-device\n" in delta
+    assert "type filter hook prerouting priority -100; policy accept;" in delta
@@ -0,0 +1,194 @@
+import os
+import json
+import shutil
+import subprocess
+from pathlib import Path
+import pytest
+from typing import Any
+from profile_translator_blocklist import translate_policies, translate_profile
+from profile_translator_blocklist.LogType import LogType
+from profile_translator_blocklist.RateLimitType import RateLimitType
+from profile_translator_blocklist.nft_json import get_match_json, get_random_verdict_json
+
+
+### TEST VARIABLES ###
+self_path = Path(os.path.abspath(__file__))
+self_dir = self_path.parents[0]
+
+device = {
+    "name": "sample-device",
+    "mac":  "11:22:33:44:55:66",
+    "ipv4": "192.168.1.2"
+}
+policies = [
+    {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": f"10.0.0.{i}"}}}
+    for i in range(1, 6)
+] + [
+    {"protocols": {"udp": {"dst-port": 5353}, "ipv4": {"src": "self", "dst": "mdns"}}},
+    {"protocols": {"udp": {"dst-port": 123}, "ipv4": {"src": "self", "dst": "10.0.1.1"}}, "stats": {"rate": "10/second"}},
+    {"protocols": {"udp": {"dst-port": 1900}, "ipv4": {"src": "self", "dst": "ssdp"}}, "stats": {"packet-count": 10}},
+    {"protocols": {"tcp": {"dst-port": 8883}, "ipv4": {"src": "self", "dst": "10.0.2.1"}}, "stats": {"duration": "10m"}},
+    {"protocols": {"tcp": {"dst-port": 9999}, "ipv4": {"src": "self", "dst": "10.0.2.1"}}, "bidirectional": True}
+]
+
+# Options of the translation, covering the optimizations of the firewall
+translation_options = [
+    {},
+    {"merge_sets": True, "verdict_maps": True, "chain_tree": True},
+    {"log_type": LogType.CSV, "counters": True, "rate_limits": RateLimitType.NAMED},
+    {"log_type": LogType.PCAP, "rate_limits": RateLimitType.SOURCE, "drop_proba": 0.5},
+    {"notrack": True, "offload": True, "flowtable_devices": ["lan0", "wan0"]},
+    {"ct_marks": True, "ct_directions": True, "early_drop": "lan0", "hook": {"priority": -100}}
+]
+
+
+### HELPER FUNCTIONS ###
+
+def payload_match(protocol: str, field: str, value: Any, op: str = "==") -> dict:
+    """
+    Build the JSON statement matching a payload field.
+
+    Args:
+        protocol (str): protocol of the payload field
+        field (str): name of the payload field
+        value (Any): JSON value of the match
+        op (str): relational operator of the match
+    Returns:
+        dict: JSON match statement
+    """
+    return {"match": {"op": op, "left": {"payload": {"protocol": protocol, "field": field}}, "right": value}}
+
+
+def flow_matches(l4proto: str, dport: int, daddr: str) -> list:
+    """
+    Build the JSON statements matching the device's flows to a host and port.
+
+    Args:
+        l4proto (str): transport protocol of the flows
+        dport (int): destination port of the flows
+        daddr (str): destination address of the flows
+    Returns:
+        list: JSON match statements
+    """
+    return [
+        {"match": {"op": "==", "left": {"meta": {"key": "l4proto"}}, "right": l4proto}},
+        payload_match(l4proto, "dport", dport),
+        payload_match("ip", "saddr", "192.168.1.2"),
+        payload_match("ip", "daddr", daddr)
+    ]
+
+
+### TEST FUNCTIONS ###
+
+def test_get_match_json() -> None:
+    """
+    Test the conversion of nftables matches and stats to libnftables JSON statements,
+    from their templates and values.
+    """
+    assert get_match_json({"template": "tcp dport {}", "match": 443}) == [payload_match("tcp", "dport", 443)]
+    assert get_match_json({"template": "tcp dport {}", "match": "{ 80, 1000-2000 }"}) == [
+        payload_match("tcp", "dport", {"set": [80, {"range": [1000, 2000]}]})
+    ]
+    assert get_match_json({"template": "ip daddr {}", "match": "!= 10.0.0.0/24"}) == [
+        payload_match("ip", "daddr", {"prefix": {"addr": "10.0.0.0", "len": 24}}, "!=")
+    ]
+    assert get_match_json({"template": "ip daddr {}", "match": "@shared_addresses"}) == [
+        payload_match("ip", "daddr", "@shared_addresses")
+    ]
+    assert get_match_json({"template": "ip length {}", "match": "100 - 200"}) == [
+        payload_match("ip", "length", {"range": [100, 200]})
+    ]
+    assert get_match_json({"template": "ct original packets > {}", "match": 10}) == [
+        {"match": {"op": ">", "left": {"ct": {"dir": "original", "key": "packets"}}, "right": 10}}
+    ]
+    assert get_match_json({"template": "limit rate over {}", "match": "10 kbytes/second burst 5 packets"}) == [
+        {"limit": {"rate": 10, "per": "second", "rate_unit": "kbytes", "burst": 5, "inv": True}}
+    ]
+    assert get_match_json({"template": "ct state != new ct id != @{}", "match": "timer", "timeout": 60}) == [
+        {"match": {"op": "!=", "left": {"ct": {"key": "state"}}, "right": "new"}},
+        {"match": {"op": "!=", "left": {"ct": {"key": "id"}}, "right": "@timer"}}
+    ]
+    assert get_match_json({"template": "limit name {}", "match": "\"rate\"", "name": "rate"}) == [{"limit": "rate"}]
+    meter = {"template": "update @{}", "match": "meter { ip saddr limit rate over 10/second }",
+             "name": "meter", "key": "ip saddr", "rate": "10/second"}
+    assert get_match_json(meter) == [{"set": {
+        "op": "update", "elem": {"payload": {"protocol": "ip", "field": "saddr"}}, "set": "@meter",
+        "stmt": [{"limit": {"rate": 10, "per": "second", "inv": True}}]
+    }}]
+    assert get_random_verdict_json(0.25) == {"vmap": {
+        "key": {"numgen": {"mode": "random", "mod": 4}},
+        "data": {"set": [[0, {"drop": None}], [{"range": [1, 3]}, {"accept": None}]]}
+    }}
+    with pytest.raises(ValueError):
+        get_match_json({"template": "dns_message.header.qr == {}", "match": 0})
+
+
+def test_translate_json(tmp_path) -> None:
+    """
+    Test the JSON output of the translator against the expected libnftables JSON document,
+    including the duration timers.
+    """
+    timer = "sample_device_tcp_dst_port_8883_ipv4_src_self_dst_10_0_2_1_duration"
+    translate_policies(device, policies[-2:-1] + policies[6:7], output_dir=str(tmp_path), device_guard=True, json_output=True)
+    rule = lambda statements: {"rule": {"family": "bridge", "table": "sample-device", "chain": "prerouting", "expr": statements}}
+    assert json.loads((tmp_path / "firewall.json").read_text()) == {"nftables": [
+        {"metainfo": {"json_schema_version": 1}},
+        {"table": {"family": "bridge", "name": "sample-device"}},
+        {"set": {"family": "bridge", "table": "sample-device", "name": timer,
+                 "type": {"typeof": {"ct": {"key": "id"}}}, "flags": ["dynamic", "timeout"]}},
+        {"chain": {"family": "bridge", "table": "sample-device", "name": "prerouting",
+                   "type": "filter", "hook": "prerouting", "prio": 0, "policy": "accept"}},
+        rule([
+            {"match": {"op": "!=", "left": {"meta": {"key": "pkttype"}}, "right": {"set": ["broadcast", "multicast"]}}},
+            payload_match("ether", "saddr", "11:22:33:44:55:66", "!="),
+            payload_match("ether", "daddr", "11:22:33:44:55:66", "!="),
+            {"return": None}
+        ]),
+        rule(flow_matches("tcp", 8883, "10.0.2.1") + [
+            {"match": {"op": "==", "left": {"ct": {"key": "state"}}, "right": "new"}},
+            {"set": {"op": "add", "elem": {"elem": {"val": {"ct": {"key": "id"}}, "timeout": 600}}, "set": f"@{timer}"}}
+        ]),
+        rule(flow_matches("tcp", 8883, "10.0.2.1") + [
+            {"match": {"op": "!=", "left": {"ct": {"key": "state"}}, "right": "new"}},
+            {"match": {"op": "!=", "left": {"ct": {"key": "id"}}, "right": f"@{timer}"}},
+            {"drop": None}
+        ]),
+        rule(flow_matches("udp", 123, "10.0.1.1") + [
+            {"limit": {"rate": 10, "per": "second", "inv": True}},
+            {"drop": None}
+        ])
+    ]}
+
+
+@pytest.mark.parametrize("options", translation_options)
+def test_translate_nft_check(tmp_path, options: dict) -> None:
+    """
+    Test that the nftables script and the JSON output of the translator are accepted by nftables,
+    with `nft -c -f` and `nft -j -c -f`.
+    The test is skipped if nft cannot be run, unless the environment variable `NFT_CHECK` is set, as in CI.
+    """
+    translate_policies(device, policies, output_dir=str(tmp_path), json_output=True, **options)
+    skip = pytest.fail if os.environ.get("NFT_CHECK") else pytest.skip
+    if shutil.which("nft") is None:
+        skip("nft is not installed")
+    for command in [["nft", "-c", "-f", str(tmp_path / "firewall.nft")], ["nft", "-j", "-c", "-f", str(tmp_path / "firewall.json")]]:
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0 and "Operation not permitted" in result.stderr:
+            skip("nft needs the CAP_NET_ADMIN capability")
+        assert result.returncode == 0, result.stderr
+
+
+def test_translate_profile_json(tmp_path) -> None:
+    """
+    Test the JSON output of a whole profile, which is only written if requested.
+    """
+    profile_path = os.path.join(self_dir, "profile.yaml")
+    translate_profile(profile_path, output_dir=str(tmp_path))
+    assert not (tmp_path / "firewall.json").exists()
+    translate_profile(profile_path, output_dir=str(tmp_path), json_output=True)
+    document = json.loads((tmp_path / "firewall.json").read_text())
+    assert document["nftables"][0] == {"metainfo": {"json_schema_version": 1}}
+    # Same rules queuing packets to user space as the nftables script
+    statements = [statement for item in document["nftables"] if "rule" in item for statement in item["rule"]["expr"]]
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert sum(1 for statement in statements if "queue" in statement) == nft_script.count(" queue num ")
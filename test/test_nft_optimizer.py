@@ -0,0 +1,318 @@
+from profile_translator_blocklist.LogType import LogType
+from profile_translator_blocklist.NFQueue import NFQueue
+from profile_translator_blocklist.VerdictMap import VerdictMap
+from profile_translator_blocklist.SubChain import SubChain
+from profile_translator_blocklist.nft_optimizer import merge_into_sets, build_verdict_maps, build_chain_tree, get_offload_exclusions, build_rate_limits, reorder_rules, merge_directions, remove_redundant_rules, add_counters
+from profile_translator_blocklist.nft_utils import format_matches
+from profile_translator_blocklist import translate_policies
+
+
+### HELPER FUNCTIONS ###
+
+def tcp_queue(name: str, dport: int, daddr: str, queue_num: int = -1) -> NFQueue:
+    """
+    Build an NFQueue object matching TCP traffic to the given port and address.
+
+    Args:
+        name (str): name of the NFQueue
+        dport (int): TCP destination port
+        daddr (str): IPv4 destination address
+        queue_num (int): NFQueue number, or -1 for a kernel-only rule
+    Returns:
+        NFQueue: NFQueue object
+    """
+    nft_matches = [
+        {"template": "meta l4proto {}", "match": "tcp"},
+        {"template": "tcp dport {}", "match": dport},
+        {"template": "ip daddr {}", "match": daddr}
+    ]
+    return NFQueue(name, nft_matches, queue_num)
+
+
+def get_match(nfqueue: NFQueue, template: str) -> str:
+    """
+    Get the value of an NFQueue object's match.
+    """
+    return next(m["match"] for m in nfqueue.nft_matches if m["template"] == template)
+
+
+### TEST FUNCTIONS ###
+
+def test_get_matches_key() -> None:
+    """
+    Test that the key of nftables matches agrees with the comparison of NFQueue objects,
+    which compares the rendered matches, whatever the type of their values.
+    """
+    int_queue = tcp_queue("tcp", 80, "10.0.0.1")
+    str_queue = tcp_queue("tcp", "80", "10.0.0.1")
+    assert int_queue == str_queue
+    assert NFQueue.get_matches_key(int_queue.nft_matches) == NFQueue.get_matches_key(list(reversed(str_queue.nft_matches)))
+    assert NFQueue.get_matches_key(int_queue.nft_matches) != NFQueue.get_matches_key(tcp_queue("tcp", 443, "10.0.0.1").nft_matches)
+
+
+def test_merge_anonymous_set() -> None:
+    """
+    Test the merging of rules differing in one match into an anonymous set.
+    """
+    nfqueues = [
+        tcp_queue("a", 443, "10.0.0.1"),
+        tcp_queue("b", 443, "10.0.0.2"),
+        tcp_queue("c", 80, "10.0.0.9"),
+        tcp_queue("d", 443, "10.0.0.3")
+    ]
+    merged, nft_sets = merge_into_sets(nfqueues)
+    assert nft_sets == []
+    assert [q.name for q in merged] == ["a", "c"]
+    assert get_match(merged[0], "ip daddr {}") == "{ 10.0.0.1, 10.0.0.2, 10.0.0.3 }"
+    assert merged[0].get_nft_rule() == "meta l4proto tcp tcp dport 443 ip daddr { 10.0.0.1, 10.0.0.2, 10.0.0.3 } drop"
+
+
+def test_merge_named_set() -> None:
+    """
+    Test the merging of many rules into a named set.
+    """
+    nfqueues = [tcp_queue(f"host-{i}", 443, f"10.0.1.{i}") for i in range(20)]
+    merged, nft_sets = merge_into_sets(nfqueues)
+    assert len(merged) == 1
+    assert nft_sets == [{
+        "name": "host_0_ip_daddr",
+        "type": "ipv4_addr",
+        "elements": [f"10.0.1.{i}" for i in range(20)]
+    }]
+    assert get_match(merged[0], "ip daddr {}") == "@host_0_ip_daddr"
+
+
+def test_merge_barriers() -> None:
+    """
+    Test that rules are not moved up past overlapping queued rules,
+    and that nothing is merged with CSV logging.
+    """
+    nfqueues = [
+        tcp_queue("a", 443, "10.0.0.1"),
+        tcp_queue("queued", 443, "10.0.0.0/24", queue_num=0),
+        tcp_queue("b", 443, "10.0.0.2"),
+        tcp_queue("c", 443, "10.0.1.1")
+    ]
+    merged, _ = merge_into_sets(nfqueues)
+    assert [q.name for q in merged] == ["a", "queued", "b"]
+    assert get_match(merged[0], "ip daddr {}") == "{ 10.0.0.1, 10.0.1.1 }"
+
+    merged, _ = merge_into_sets(nfqueues, LogType.CSV)
+    assert merged == nfqueues
+
+
+def test_build_verdict_maps() -> None:
+    """
+    Test the replacement of rules matching exact values of the same fields by a verdict map.
+    """
+    nfqueues = [
+        tcp_queue("a", 443, "10.0.0.1"),
+        tcp_queue("queued", 80, "10.0.0.2", queue_num=10),
+        tcp_queue("prefix", 443, "10.0.0.0/24"),
+        tcp_queue("b", 443, "10.0.0.3"),
+        tcp_queue("c", 443, "10.0.1.1")
+    ]
+    rules, verdict_chains = build_verdict_maps(nfqueues)
+    assert [rule.name for rule in rules] == ["a", "prefix", "b"]
+    assert isinstance(rules[0], VerdictMap)
+    assert rules[0].get_nft_rule() == (
+        "meta l4proto . tcp dport . ip daddr vmap { "
+        "tcp . 443 . 10.0.0.1 : drop, tcp . 80 . 10.0.0.2 : jump queued_verdict }"
+    )
+    assert [(chain["name"], chain["rule"]) for chain in verdict_chains] == [("queued_verdict", "queue num 10")]
+    assert verdict_chains[0]["nfqueue"].get_nft_rule() == "queue num 10"
+    # Rule "b" overlaps rule "prefix", so it cannot be moved up, and starts a new verdict map
+    assert [nfqueue.name for nfqueue in rules[2].nfqueues] == ["b", "c"]
+
+
+def test_build_chain_tree() -> None:
+    """
+    Test the dispatch of rules to sub-chains, by layer 4 protocol.
+    """
+    udp_queue = lambda name, daddr: NFQueue(name, [
+        {"template": "meta l4proto {}", "match": "udp"},
+        {"template": "udp dport {}", "match": 53},
+        {"template": "ip daddr {}", "match": daddr}
+    ])
+    any_queue = NFQueue("any-to-10.0.0.9", [{"template": "ip daddr {}", "match": "10.0.0.9"}], 10)
+    nfqueues = [
+        tcp_queue("tcp-1", 443, "10.0.0.1"),
+        udp_queue("udp-1", "10.0.0.1"),
+        tcp_queue("tcp-2", 443, "10.0.0.2"),
+        udp_queue("udp-2", "10.0.0.2"),
+        any_queue,
+        tcp_queue("tcp-3", 443, "10.0.0.3"),
+        tcp_queue("tcp-4", 443, "10.0.0.4"),
+        udp_queue("udp-3", "10.0.0.9")
+    ]
+    rules, sub_chains = build_chain_tree(nfqueues, ["meta l4proto {}"], min_size=3)
+    assert [rule.name for rule in rules] == ["meta_l4proto_tcp", "udp-1", "udp-2", "any-to-10.0.0.9", "udp-3"]
+    assert isinstance(rules[0], SubChain)
+    assert rules[0].get_nft_rule() == "meta l4proto tcp jump meta_l4proto_tcp"
+    assert [rule.name for rule in sub_chains[0].rules] == ["tcp-1", "tcp-2", "tcp-3", "tcp-4"]
+    assert sub_chains[0].rules[0].get_nft_rule() == "tcp dport 443 ip daddr 10.0.0.1 drop"
+    # Input NFQueue objects are left untouched
+    assert len(nfqueues[0].nft_matches) == 3
+
+
+def test_get_offload_exclusions() -> None:
+    """
+    Test the computation of the flows which cannot be offloaded to a flowtable.
+    """
+    rate_queue = tcp_queue("tcp-rate", 80, "10.0.0.3")
+    rate_queue.nft_stats["rate"] = {"template": "limit rate {}", "match": "10/second"}
+    nfqueues = [
+        tcp_queue("tcp-drop", 22, "10.0.0.1"),
+        tcp_queue("tcp-queue", 443, "10.0.0.2", queue_num=0),
+        rate_queue
+    ]
+    assert [format_matches(exclusion) for exclusion in get_offload_exclusions(nfqueues)] == [
+        "meta l4proto tcp tcp dport 443 ip daddr 10.0.0.2",
+        "meta l4proto tcp tcp sport 443 ip saddr 10.0.0.2",
+        "meta l4proto tcp tcp dport 80 ip daddr 10.0.0.3",
+        "meta l4proto tcp tcp sport 80 ip saddr 10.0.0.3"
+    ]
+
+    # Rules matching per-packet fields only might match any flow
+    icmp_queue = NFQueue("icmp", [{"template": "icmp type {}", "match": "echo-request"}])
+    assert get_offload_exclusions(nfqueues + [icmp_queue]) is None
+
+
+def test_build_rate_limits() -> None:
+    """
+    Test the replacement of anonymous rate limits by named limits and per-source meters.
+    """
+    rate_queue = tcp_queue("tcp-rate", 80, "10.0.0.3")
+    rate_queue.nft_stats["rate"] = {"template": "limit rate over {}", "match": "10/second"}
+    nfqueues = [tcp_queue("tcp-drop", 22, "10.0.0.1"), rate_queue]
+
+    rules, nft_limits, nft_meters = build_rate_limits(nfqueues, prefix="dev_")
+    assert rules[0] is nfqueues[0]
+    assert nft_limits == [{"name": "dev_tcp_rate_rate", "rate": "10/second"}]
+    assert nft_meters == []
+    assert rules[1].get_nft_rule() == "meta l4proto tcp tcp dport 80 ip daddr 10.0.0.3 limit name \"dev_tcp_rate_rate\" drop"
+
+    rules, nft_limits, nft_meters = build_rate_limits(nfqueues, per_source=True)
+    assert nft_limits == []
+    assert nft_meters == [{"name": "tcp_rate_meter", "type": "ipv4_addr", "timeout": "1m"}]
+    assert rules[1].get_nft_rule().endswith("update @tcp_rate_meter { ip saddr limit rate over 10/second } drop")
+    # Input NFQueue objects are left untouched
+    assert rate_queue.nft_stats["rate"]["template"] == "limit rate over {}"
+
+
+def test_reorder_rules() -> None:
+    """
+    Test the reordering of rules by decreasing number of hits,
+    which only moves rules that cannot match the same packets.
+    """
+    any_queue = NFQueue("any-to-10.0.0.2", [{"template": "ip daddr {}", "match": "10.0.0.2"}])
+    nfqueues = [
+        tcp_queue("tcp-1", 22, "10.0.0.1"),
+        any_queue,
+        tcp_queue("tcp-2", 443, "10.0.0.2"),
+        tcp_queue("tcp-3", 443, "10.0.0.3")
+    ]
+    hits = {"tcp_1": 1, "any_to_10_0_0_2": 5, "tcp_2": 100, "tcp_3": 50}
+    rules = reorder_rules(nfqueues, hits)
+    # tcp-2 overlaps any-to-10.0.0.2, hence stays after it
+    assert [rule.name for rule in rules] == ["tcp-3", "any-to-10.0.0.2", "tcp-2", "tcp-1"]
+    # Without hits, the order is unchanged
+    assert reorder_rules(nfqueues, {}) == nfqueues
+
+
+def test_reorder_rules_shared_slug() -> None:
+    """
+    Test the hits of rules whose names share the same slug,
+    which are looked up by the names of their counters, whatever the rule order.
+    """
+    dash_queue = tcp_queue("tcp-4", 443, "10.0.0.4")
+    underscore_queue = tcp_queue("tcp_4", 443, "10.0.0.5")
+    for nfqueues in [[dash_queue, underscore_queue], [underscore_queue, dash_queue]]:
+        rules, nft_counters = add_counters(nfqueues)
+        assert sorted(nft_counter["name"] for nft_counter in nft_counters) == ["tcp_4", "tcp_4_2"]
+        assert {rule.name: rule.counter for rule in rules} == {"tcp-4": "tcp_4", "tcp_4": "tcp_4_2"}
+
+    # Each rule is credited with the hits of its own counter
+    rules = reorder_rules([dash_queue, underscore_queue], {"tcp_4": 1, "tcp_4_2": 10})
+    assert [rule.name for rule in rules] == ["tcp_4", "tcp-4"]
+    rules = reorder_rules([underscore_queue, dash_queue], {"tcp_4": 10, "tcp_4_2": 1})
+    assert [rule.name for rule in rules] == ["tcp-4", "tcp_4"]
+
+
+def test_merge_directions() -> None:
+    """
+    Test the merging of the rules matching both directions of the same flows
+    into a single rule matching the flows' original tuple,
+    which is not done past an overlapping queued rule.
+    """
+    forward = NFQueue("fwd", [
+        {"template": "tcp sport {}", "match": 9999},
+        {"template": "ip saddr {}", "match": "192.168.1.2"},
+        {"template": "ip daddr {}", "match": "192.168.1.3"}
+    ])
+    backward = NFQueue("fwd-backward", [
+        {"template": "tcp dport {}", "match": 9999},
+        {"template": "ip daddr {}", "match": "192.168.1.2"},
+        {"template": "ip saddr {}", "match": "192.168.1.3"}
+    ])
+    other = tcp_queue("other", 443, "10.0.0.1")
+    merged = merge_directions([forward, other, backward])
+    assert [q.name for q in merged] == ["fwd", "other"]
+    assert merged[0].get_nft_rule() == (
+        "meta l4proto tcp "
+        "ct original ip saddr . ct original ip daddr . ct original proto-src . ct original proto-dst "
+        "{ 192.168.1.2 . 192.168.1.3 . 9999 . 0-65535, 192.168.1.3 . 192.168.1.2 . 0-65535 . 9999 } drop"
+    )
+
+    queued = tcp_queue("queued", 9999, "192.168.1.2", queue_num=0)
+    assert merge_directions([forward, queued, backward]) == [forward, queued, backward]
+    assert merge_directions([forward, backward], LogType.CSV) == [forward, backward]
+
+
+def test_remove_redundant_rules() -> None:
+    """
+    Test the removal of the rules covered by another rule with the same verdict:
+    rules shadowed by an earlier rule, and kernel-only rules covered by a later kernel-only rule,
+    which are not removed past an overlapping queued rule.
+    """
+    subnet = tcp_queue("subnet", "1000-2000", "10.0.0.0/24")
+    nfqueues = [
+        tcp_queue("host-before", 1500, "10.0.0.1"),
+        tcp_queue("host-blocked", 1500, "10.0.0.2"),
+        NFQueue("queued", [
+            {"template": "ip saddr {}", "match": "192.168.1.2"},
+            {"template": "ip daddr {}", "match": "10.0.0.2"}
+        ], 0),
+        subnet,
+        tcp_queue("host-after", 1200, "10.0.0.3", queue_num=10),
+        tcp_queue("outside", 1200, "10.0.1.3")
+    ]
+    rules, removed = remove_redundant_rules(nfqueues)
+    # host-blocked might be matched by the queued rule, hence is not covered by the subnet rule
+    assert [rule.name for rule in rules] == ["host-blocked", "queued", "subnet", "outside"]
+    assert [(rule.name, covering.name) for rule, covering in removed] == [
+        ("host-after", "subnet"),
+        ("host-before", "subnet")
+    ]
+    # Rules logged with their name are only removed if shadowed
+    rules, removed = remove_redundant_rules(nfqueues, LogType.CSV)
+    assert [rule.name for rule, _ in removed] == ["host-after"]
+
+
+def test_translate_merge_sets(tmp_path) -> None:
+    """
+    Test the translation of policies with rules merged into sets.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": f"10.0.0.{i}"}}}
+        for i in range(1, 21)
+    ]
+    translate_policies(device, policies, output_dir=str(tmp_path), merge_sets=True)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "flags interval" in nft_script
+    assert nft_script.count(" drop") == 1
@@ -0,0 +1,70 @@
+from profile_translator_blocklist.ValueSet import ValueSet
+from profile_translator_blocklist.nft_utils import split_elements, parse_value, get_rule_fields, may_overlap, is_subset, get_random_verdict
+
+
+### TEST FUNCTIONS ###
+
+def test_value_set() -> None:
+    """
+    Test the set operations of the class `ValueSet`.
+    """
+    a = ValueSet([(10, 20), (0, 5), (21, 30)], 100)
+    assert a.intervals == [(0, 5), (10, 30)]
+    assert len(a) == 27
+    b = ValueSet([(15, 40)], 100)
+    assert a.intersection(b) == ValueSet([(15, 30)])
+    assert a.union(b) == ValueSet([(0, 5), (10, 40)])
+    assert ValueSet([(12, 18)]).issubset(a)
+    assert not b.issubset(a)
+    assert a.isdisjoint(ValueSet([(6, 9), (31, 100)]))
+    assert a.complement() == ValueSet([(6, 9), (31, 100)])
+
+
+def test_parse_value() -> None:
+    """
+    Test the parsing of nftables match values.
+    """
+    assert split_elements("{ 80, 443 }") == ["80", "443"]
+    assert split_elements("!= 80") is None
+    assert parse_value("{ 80, 443 }", "inet_service") == ValueSet([(80, 80), (443, 443)])
+    assert parse_value("1000-2000", "inet_service") == ValueSet([(1000, 2000)])
+    assert parse_value("192.168.1.0/24", "ipv4_addr") == ValueSet([(0xc0a80100, 0xc0a801ff)])
+    assert parse_value("!= 53", "inet_service") == ValueSet([(0, 52), (54, 65535)])
+    assert parse_value("< 100", "integer") == ValueSet([(0, 99)])
+    assert parse_value("100 - 200", "integer") == ValueSet([(100, 200)])
+    assert parse_value("tcp", "inet_proto") == ValueSet([(6, 6)])
+    assert parse_value("www.example.com", "ipv4_addr") is None
+
+
+def test_rule_relations() -> None:
+    """
+    Test the overlap and inclusion checks between nftables rules.
+    """
+    tcp_443 = get_rule_fields([
+        {"template": "tcp dport {}", "match": 443},
+        {"template": "ip daddr {}", "match": "10.0.0.1"}
+    ])
+    tcp_any = get_rule_fields([
+        {"template": "meta l4proto {}", "match": "tcp"},
+        {"template": "ip daddr {}", "match": "10.0.0.0/8"}
+    ])
+    udp_53 = get_rule_fields([{"template": "udp dport {}", "match": 53}])
+    unknown = get_rule_fields([{"template": "ct state {}", "match": "established"}])
+
+    assert is_subset(tcp_443, tcp_any)
+    assert not is_subset(tcp_any, tcp_443)
+    assert not may_overlap(tcp_443, udp_53)
+    assert may_overlap(tcp_443, tcp_any)
+    assert may_overlap(unknown, tcp_443)
+    assert not is_subset(tcp_443, unknown)
+
+
+def test_get_random_verdict() -> None:
+    """
+    Test the kernel verdict dropping packets with a given probability.
+    """
+    assert get_random_verdict(0.25) == "numgen random mod 4 vmap { 0 : drop, 1-3 : accept }"
+    assert get_random_verdict(0.5) == "numgen random mod 2 vmap { 0 : drop, 1 : accept }"
+    # Probabilities too close to 0 or 1 are approximated with the finest resolution
+    assert get_random_verdict(0.00001) == "numgen random mod 10000 vmap { 0 : drop, 1-9999 : accept }"
+    assert get_random_verdict(0.99999) == "numgen random mod 10000 vmap { 0-9998 : drop, 9999 : accept }"
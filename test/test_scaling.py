@@ -0,0 +1,92 @@
+import math
+import time
+import statistics
+import tracemalloc
+from profile_translator_blocklist import translate_policies
+from profile_translator_blocklist.profile_generator import generate_policies
+
+
+### TEST VARIABLES ###
+device = {
+    "name": "scaling-device",
+    "mac":  "11:22:33:44:55:66",
+    "ipv4": "192.168.1.2"
+}
+base_num_policies = 200        # Number of policies at scale 1, large enough for the fixed costs not to dominate
+scales = [1, 4, 16]            # Profile size multipliers
+max_growth_exponent = 1.5      # 1 means linear growth, 2 means quadratic growth
+num_timing_runs = 5            # Number of runs per scale, the median one is kept
+
+
+### HELPER FUNCTIONS ###
+
+def measure(num_policies: int, output_dir: str) -> tuple:
+    """
+    Measure the time and peak memory needed to translate a generated profile.
+
+    Args:
+        num_policies (int): number of policies in the generated profile
+        output_dir (str): output directory for the generated files
+    Returns:
+        tuple: translation time, in seconds, and peak memory usage, in bytes
+    """
+    # Time: keep the median run, to reduce noise
+    times = []
+    for _ in range(num_timing_runs):
+        policies = list(generate_policies(num_policies).values())
+        start = time.perf_counter()
+        translate_policies(device, policies, output_dir=output_dir)
+        times.append(time.perf_counter() - start)
+    elapsed = statistics.median(times)
+
+    # Memory
+    policies = list(generate_policies(num_policies).values())
+    tracemalloc.start()
+    translate_policies(device, policies, output_dir=output_dir)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+def growth_exponent(sizes: list, values: list) -> float:
+    """
+    Compute the growth exponent of values with respect to sizes,
+    i.e. the slope of the least-squares fit in log-log space.
+
+    Args:
+        sizes (list): input sizes
+        values (list): measured values
+    Returns:
+        float: growth exponent (1 for linear growth, 2 for quadratic growth)
+    """
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(value) for value in values]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    num = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    den = sum((x - mean_x) ** 2 for x in xs)
+    return num / den
+
+
+### TEST FUNCTIONS ###
+
+def test_translation_scaling(tmp_path) -> None:
+    """
+    Test that the translation time and memory usage grow close to linearly
+    with the number of policies in the profile.
+    The measurements include the fixed costs (Jinja2 environment, file output, ...),
+    which can only lower the growth exponent.
+    """
+    sizes = [base_num_policies * scale for scale in scales]
+    times = []
+    peaks = []
+    for size in sizes:
+        elapsed, peak = measure(size, str(tmp_path))
+        times.append(elapsed)
+        peaks.append(peak)
+
+    time_exponent = growth_exponent(sizes, times)
+    assert time_exponent < max_growth_exponent, f"Translation time grows as n^{time_exponent:.2f}: {times}"
+    memory_exponent = growth_exponent(sizes, peaks)
+    assert memory_exponent < max_growth_exponent, f"Memory usage grows as n^{memory_exponent:.2f}: {peaks}"
@@ -1,11 +1,17 @@
 import os
+import sys
+import hashlib
+import subprocess
 from pathlib import Path
-from profile_translator_blocklist import translate_policy, translate_profile
+import yaml
+import pytest
+from profile_translator_blocklist import translate_policy, translate_policies, translate_profile, translate_fleet, FirewallOptions
 
 # Paths
 self_name = os.path.basename(__file__)
 self_path = Path(os.path.abspath(__file__))
 self_dir = self_path.parents[0]
+repo_dir = self_path.parents[1]
 
 
 ### TEST FUNCTIONS ###
@@ -44,3 +50,503 @@ def test_translate_profile() -> None:
     """
     sample_profile = os.path.join(self_dir, 'profile.yaml')
     translate_profile(sample_profile)
+
+
+def test_translate_profile_reproducible(tmp_path) -> None:
+    """
+    Test that the function `translate_profile` from the package `profile-translator`
+    generates byte-identical files regardless of the hash randomization seed.
+    """
+    profile = os.path.join(self_dir, "profile_parsers.yaml")
+    script = "from profile_translator_blocklist import translate_profile; translate_profile({!r}, output_dir={!r})"
+    python_path = [str(repo_dir)] + ([os.environ["PYTHONPATH"]] if "PYTHONPATH" in os.environ else [])
+
+    digests = {}
+    for seed in ["0", "1", "2", "42"]:
+        output_dir = tmp_path / seed
+        output_dir.mkdir()
+        env = dict(os.environ, PYTHONHASHSEED=seed, PYTHONPATH=os.pathsep.join(python_path))
+        subprocess.run([sys.executable, "-c", script.format(profile, str(output_dir))], env=env, check=True)
+        digests[seed] = {
+            file.name: hashlib.sha256(file.read_bytes()).hexdigest()
+            for file in sorted(output_dir.iterdir())
+        }
+
+    assert "nfqueues.c" in digests["0"]
+    assert all(digest == digests["0"] for digest in digests.values())
+
+
+def test_translate_profile_split_sources(tmp_path) -> None:
+    """
+    Test the function `translate_profile` from the package `profile-translator`,
+    with the NFQueue C source code split into one file per NFQueue.
+    """
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    translate_profile(sample_profile, output_dir=str(tmp_path), split_sources=True)
+
+    # One C file per NFQueue, plus the shared header and main
+    callbacks = sorted(file.name for file in tmp_path.glob("callback_*.c"))
+    assert callbacks == [
+        "callback_dns_query_tplinkapi.c",
+        "callback_dns_query_tplinkapi_backward.c",
+        "callback_wan_https_to_domain_tplinkapi.c",
+        "callback_wan_https_to_domain_tplinkapi_backward.c"
+    ]
+    assert (tmp_path / "nfqueues.h").is_file()
+    assert (tmp_path / "main.c").is_file()
+    assert not (tmp_path / "nfqueues.c").exists()
+    cmake = (tmp_path / "CMakeLists.txt").read_text()
+    assert all(source in cmake for source in ["main.c"] + callbacks)
+
+    # Unchanged files are not rewritten, to preserve incremental builds
+    mtimes = {file.name: file.stat().st_mtime_ns for file in tmp_path.iterdir() if file.suffix != ".nft"}
+    translate_profile(sample_profile, output_dir=str(tmp_path), split_sources=True)
+    assert mtimes == {file.name: file.stat().st_mtime_ns for file in tmp_path.iterdir() if file.suffix != ".nft"}
+
+
+def test_translate_options(tmp_path) -> None:
+    """
+    Test the options of the firewall given as a `FirewallOptions` object,
+    overridden by individual options.
+    """
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    options = FirewallOptions(merge_sets=True, counters=True)
+    (tmp_path / "object").mkdir()
+    (tmp_path / "kwargs").mkdir()
+    translate_profile(sample_profile, output_dir=str(tmp_path / "object"), options=options)
+    translate_profile(sample_profile, output_dir=str(tmp_path / "kwargs"), merge_sets=True, counters=True)
+    for name in ["firewall.nft", "counters.json", "nfqueues.c"]:
+        assert (tmp_path / "object" / name).read_text() == (tmp_path / "kwargs" / name).read_text()
+
+    # Individual options override the object, which is left unchanged
+    translate_profile(sample_profile, output_dir=str(tmp_path / "object"), options=options, counters=False)
+    assert "counter name" not in (tmp_path / "object" / "firewall.nft").read_text()
+    assert options.counters
+
+    with pytest.raises(TypeError):
+        translate_profile(sample_profile, output_dir=str(tmp_path), unknown_option=True)
+
+
+def test_translate_device_guard(tmp_path) -> None:
+    """
+    Test the guard skipping the traffic which does not involve the device,
+    which is only emitted if requested, if all policies involve the device,
+    and if the base chain sees the Ethernet header.
+    """
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    guard = "ether saddr != 50:c7:bf:ed:0a:54 ether daddr != 50:c7:bf:ed:0a:54 return"
+    translate_profile(sample_profile, output_dir=str(tmp_path))
+    firewall = (tmp_path / "firewall.nft").read_text()
+    assert "meta pkttype" not in firewall
+    assert guard not in firewall
+    translate_profile(sample_profile, output_dir=str(tmp_path), device_guard=True)
+    assert guard in (tmp_path / "firewall.nft").read_text()
+    translate_profile(sample_profile, output_dir=str(tmp_path), device_guard=True, hook={"family": "inet", "hook": "forward"})
+    assert guard not in (tmp_path / "firewall.nft").read_text()
+
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policy_dict = {
+        "protocols": {
+            "tcp": {"dst-port": 22},
+            "ipv4": {"src": "192.168.1.3", "dst": "192.168.1.4"}
+        }
+    }
+    translate_policy(device, policy_dict, output_dir=str(tmp_path), device_guard=True)
+    assert "return" not in (tmp_path / "firewall.nft").read_text()
+
+
+def test_translate_cli(tmp_path) -> None:
+    """
+    Test the command line interface of the translator, with the opt-in device guard.
+    """
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    python_path = [str(repo_dir)] + ([os.environ["PYTHONPATH"]] if "PYTHONPATH" in os.environ else [])
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(python_path))
+    command = [sys.executable, "-m", "profile_translator_blocklist", sample_profile, "-o", str(tmp_path)]
+    subprocess.run(command, env=env, check=True)
+    assert "meta pkttype" not in (tmp_path / "firewall.nft").read_text()
+    subprocess.run(command + ["--device-guard"], env=env, check=True)
+    assert "meta pkttype" in (tmp_path / "firewall.nft").read_text()
+
+
+def test_translate_stochastic_kernel(tmp_path) -> None:
+    """
+    Test the stochastic verdict given in the kernel
+    to the policies which do not need to be queued to user space.
+    """
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    translate_profile(sample_profile, output_dir=str(tmp_path), drop_proba=0.25)
+    firewall = (tmp_path / "firewall.nft").read_text()
+    assert "tcp sport 9999 ip saddr 192.168.1.135 ip daddr 192.168.1.222 numgen random mod 4 vmap { 0 : drop, 1-3 : accept }" in firewall
+    assert "tcp dport 443 ip saddr 192.168.1.135 queue num" in firewall
+
+
+def test_translate_counters(tmp_path) -> None:
+    """
+    Test the kernel enforcement of the packet count and duration statistics.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {
+            "protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.1"}},
+            "stats": {"packet-count": 100, "duration": "5m"},
+            "bidirectional": True
+        },
+        {
+            "protocols": {"udp": {"dst-port": 123}, "ipv4": {"src": "self", "dst": "10.0.0.2"}},
+            "stats": {"packet-count": {"fwd": 10, "bwd": 20}}
+        }
+    ]
+    translate_policies(device, policies, output_dir=str(tmp_path))
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    timer = "sample_device_tcp_dst_port_443_ipv4_src_self_dst_10_0_0_1_duration"
+    assert f"set {timer} {{" in nft_script
+    assert f"ct state new add @{timer} {{ ct id timeout 300s }}" in nft_script
+    assert nft_script.count(f"ct packets > 100 ct state != new ct id != @{timer} drop") == 2
+    assert "ct original packets > 10 drop" in nft_script
+    # Counters are enforced in the kernel, hence no NFQueue is needed
+    assert not (tmp_path / "nfqueues.c").exists()
+
+
+def test_translate_counters_netdev(tmp_path, caplog) -> None:
+    """
+    Test the removal of the rules checking packet count and duration statistics,
+    and of their timers, from a netdev table, which does not use connection tracking.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.1"}}, "stats": {"duration": "5m"}},
+        {"protocols": {"udp": {"dst-port": 123}, "ipv4": {"src": "self", "dst": "10.0.0.2"}}, "stats": {"packet-count": 10}},
+        {"protocols": {"tcp": {"dst-port": 22}, "ipv4": {"src": "self", "dst": "10.0.0.3"}}}
+    ]
+    translate_policies(device, policies, output_dir=str(tmp_path), test=True)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "table netdev sample-device {" in nft_script
+    assert " ct " not in nft_script
+    assert "_duration" not in nft_script
+    assert "tcp dport 22 ip saddr 192.168.1.2 ip daddr 10.0.0.3 drop" in nft_script
+    assert sum("need connection tracking" in record.message for record in caplog.records) == 2
+
+
+def test_translate_counters_merged(tmp_path) -> None:
+    """
+    Test the durations of the policies sharing an NFQueue,
+    which are checked against the timer with the longest timeout.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {
+            "protocols": {
+                "dns": {"qtype": "A", "domain-name": f"{name}.example.com"},
+                "udp": {"dst-port": 53},
+                "ipv4": {"src": "self", "dst": "gateway"}
+            },
+            "stats": {"duration": duration}
+        }
+        for name, duration in [("a", "1m"), ("b", "10m"), ("c", "5m")]
+    ]
+    translate_policies(device, policies, output_dir=str(tmp_path))
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    timer = "sample_device_dns_qtype_A_domain_name_b_example_com_udp_dst_port_53_ipv4_src_self_dst_gateway_duration"
+    assert nft_script.count("typeof ct id") == 1
+    assert f"set {timer} {{" in nft_script
+    assert f"ct state new add @{timer} {{ ct id timeout 600s }}" in nft_script
+    assert f"ct state != new ct id != @{timer} queue num 0" in nft_script
+
+
+def test_translate_ct_marks(tmp_path) -> None:
+    """
+    Test the caching of user space DROP verdicts in conntrack marks,
+    which is disabled with a stochastic verdict.
+    ACCEPT verdicts are not cached, for the next messages of an accepted connection,
+    which might have to be dropped, to still be queued to user space.
+    """
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    translate_profile(sample_profile, output_dir=str(tmp_path), ct_marks=True)
+    firewall = (tmp_path / "firewall.nft").read_text()
+    assert "ct mark 2 drop" in firewall
+    assert firewall.count("ct mark") == 1
+    nfqueues = (tmp_path / "nfqueues.c").read_text()
+    assert "set_ct_mark(" in nfqueues
+    assert "CT_MARK_ACCEPT" not in nfqueues
+    assert nfqueues.count("set_ct_mark(thread_data") == nfqueues.count("if (verdict == NF_DROP) {\n        set_ct_mark(")
+    assert "netfilter_conntrack" in (tmp_path / "CMakeLists.txt").read_text()
+
+    translate_profile(sample_profile, output_dir=str(tmp_path), drop_proba=0.5, ct_marks=True)
+    assert "ct mark" not in (tmp_path / "firewall.nft").read_text()
+    assert "set_ct_mark(" not in (tmp_path / "nfqueues.c").read_text()
+
+
+def test_translate_workers(tmp_path) -> None:
+    """
+    Test the spreading of the NFQueues' flows over multiple worker threads,
+    each one reading its own queue.
+    """
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    translate_profile(sample_profile, output_dir=str(tmp_path), workers=4)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "queue num 0-3 fanout" in nft_script
+    assert "queue num 4-7 fanout" in nft_script
+    # The queues of the next policy start after the reserved range
+    assert "queue num 10-13 fanout" in nft_script
+    nfqueues = (tmp_path / "nfqueues.c").read_text()
+    assert "#define NUM_THREADS 16" in nfqueues
+    assert all(f".queue_id = {queue_id}," in nfqueues for queue_id in [0, 3, 4, 7, 10, 13, 14, 17])
+
+    translate_profile(sample_profile, output_dir=str(tmp_path), workers=6)
+    assert "queue num 20-25 fanout" in (tmp_path / "firewall.nft").read_text()
+
+    # Thread IDs do not wrap around beyond 255 threads
+    translate_profile(sample_profile, output_dir=str(tmp_path), workers=100)
+    nfqueues = (tmp_path / "nfqueues.c").read_text()
+    assert "#define NUM_THREADS 400" in nfqueues
+    assert "uint16_t  id;" in nfqueues
+    assert "uint16_t i = 0;" in nfqueues
+
+    # Queue numbers are unsigned 16-bit integers
+    with pytest.raises(ValueError):
+        translate_profile(sample_profile, output_dir=str(tmp_path), workers=40000)
+    with pytest.raises(ValueError):
+        translate_profile(sample_profile, output_dir=str(tmp_path), nfqueue_id=65530)
+    translate_profile(sample_profile, output_dir=str(tmp_path), nfqueue_id=65500)
+    assert "queue num 65510" in (tmp_path / "firewall.nft").read_text()
+
+
+def test_translate_queue_settings(tmp_path) -> None:
+    """
+    Test the overload protection settings of the NFQueues,
+    given for the whole profile and overridden by a policy's `queue` settings.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"dns": {"domain-name": "example.com", "qtype": "A"}, "udp": {"dst-port": 53}, "ipv4": {"src": "self", "dst": "192.168.1.1"}}},
+        {
+            "protocols": {"dns": {"domain-name": "example.org", "qtype": "A"}, "udp": {"dst-port": 5353}, "ipv4": {"src": "self", "dst": "192.168.1.1"}},
+            "queue": {"bypass": False, "maxlen": 4096}
+        }
+    ]
+    queue_settings = {"bypass": True, "fail-open": True}
+    translate_policies(device, policies, output_dir=str(tmp_path), workers=2, queue_settings=queue_settings)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "queue num 0-1 bypass,fanout" in nft_script
+    assert "queue num 10-11 fanout" in nft_script
+    # Settings are applied on the queue handles, by the threads reading the queues
+    nfqueues = (tmp_path / "nfqueues.c").read_text()
+    assert "#include <libnetfilter_queue/libnetfilter_queue.h>" in nfqueues
+    assert "nfq_set_queue_maxlen(qh, queue_arg->queue_maxlen)" in nfqueues
+    assert "nfq_set_queue_flags(qh, NFQA_CFG_F_FAIL_OPEN, NFQA_CFG_F_FAIL_OPEN)" in nfqueues
+    assert nfqueues.count("pthread_create(&(thread_data[i++].thread), NULL, queue_thread, ") == 4
+    assert nfqueues.count(".fail_open = true") == 4
+    assert nfqueues.count(".queue_maxlen = 4096,") == 2
+    assert "netfilter_queue)" in (tmp_path / "CMakeLists.txt").read_text()
+
+    with pytest.raises(ValueError):
+        translate_policies(device, policies, output_dir=str(tmp_path), queue_settings={"maxlength": 10})
+
+
+def test_translate_copy_ranges(tmp_path) -> None:
+    """
+    Test the number of bytes of the packets copied to user space for each NFQueue,
+    bounded by the IPv4 and transport headers for the NFQueues without custom parser,
+    and the whole packet otherwise.
+    """
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    translate_profile(sample_profile, output_dir=str(tmp_path), copy_ranges=True)
+    nfqueues = (tmp_path / "nfqueues.c").read_text()
+    # DNS messages have no bound (EDNS): whole packet, from the library's thread
+    assert ".queue_id = 0,\n        .func" in nfqueues
+    assert ".queue_id = 1,\n        .func" in nfqueues
+    # Domain name lookup only: IPv4 and TCP headers, applied on the queue handle
+    assert ".queue_id = 10,\n            .func" in nfqueues
+    assert ".copy_range = 120\n" in nfqueues
+    assert "nfq_set_mode(qh, NFQNL_COPY_PACKET, queue_arg->copy_range)" in nfqueues
+
+
+def test_translate_flowtable(tmp_path) -> None:
+    """
+    Test the offload of the established flows to a flowtable,
+    from the forward hook of a separate inet table.
+    This hook only sees routed traffic, hence bridged flows, e.g. between two LAN devices,
+    are never offloaded, and still traverse the device's bridge table.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.1"}}},
+        {"protocols": {"udp": {"dst-port": 1900}, "ipv4": {"src": "self", "dst": "10.0.0.2"}}, "stats": {"packet-count": 10}}
+    ]
+    translate_policies(device, policies, output_dir=str(tmp_path), offload=True, flowtable_devices=["lan0", "wan0"])
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "table inet sample-device_offload {" in nft_script
+    assert "devices = { lan0, wan0 }" in nft_script
+    assert "type filter hook forward priority 0; policy accept;" in nft_script
+    assert "ct state established flow add @ft" in nft_script
+    # Flows counted by the device's rules are not offloaded
+    assert "meta l4proto udp udp dport 1900 ip saddr 192.168.1.2 ip daddr 10.0.0.2 return" in nft_script
+    # Bridged traffic is still filtered by the bridge table
+    assert "table bridge sample-device {" in nft_script
+    assert "tcp dport 443 ip saddr 192.168.1.2 ip daddr 10.0.0.1 drop" in nft_script
+
+    # The flowtable needs its network interfaces
+    with pytest.raises(ValueError):
+        translate_policies(device, policies, output_dir=str(tmp_path), offload=True)
+    translate_policies(device, policies, output_dir=str(tmp_path), flowtable_devices=["lan0", "wan0"])
+    assert "flowtable" not in (tmp_path / "firewall.nft").read_text()
+
+
+def test_translate_notrack(tmp_path) -> None:
+    """
+    Test the chain skipping connection tracking for the multicast and broadcast traffic,
+    which excludes the traffic matched by rules depending on conntrack.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"udp": {"dst-port": 5353}, "ipv4": {"src": "self", "dst": "mdns"}}},
+        {"protocols": {"udp": {"dst-port": 67}, "ipv4": {"src": "self", "dst": "broadcast"}}},
+        {"protocols": {"udp": {"dst-port": 1900}, "ipv4": {"src": "self", "dst": "ssdp"}}, "stats": {"packet-count": 10}},
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.1"}}}
+    ]
+    translate_policies(device, policies, output_dir=str(tmp_path), notrack=True)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "type filter hook prerouting priority -300; policy accept;" in nft_script
+    assert "udp dport 5353 ip saddr 192.168.1.2 ip daddr 224.0.0.251 notrack" in nft_script
+    assert "udp dport 67 ip saddr 192.168.1.2 ip daddr 255.255.255.255 notrack" in nft_script
+    # Packet counts are tracked by conntrack, and unicast traffic is tracked
+    assert "239.255.255.250 notrack" not in nft_script
+    assert nft_script.count(" notrack\n") == 2
+
+
+def test_translate_hook(tmp_path) -> None:
+    """
+    Test the configurable hook of the base chain,
+    and the rules dropping the traffic sent by the device at netdev ingress.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"tcp": {"dst-port": 23}, "ipv4": {"src": "self", "dst": "10.0.0.1"}}},
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "10.0.0.1", "dst": "self"}}}
+    ]
+
+    # Hook given per call
+    hook = {"family": "netdev", "hook": "ingress", "device": "eth1", "priority": -150}
+    translate_policies(device, policies, output_dir=str(tmp_path), hook=hook)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "table netdev sample-device {" in nft_script
+    assert "type filter hook ingress device eth1 priority -150; policy accept;" in nft_script
+    with pytest.raises(ValueError):
+        translate_policies(device, policies, output_dir=str(tmp_path), hook={"family": "netdev"})
+    with pytest.raises(ValueError):
+        translate_policies(device, policies, output_dir=str(tmp_path), hook={"table": "filter"})
+
+    # Hook given per device
+    translate_policies(dict(device, hook={"hook": "forward"}), policies, output_dir=str(tmp_path))
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "table bridge sample-device {" in nft_script
+    assert "type filter hook forward priority 0; policy accept;" in nft_script
+
+    # Early drop of the traffic sent by the device
+    translate_policies(device, policies, output_dir=str(tmp_path), early_drop="lan0")
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    main_table, early_table = nft_script.split("table netdev sample-device_early {")
+    assert "type filter hook ingress device lan0 priority -500; policy accept;" in early_table
+    assert "tcp dport 23 ip saddr 192.168.1.2 ip daddr 10.0.0.1 drop" in early_table
+    assert "tcp dport 23" not in main_table
+    assert "tcp dport 443" in main_table
+
+
+def test_translate_remove_redundant(tmp_path) -> None:
+    """
+    Test the removal of the rules covered by another rule with the same verdict,
+    e.g. a host rule covered by a subnet rule.
+    """
+    device = {
+        "name": "sample-device",
+        "mac":  "11:22:33:44:55:66",
+        "ipv4": "192.168.1.2"
+    }
+    policies = [
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.1"}}},
+        {"protocols": {"tcp": {"dst-port": 443}, "ipv4": {"src": "self", "dst": "10.0.0.0/24"}}}
+    ]
+    translate_policies(device, policies, output_dir=str(tmp_path), remove_redundant=True)
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert "ip daddr 10.0.0.0/24 drop" in nft_script
+    assert "10.0.0.1" not in nft_script
+
+
+def test_translate_fleet(tmp_path) -> None:
+    """
+    Test the function `translate_fleet` from the package `profile-translator`,
+    which combines multiple device profiles in a single table.
+    """
+    camera_profile = {
+        "device-info": {
+            "name": "camera",
+            "mac": "AA:BB:CC:DD:EE:FF",
+            "ipv4": "192.168.1.150"
+        },
+        "single-policies": {
+            "dns-query": {
+                "protocols": {
+                    "dns": {"qtype": "A", "domain-name": "camera.example.com"},
+                    "udp": {"dst-port": 53},
+                    "ipv4": {"src": "self", "dst": "192.168.1.1"}
+                },
+                "bidirectional": True
+            },
+            "lan-to-phone": {
+                "protocols": {
+                    "tcp": {"dst-port": 554},
+                    "ipv4": {"src": "self", "dst": "192.168.1.222"}
+                },
+                "bidirectional": True
+            }
+        }
+    }
+    camera_path = tmp_path / "camera.yaml"
+    camera_path.write_text(yaml.dump(camera_profile))
+    sample_profile = os.path.join(self_dir, "profile.yaml")
+    translate_fleet([sample_profile, str(camera_path)], output_dir=str(tmp_path))
+
+    nft_script = (tmp_path / "firewall.nft").read_text()
+    assert nft_script.count("table bridge") == 1
+    assert nft_script.count("type filter hook") == 1
+    assert "ether saddr vmap { 50:c7:bf:ed:0a:54 : jump device_tplink_plug, aa:bb:cc:dd:ee:ff : jump device_camera }" in nft_script
+    # Addresses matched by both devices are shared
+    assert "set addr_192_168_1_222 {" in nft_script
+    assert "ip daddr 192.168.1.222" not in nft_script
+    # NFQueue numbers do not collide between devices
+    assert "queue num 20" in nft_script
+    assert (tmp_path / "tplink-plug" / "nfqueues.c").is_file()
+    assert ".queue_id = 20," in (tmp_path / "camera" / "nfqueues.c").read_text()